@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+import time
+import http_client
+import response_cache
+from layer_registry import LAYERS
+
+# Where the lookup is kept between runs, next to the response cache
+LOOKUP_FILE = "nj_lookup.json"
+
+# The lookup is downloaded again once it is older than this; boundaries and codes change very rarely
+LOOKUP_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# The lookup loaded by this process, and the lock that makes sure only one thread downloads it
+_lookup = None
+_lock = threading.Lock()
+
+# Path of the lookup file
+def lookup_path():
+    return os.path.join(response_cache.CACHE_DIR, LOOKUP_FILE)
+
+# Normalize a county or municipality name for comparison: case, underscores and extra spaces are ignored
+def normalize_name(name):
+    return " ".join(str(name or "").replace("_", " ").split()).casefold()
+
+# Normalize a numeric code for comparison: surrounding spaces, leading zeros and a trailing ".0" are ignored
+def normalize_code(code):
+    return str(code or "").strip().removesuffix(".0").lstrip("0")
+
+# Key of a county in the lookup: "County of Atlantic", "Atlantic County" and "atlantic" all give "atlantic"
+def county_key(county_name):
+    name = normalize_name(county_name)
+    return name.removeprefix("county of ").removesuffix(" county").strip()
+
+# Query a boundary layer for attributes only
+def query_attributes(url, params):
+    params = {"outFields": "*", "returnGeometry": "false", "f": "json", **params}
+    return http_client.read_json(http_client.post(f"{url}/query", data=params, verify=False, use_cache=False))
+
+# Download every feature's attributes (no geometry) from a boundary layer. Layers that support pagination are read
+# page by page; paging stops once a page adds no new OBJECTID, so a service that ignores resultOffset cannot keep
+# returning the same page. Other layers are read by object ID, maxRecordCount IDs per request.
+def fetch_attributes(url, out_fields):
+    metadata = http_client.read_json(http_client.get(url, params={"f": "json"}, verify=False, use_cache=False))
+    id_field = metadata.get("objectIdField") or "OBJECTID"
+    features = {}
+    if metadata.get("advancedQueryCapabilities", {}).get("supportsPagination"):
+        while True:
+            data = query_attributes(url, {"where": "1=1", "outFields": out_fields, "resultOffset": len(features)})
+            count = len(features)
+            for feature in data.get("features", []):
+                attributes = feature["attributes"]
+                features.setdefault(attributes.get(id_field, tuple(sorted(attributes.items()))), attributes)
+            if not data.get("exceededTransferLimit") or len(features) == count:
+                return list(features.values())
+
+    object_ids = sorted(query_attributes(url, {"where": "1=1", "returnIdsOnly": "true"}).get("objectIds") or [])
+    batch_size = max(1, int(metadata.get("maxRecordCount") or 1000))
+    for start in range(0, len(object_ids), batch_size):
+        batch = ",".join(str(object_id) for object_id in object_ids[start:start + batch_size])
+        data = query_attributes(url, {"objectIds": batch, "outFields": out_fields})
+        for feature in data.get("features", []):
+            features[feature["attributes"].get(id_field, len(features))] = feature["attributes"]
+    return list(features.values())
+
+# Download the counties (with their GNIS codes) and the municipalities (with their names and counties) from the
+# county and municipality boundary layers
+def fetch_lookup():
+    counties = {}
+    for attributes in fetch_attributes(LAYERS["county"]["url"], "*"):
+        name = str(attributes.get("GNIS_NAME") or attributes.get("COUNTY") or "")
+        if not name:
+            continue
+        name = " ".join(name.split()).removeprefix("County of ").strip()
+        counties[county_key(name)] = {"name": name, "gnis_code": str(attributes.get("GNIS") or "")}
+
+    municipalities = {}
+    for attributes in fetch_attributes(LAYERS["municipality"]["url"], "*"):
+        code = str(attributes.get("MUN_CODE") or attributes.get("SSN") or "").zfill(4)
+        if code == "0000":
+            continue
+        names = [attributes.get(field) for field in ("MUN_LABEL", "NAME", "GNIS_NAME", "MUN")]
+        names = [str(name) for name in names if name]
+        municipalities[code] = {
+            "name": names[0] if names else "",
+            "names": sorted({normalize_name(name) for name in names}),
+            "county": county_key(attributes.get("COUNTY")),
+        }
+    if not counties or not municipalities:
+        raise ValueError("The boundary services returned no counties or municipalities")
+    return {"fetched_at": time.time(), "counties": counties, "municipalities": municipalities}
+
+# Read the lookup file, or None if there is none
+def read_lookup():
+    try:
+        with open(lookup_path()) as lookup_file:
+            return json.load(lookup_file)
+    except (OSError, ValueError):
+        return None
+
+# Write the lookup file, replacing it in one step
+def write_lookup(lookup):
+    os.makedirs(response_cache.CACHE_DIR, exist_ok=True)
+    temporary_path = f"{lookup_path()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w") as lookup_file:
+        json.dump(lookup, lookup_file)
+    os.replace(temporary_path, lookup_path())
+
+# Get the lookup of NJ counties and municipalities: from memory, from the lookup file while it is younger than
+# LOOKUP_TTL_SECONDS, or else from the boundary services. If it cannot be downloaded an outdated lookup is used,
+# and None is returned when there is none at all, so a missing lookup never stops a run.
+def load_lookup(cancel_event=None):
+    global _lookup
+    with _lock:
+        if _lookup is not None and time.time() - _lookup["fetched_at"] < LOOKUP_TTL_SECONDS:
+            return _lookup
+        lookup = read_lookup()
+        if lookup is None or time.time() - lookup.get("fetched_at", 0) >= LOOKUP_TTL_SECONDS:
+            http_client.check_cancelled(cancel_event)
+            try:
+                logging.info("Downloading the list of NJ counties and municipalities...")
+                lookup = fetch_lookup()
+                write_lookup(lookup)
+            except (OSError, ValueError, KeyError) as e:
+                if lookup is None:
+                    logging.warning(f"Could not download the list of NJ counties and municipalities: {e}")
+                    return None
+                logging.warning(f"Could not update the list of NJ counties and municipalities, using the old one: {e}")
+        _lookup = lookup
+        return lookup
+
+# Check a project's county, municipality code, municipality name and GNIS code against the lookup before any layer
+# is downloaded, filling in the county, municipality name and GNIS code from the municipality code when they are
+# blank. Returns (county_name, municipality_name, gnis_code); raises ValueError for any input that does not match.
+# Without a lookup the inputs are returned as they are and the layer queries find any mistake.
+def validate_inputs(county_name, municipality_code, municipality_name, gnis_code, lookup=None):
+    if not str(municipality_code or "").strip():
+        raise ValueError("Error: Please ensure municipality code is correct")
+    if lookup is None:
+        return county_name, municipality_name, gnis_code
+
+    municipality = lookup["municipalities"].get(str(municipality_code).strip())
+    if municipality is None:
+        raise ValueError(
+            f"Error: Please ensure municipality code is correct (there is no municipality {municipality_code})"
+        )
+    county = lookup["counties"].get(municipality["county"])
+
+    if not str(county_name or "").strip():
+        county_name = county["name"] if county is not None else county_name
+    elif county_key(county_name) not in lookup["counties"]:
+        raise ValueError("Error: Please ensure county name is correct")
+    elif county is not None and county_key(county_name) != municipality["county"]:
+        raise ValueError(
+            "Error: Please ensure county name is correct "
+            f"(municipality {municipality_code} is in {county['name']} County)"
+        )
+    else:
+        county_name = lookup["counties"][county_key(county_name)]["name"]
+
+    if not str(municipality_name or "").strip():
+        municipality_name = municipality["name"]
+    elif normalize_name(municipality_name) not in {normalize_name(name) for name in municipality["names"]}:
+        raise ValueError(
+            "Error: Please ensure municipality name and code are correct "
+            f"(municipality {municipality_code} is {municipality['name']})"
+        )
+
+    if county is not None:
+        if not str(gnis_code or "").strip():
+            gnis_code = county["gnis_code"]
+        elif normalize_code(gnis_code) != normalize_code(county["gnis_code"]):
+            raise ValueError(
+                "Error: Please ensure GNIS code is correct "
+                f"(the GNIS code of {county['name']} County is {county['gnis_code']})"
+            )
+        else:
+            gnis_code = county["gnis_code"]
+    return county_name, municipality_name, str(gnis_code or "").strip()
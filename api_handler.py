@@ -1,281 +1,358 @@
-import requests
+import io
 import json
 import logging
+from datetime import datetime, timezone
 import geopandas as gpd
-import urllib.parse
 import pandas as pd
-import os
+from shapely.geometry import mapping
+from shapely.geometry.polygon import orient
+from pyproj import CRS, Transformer
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http_client
+import run_report
+import layer_mirror
+from esri_decoder import GEOMETRY_PARTS, esri_json_to_frame
+from layer_registry import LAYERS, where_clause as layer_where_clause
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Fetch county boundary data
-def fetch_county_boundary(county_name, output_folder, project_number):
-    # Construct the URL for the API request using the county_name variable.
-    url = (f"https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/1/query"
-           f"?where=GNIS_NAME+%3D+%27County+of+{county_name}%27&text=&objectIds=&time=&timeRelation=esriTimeRelationOverlaps"
-           "&geometry=&geometryType=esriGeometryPolygon&inSR=&spatialRel=esriSpatialRelIntersects&distance=&units=esriSRUnit_Foot"
-           "&relationParam=&outFields=*&returnGeometry=true&returnTrueCurves=false&maxAllowableOffset=&geometryPrecision=&outSR="
-           "&havingClause=&returnIdsOnly=false&returnCountOnly=false&orderByFields=&groupByFieldsForStatistics=&outStatistics="
-           "&returnZ=false&returnM=false&gdbVersion=&historicMoment=&returnDistinctValues=false&resultOffset=&resultRecordCount="
-           "&returnExtentOnly=false&sqlFormat=none&datumTransformation=&parameterValues=&rangeValues=&quantizationParameters="
-           "&featureEncoding=esriDefault&f=geojson")
-
-    # Send the request
-    response = requests.get(url, verify=False)
-    response.raise_for_status()  # Raise an error if the request failed
-    data = response.json()
-
-    # Check if features were returned
-    if not data['features']:
-        print("No features found for the specified query.")
-        print("Response data:", data)
-        return
-
-    # Convert the response data to a GeoDataFrame
-    gdf = gpd.GeoDataFrame.from_features(data['features'])
-
-    # Set the geometry column if it exists
-    if 'geometry' in gdf:
-        gdf.set_geometry('geometry', inplace=True)
-
-    # Set the coordinate reference system to 4326
-    gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    output_folder = os.path.join(output_folder, f"County_Boundary_{project_number}")
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    output_filename = f"County_of_{county_name}_Boundary_{project_number}.shp"
-    output_path = os.path.join(output_folder, output_filename)
-    gdf.to_file(output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {output_path}")
-    return output_path
+# Maximum number of OBJECTID-range chunk requests sent to a server at the same time
+MAX_CONCURRENT_REQUESTS = 4
+
+# Spatial reference (EPSG code) the servers are asked to return features in, unless a run asks for another one
+DEFAULT_OUT_SR = 4326
+
+# Per CRS unit: coordinate decimals requested with geometryPrecision (about 1 cm), the maxAllowableOffset used
+# to generalize context layers (about 1 m), and the cell size of the quantization grid (about 1 cm)
+COORDINATE_PRECISION = {"degree": 7, "foot": 2, "metre": 2}
+GENERALIZATION_OFFSET = {"degree": 0.00001, "foot": 3, "metre": 1}
+QUANTIZATION_TOLERANCE = {"degree": 1e-7, "foot": 0.03, "metre": 0.01}
+
+# Tolerance (in degrees, roughly 50 m) used to generalize a boundary before sending it as a query geometry
+SPATIAL_FILTER_TOLERANCE = 0.0005
+
+# Encoding requested for OBJECTID-range chunks: quantized Esri JSON is much smaller than GeoJSON and is decoded
+# in bulk; layers that do not support it (and any chunk the server rejects) fall back to GeoJSON
+PREFERRED_ENCODING = "quantized-json"
+
+# Area covered by the quantization grid for quantized Esri JSON: New Jersey, in WGS84
+QUANTIZATION_EXTENT = (-75.7, 38.8, -73.8, 41.4)
+
+# How many times an envelope query is split into quadrants while the server keeps truncating the response
+MAX_SPLIT_DEPTH = 6
+
+# Report a layer's download progress to the caller, if a progress callback was given
+def report_progress(progress, layer_name, chunks_done, chunks_total, features, bytes_received):
+    run_report.record_features_fetched(features)
+    if progress is not None:
+        progress(layer_name, chunks_done, chunks_total, features, bytes_received)
+
+# Get the unit of a spatial reference's coordinates: degree, foot or metre
+def crs_unit(out_sr):
+    unit = CRS.from_epsg(out_sr).axis_info[0].unit_name.lower()
+    if "degree" in unit:
+        return "degree"
+    if "foot" in unit or "feet" in unit:
+        return "foot"
+    return "metre"
+
+# Query parameters asking the server to project features to out_sr and round their coordinates.
+# With generalize=True the geometries are also simplified by about a metre, which suits context layers.
+def build_output_params(out_sr=DEFAULT_OUT_SR, generalize=False):
+    unit = crs_unit(out_sr)
+    params = {"outSR": str(out_sr), "geometryPrecision": str(COORDINATE_PRECISION[unit])}
+    if generalize:
+        params["maxAllowableOffset"] = str(GENERALIZATION_OFFSET[unit])
+    return params
+
+# Set the CRS of a frame decoded from GeoJSON. ArcGIS names the CRS in the response when it honors outSR;
+# when it does not, the coordinates are WGS84 and are projected later by geo_processor.reproject_layer.
+def set_response_crs(gdf, data=None, out_sr=DEFAULT_OUT_SR):
+    crs = gdf.crs
+    if data is not None and data.get("crs"):
+        crs = data["crs"].get("properties", {}).get("name")
+    if crs is None:
+        crs = "EPSG:4326"
+    # Projected coordinates labelled as WGS84 can only mean the server projected them without saying so
+    if CRS.from_user_input(crs).is_geographic and len(gdf) and abs(gdf.total_bounds).max() > 360:
+        crs = f"EPSG:{out_sr}"
+    return gdf.set_crs(crs, allow_override=True)
+
+# Build query parameters that limit a query to features intersecting the boundary.
+# The boundary is generalized so the request stays small; it is buffered by the same tolerance first, so the
+# generalized polygon still covers the whole boundary and no candidate features are missed.
+def build_polygon_filter(boundary_gdf, tolerance=SPATIAL_FILTER_TOLERANCE):
+    boundary = boundary_gdf.to_crs("EPSG:4326").union_all()
+    generalized = boundary.buffer(tolerance).simplify(tolerance)
+    polygons = getattr(generalized, "geoms", [generalized])
+
+    # Esri polygons list outer rings clockwise; holes are left out since the filter only needs to cover the boundary
+    rings = [mapping(orient(polygon, sign=-1.0))["coordinates"][0] for polygon in polygons]
+    rings = [[[round(x, 6), round(y, 6)] for x, y in ring] for ring in rings]
+    geometry = {"rings": rings, "spatialReference": {"wkid": 4326}}
+    return {
+        "geometry": json.dumps(geometry),
+        "geometryType": "esriGeometryPolygon",
+        "inSR": "4326",
+        "spatialRel": "esriSpatialRelIntersects",
+    }
 
-# Fetch parcels data
-def fetch_parcels(municipality_code, output_folder, project_number):
-    url = "https://services2.arcgis.com/XVOqAjTOJ5P6ngMu/ArcGIS/rest/services/Hosted_Parcels_Test_WebMer_20201016/FeatureServer/0"
-    where_clause = f"PCL_MUN='{municipality_code}'"
-    fields = "*"
-
-    # Initial request to get max record count
-    urlstring = url + "?f=json"
-    response = requests.get(urlstring)
-    response.raise_for_status()
-    data = response.json()
-    max_record_count = int(data["maxRecordCount"])
-
-    # Request to get all object IDs
-    encoded_where_clause = urllib.parse.quote(where_clause)
-    urlstring = f"{url}/query?where={encoded_where_clause}&returnIdsOnly=true&f=json"
-    response = requests.get(urlstring)
-    response.raise_for_status()
-    data = response.json()
+# Send a query request. Queries with a spatial filter or a list of object IDs are posted since the geometry or
+# the list can be too long for a URL. With use_cache=False the response cache is bypassed.
+def send_query(url, params, spatial_filter=None, cancel_event=None, verify=True, use_cache=True):
+    if spatial_filter or "objectIds" in params:
+        return http_client.post(
+            f"{url}/query", data={**params, **(spatial_filter or {})}, verify=verify, cancel_event=cancel_event,
+            use_cache=use_cache
+        )
+    return http_client.get(f"{url}/query", params=params, verify=verify, cancel_event=cancel_event, use_cache=use_cache)
+
+# Request the max record count, object ID field and sorted object IDs matching the where clause,
+# along with the layer metadata
+def fetch_object_ids(url, where_clause, cancel_event=None, spatial_filter=None, use_cache=True):
+    metadata = http_client.read_json(
+        http_client.get(url, params={"f": "json"}, cancel_event=cancel_event, use_cache=use_cache)
+    )
+    max_record_count = int(metadata["maxRecordCount"])
+
+    params = {"where": where_clause, "returnIdsOnly": "true", "f": "json"}
+    data = http_client.read_json(send_query(url, params, spatial_filter, cancel_event, use_cache=use_cache))
     id_field = data["objectIdFieldName"]
-    id_list = data["objectIds"]
-    id_list.sort()
-    num_records = len(id_list)
-
-    # Fetch features in chunks based on max record count (workaround to 2000 item request limit)
-    feature_list = []
-    for i in range(0, num_records, max_record_count):
-        to_record = i + (max_record_count - 1)
-        if to_record > num_records:
-            to_record = num_records - 1
-        from_id = id_list[i]
-        to_id = id_list[to_record]
-        where = f"{id_field}>={from_id} AND {id_field}<={to_id} AND {where_clause}"
-        encoded_where = urllib.parse.quote(where)
-        urlstring = f"{url}/query?where={encoded_where}&returnGeometry=true&outFields={fields}&f=geojson"
-        response = requests.get(urlstring)
-        response.raise_for_status()
-        data = response.json()
-        gdf = gpd.GeoDataFrame.from_features(data['features'])
-        feature_list.append(gdf)
-
-    # Concatenate all GeoDataFrames and set CRS
-    final_gdf = pd.concat(feature_list, ignore_index=True)
-    final_gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    output_folder = os.path.join(output_folder, f"Parcels_{project_number}")
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    output_filename = f"Parcels_{project_number}.shp"
-    output_path = os.path.join(output_folder, output_filename)
-    final_gdf.to_file(output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {output_path}")
-    return output_path
-
-# Fetch roads
-def fetch_roads(gnis_code, output_folder, project_number):
-    url = "https://maps.nj.gov/arcgis/rest/services/Framework/Transportation/MapServer/14"
-    where_clause = f"COUNTY_L='{gnis_code}'"
-    fields = "*"
-    urlstring = url + "?f=json"
-    response = requests.get(urlstring)
-    data = response.json()
-    max_record_count = int(data["maxRecordCount"])
-
-    # Request to get all object IDs
-    encoded_where_clause = urllib.parse.quote(where_clause)
-    urlstring = f"{url}/query?where={encoded_where_clause}&returnIdsOnly=true&f=json"
-    response = requests.get(urlstring)
-    data = response.json()
-    id_field = data["objectIdFieldName"]
-    id_list = data["objectIds"]
-    id_list.sort()
-    num_records = len(id_list)
-
-    # Fetch features in chunks based on max record count (workaround to 2000 item request limit)
-    feature_list = []
-    for i in range(0, num_records, max_record_count):
-        to_record = i + (max_record_count - 1)
-        if to_record > num_records:
-            to_record = num_records - 1
-        from_id = id_list[i]
-        to_id = id_list[to_record]
-        where = f"{id_field}>={from_id} AND {id_field}<={to_id} AND {where_clause}"
-        encoded_where = urllib.parse.quote(where)
-        urlstring = f"{url}/query?where={encoded_where}&returnGeometry=true&outFields={fields}&f=geojson"
-        response = requests.get(urlstring)
-        data = response.json()
-        gdf = gpd.GeoDataFrame.from_features(data['features'])
-        feature_list.append(gdf)
-
-    # Concatenate all GeoDataFrames and set CRS
-    final_gdf = pd.concat(feature_list, ignore_index=True)
-    final_gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    output_folder = os.path.join(output_folder, f"Roads_{project_number}")
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    output_filename = f"Roads_{project_number}.shp"
-    output_path = os.path.join(output_folder, output_filename)
-    final_gdf.to_file(output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {output_path}")
-    return output_path
-
-# Fetch municipality boundary data
-def fetch_municipality_boundary(municipality_code, output_folder, municipality_name, project_number):
-    url = (f"https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/2/query"
-           f"?where=MUN_CODE+%3D+%27{municipality_code}%27&text=&objectIds=&time=&timeRelation=esriTimeRelationOverlaps"
-           "&geometry=&geometryType=esriGeometryPolygon&inSR=&spatialRel=esriSpatialRelIntersects&distance=&units=esriSRUnit_Foot"
-           "&relationParam=&outFields=*&returnGeometry=true&returnTrueCurves=false&maxAllowableOffset=&geometryPrecision=&outSR="
-           "&havingClause=&returnIdsOnly=false&returnCountOnly=false&orderByFields=&groupByFieldsForStatistics=&outStatistics="
-           "&returnZ=false&returnM=false&gdbVersion=&historicMoment=&returnDistinctValues=false&resultOffset=&resultRecordCount="
-           "&returnExtentOnly=false&sqlFormat=none&datumTransformation=&parameterValues=&rangeValues=&quantizationParameters="
-           "&featureEncoding=esriDefault&f=geojson")
-
-    # Send the API request
-    response = requests.get(url, verify=False)
-    response.raise_for_status()  # Raise an error if the request failed
-    data = response.json()
-
-    # Check if features were returned
-    if not data['features']:
-        print("No features found for the specified query.")
-        print("Response data:", data)
-        return
-
-    # Convert the response data to a GeoDataFrame
-    gdf = gpd.GeoDataFrame.from_features(data['features'])
-
-    # Set the geometry column if it exists
-    if 'geometry' in gdf:
-        gdf.set_geometry('geometry', inplace=True)
-
-    # Set the coordinate reference system to 4326
-    gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    output_folder = os.path.join(output_folder, f"Municipality_Boundary_{project_number}")
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    sanitized_municipality_name = municipality_name.replace(" ", "_")
-    output_filename = f"{sanitized_municipality_name}_Boundary_{project_number}.shp"
-    output_path = os.path.join(output_folder, output_filename)
-    gdf.to_file(output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {output_path}")
-    return output_path
-
-# Fetch wetlands data within municipal_boundary bounding box
-def fetch_wetlands_within_boundary(boundary_gdf, output_folder, project_number):
-    url = "https://mapsdep.nj.gov/arcgis/rest/services/Features/Land_lu/MapServer/2/query"
-
-    # Define the bounding box for the query
-    bounds = boundary_gdf.total_bounds
-    bbox = {
-        "xmin": bounds[0],
-        "ymin": bounds[1],
-        "xmax": bounds[2],
-        "ymax": bounds[3],
-        "spatialReference": {"wkid": 4326}
+    id_list = sorted(data["objectIds"] or [])
+    return max_record_count, id_field, id_list, metadata
+
+# Pick the encoding for a layer's chunk requests from what its metadata says the server supports
+def choose_encoding(metadata):
+    if PREFERRED_ENCODING == "quantized-json" and \
+            metadata.get("advancedQueryCapabilities", {}).get("supportsCoordinatesQuantization") and \
+            "JSON" in metadata.get("supportedQueryFormats", "").upper() and \
+            metadata.get("geometryType") in GEOMETRY_PARTS:
+        return "quantized-json"
+    return "geojson"
+
+# Query parameters asking for quantized Esri JSON in out_sr
+def build_quantization_params(out_sr=DEFAULT_OUT_SR):
+    transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{out_sr}", always_xy=True)
+    xmin, ymin, xmax, ymax = transformer.transform_bounds(*QUANTIZATION_EXTENT)
+    quantization = {
+        "mode": "edit",
+        "originPosition": "upperLeft",
+        "tolerance": QUANTIZATION_TOLERANCE[crs_unit(out_sr)],
+        "extent": {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax, "spatialReference": {"wkid": out_sr}},
     }
-
-    # Define the parameters for the API request
+    return {"f": "json", "outSR": str(out_sr), "quantizationParameters": json.dumps(quantization)}
+
+# Split the sorted object IDs into (from_id, to_id) ranges of at most max_record_count features
+def build_id_ranges(id_list, max_record_count):
+    id_ranges = []
+    for i in range(0, len(id_list), max_record_count):
+        chunk = id_list[i:i + max_record_count]
+        id_ranges.append((chunk[0], chunk[-1]))
+    return id_ranges
+
+# Convert a GeoJSON response body to a GeoDataFrame.
+# With pyogrio the body is parsed by GDAL and the geometry and attribute columns are built in bulk (through Arrow
+# when pyarrow is installed), without creating a Python dictionary and shapely object per feature on the way.
+# Without pyogrio the features are converted one at a time.
+def geojson_to_frame(response):
+    http_client.raise_for_arcgis_error(response)
+    try:
+        import pyogrio
+    except ImportError:
+        return gpd.GeoDataFrame.from_features(response.json()['features'])
+    try:
+        import pyarrow  # noqa: F401
+        use_arrow = True
+    except ImportError:
+        use_arrow = False
+    return pyogrio.read_dataframe(io.BytesIO(response.content), use_arrow=use_arrow)
+
+# Fetch the features of a single OBJECTID range as a GeoDataFrame, along with the response size in bytes.
+# With object_ids, only those features of the range are fetched.
+def fetch_id_range(url, where_clause, fields, id_field, from_id, to_id, cancel_event=None, spatial_filter=None,
+                   encoding="geojson", out_sr=DEFAULT_OUT_SR, object_ids=None, use_cache=True):
+    where = f"{id_field}>={from_id} AND {id_field}<={to_id} AND {where_clause}"
     params = {
-        "where": "1=1",
-        "geometryType": "esriGeometryEnvelope",
-        "spatialRel": "esriSpatialRelIntersects",
-        "geometry": json.dumps(bbox),
-        "outFields": "*",
-        "returnGeometry": "true",
-        "f": "geojson"
+        "where": where, "returnGeometry": "true", "outFields": fields, "f": "geojson", **build_output_params(out_sr)
     }
-
-    # Send the API request
-    response = requests.post(url, data=params, verify=False)
-    response.raise_for_status()  # Raise an error if the request failed
-    data = response.json()
-
-    # Check if features were returned
-    if not data['features']:
-        print("No features found for the specified query.")
-        print("Response data:", data)
+    if object_ids is not None:
+        params["objectIds"] = ",".join(str(object_id) for object_id in object_ids)
+    if encoding == "quantized-json":
+        try:
+            response = send_query(
+                url, {**params, **build_quantization_params(out_sr)}, spatial_filter, cancel_event, use_cache=use_cache
+            )
+            with run_report.timed("decode"):
+                return esri_json_to_frame(http_client.read_json(response)), len(response.content)
+        except (http_client.ArcGISError, ValueError, KeyError, IndexError, TypeError) as e:
+            logging.warning(f"Quantized JSON request to {url} failed ({e}), falling back to GeoJSON")
+    response = send_query(url, params, spatial_filter, cancel_event, use_cache=use_cache)
+    with run_report.timed("decode"):
+        return set_response_crs(geojson_to_frame(response), out_sr=out_sr), len(response.content)
+
+# Fetch every OBJECTID range in parallel (bounded by max_workers) and return the chunks in ID order.
+# With a run journal, chunks staged by an earlier attempt are reused and each new chunk is staged as it completes.
+# id_groups optionally lists the object IDs to fetch from each range, when only some of them are wanted.
+def fetch_chunks_concurrently(url, where_clause, fields, id_field, id_ranges, max_workers=MAX_CONCURRENT_REQUESTS,
+                              layer_name=None, progress=None, cancel_event=None, spatial_filter=None,
+                              encoding="geojson", out_sr=DEFAULT_OUT_SR, journal=None, id_groups=None,
+                              use_cache=True):
+    chunks = [None] * len(id_ranges)
+    if journal is not None:
+        for index, (from_id, to_id) in enumerate(id_ranges):
+            chunks[index] = journal.chunk(layer_name, from_id, to_id)
+    chunks_done = sum(1 for chunk in chunks if chunk is not None)
+    features = sum(len(chunk) for chunk in chunks if chunk is not None)
+    bytes_received = 0
+    if chunks_done:
+        logging.info(f"{layer_name}: {chunks_done} of {len(id_ranges)} chunks were staged by the last run")
+        report_progress(progress, layer_name, chunks_done, len(id_ranges), features, bytes_received)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            run_report.submit(
+                executor, fetch_id_range, url, where_clause, fields, id_field, from_id, to_id, cancel_event, spatial_filter,
+                encoding, out_sr, id_groups[index] if id_groups is not None else None, use_cache
+            ): index
+            for index, (from_id, to_id) in enumerate(id_ranges)
+            if chunks[index] is None
+        }
+        try:
+            for future in as_completed(futures):
+                gdf, size = future.result()
+                index = futures[future]
+                if journal is not None:
+                    journal.stage_chunk(layer_name, *id_ranges[index], gdf)
+                chunks[index] = gdf
+                chunks_done += 1
+                features += len(gdf)
+                bytes_received += size
+                report_progress(progress, layer_name, chunks_done, len(id_ranges), features, bytes_received)
+        except Exception:
+            # Stop the chunks that have not started yet before re-raising. Chunks already downloading are still
+            # staged if they succeed, so a resumed run does not fetch them again.
+            for future in futures:
+                future.cancel()
+            if journal is not None:
+                for future, index in futures.items():
+                    if chunks[index] is None and not future.cancelled() and future.exception() is None:
+                        try:
+                            journal.stage_chunk(layer_name, *id_ranges[index], future.result()[0])
+                        except OSError as e:
+                            logging.warning(f"{layer_name}: could not stage a chunk for resuming ({e})")
+            raise
+    return chunks
+
+# Check whether a layer fetched by an earlier run can be refreshed in place: it must have been fetched with the
+# same query and output CRS, and still have its object ID column
+def can_refresh(previous, fetch_info):
+    previous_info = previous.attrs.get("fetch") if previous is not None else None
+    if not previous_info:
+        return False
+    same_query = all(previous_info.get(key) == fetch_info[key] for key in ("url", "where", "spatial_filter", "out_sr"))
+    return same_query and fetch_info["id_field"] in previous
+
+# Update a layer fetched by an earlier run: features added since then and features edited after its lastEditDate
+# (when the layer has an edit date field) are fetched, deleted ones are dropped and the rest are kept as they are.
+# metadata and id_list must come straight from the server, and every request made here bypasses the response
+# cache, since a cached answer could hide the very edits the refresh is looking for.
+def refresh_chunks(url, where_clause, fields, id_field, id_list, max_record_count, metadata, previous,
+                   max_workers=MAX_CONCURRENT_REQUESTS, layer_name=None, progress=None, cancel_event=None,
+                   spatial_filter=None, encoding="geojson", out_sr=DEFAULT_OUT_SR, journal=None):
+    last_edit_date = previous.attrs["fetch"]["last_edit_date"]
+    if last_edit_date is not None and metadata.get("editingInfo", {}).get("lastEditDate") == last_edit_date:
+        logging.info(f"{layer_name}: unchanged since the last run")
+        report_progress(progress, layer_name, 0, 0, len(previous), 0)
+        return previous
+
+    previous_ids = set(previous[id_field])
+    changed_ids = set()
+    edit_date_field = (metadata.get("editFieldsInfo") or {}).get("editDateField")
+    if edit_date_field and last_edit_date is not None:
+        since = datetime.fromtimestamp(last_edit_date / 1000, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        params = {
+            "where": f"({where_clause}) AND {edit_date_field} >= timestamp '{since}'",
+            "returnIdsOnly": "true",
+            "f": "json",
+        }
+        data = http_client.read_json(send_query(url, params, spatial_filter, cancel_event, use_cache=False))
+        changed_ids = set(data["objectIds"] or []) & previous_ids
+    else:
+        logging.warning(f"{layer_name}: the layer has no edit dates, only added and deleted features are refreshed")
+    deleted_ids = previous_ids - set(id_list)
+    fetch_ids = sorted((set(id_list) - previous_ids) | changed_ids)
+    logging.info(
+        f"{layer_name}: {len(fetch_ids) - len(changed_ids)} features added, {len(changed_ids)} changed and "
+        f"{len(deleted_ids)} deleted since the last run"
+    )
+
+    # Fetch the added and changed features by object ID, in chunks of the max record count
+    id_groups = [fetch_ids[i:i + max_record_count] for i in range(0, len(fetch_ids), max_record_count)]
+    feature_list = fetch_chunks_concurrently(
+        url, where_clause, fields, id_field, [(group[0], group[-1]) for group in id_groups], max_workers,
+        layer_name, progress, cancel_event, spatial_filter, encoding, out_sr, journal, id_groups, use_cache=False
+    )
+    kept = previous[~previous[id_field].isin(deleted_ids | changed_ids)]
+    return pd.concat([kept, *feature_list], ignore_index=True).sort_values(id_field, ignore_index=True)
+
+# Fetch every feature matching the where clause (and the spatial filter, if any) in parallel OBJECTID chunks.
+# With previous, the layer as fetched by an earlier run, only the changes since then are fetched when possible.
+# The query details are kept in the frame's attrs["fetch"] so the layer can be refreshed later.
+# With use_cache=False, or when refreshing previous, no request is answered from the response cache.
+def fetch_chunked_layer(url, where_clause, layer_name, max_workers=MAX_CONCURRENT_REQUESTS, progress=None,
+                        cancel_event=None, spatial_filter=None, out_sr=DEFAULT_OUT_SR, journal=None, previous=None,
+                        fields="*", use_cache=True):
+    use_cache = use_cache and previous is None
+
+    # Request the max record count and all object IDs
+    max_record_count, id_field, id_list, metadata = fetch_object_ids(
+        url, where_clause, cancel_event, spatial_filter, use_cache
+    )
+    if not id_list:
         return None
+    fetch_info = {
+        "url": url,
+        "where": where_clause,
+        "spatial_filter": spatial_filter,
+        "out_sr": out_sr,
+        "id_field": id_field,
+        "last_edit_date": metadata.get("editingInfo", {}).get("lastEditDate"),
+    }
 
-    # Convert the response data to a GeoDataFrame
-    wetlands_gdf = gpd.GeoDataFrame.from_features(data['features'])
-    wetlands_gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    wetlands_output_folder = os.path.join(output_folder, f"Wetlands_{project_number}")
-    if not os.path.exists(wetlands_output_folder):
-        os.makedirs(wetlands_output_folder)
-
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    wetlands_output_filename = f"Wetlands_{project_number}.shp"
-    wetlands_output_path = os.path.join(wetlands_output_folder, wetlands_output_filename)
-    wetlands_gdf.to_file(wetlands_output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {wetlands_output_path}")
-    return wetlands_output_path
-
-# Fetch neighboring municipalities data using municipal_boundary bounding box
-def fetch_neighboring_municipalities(boundary_gdf, output_folder, project_number):
-    url = "https://services2.arcgis.com/XVOqAjTOJ5P6ngMu/ArcGIS/rest/services/NJ_Municipal_Boundaries_3424/FeatureServer/0/query"
-
-    # Define the bounding box for the query
-    bounds = boundary_gdf.total_bounds
+    if can_refresh(previous, fetch_info):
+        final_gdf = refresh_chunks(
+            url, where_clause, fields, id_field, id_list, max_record_count, metadata, previous, max_workers,
+            layer_name, progress, cancel_event, spatial_filter, choose_encoding(metadata), out_sr, journal
+        )
+    else:
+        if previous is not None:
+            logging.info(f"{layer_name}: the last run used a different query, fetching the whole layer")
+        # Fetch features in parallel chunks based on max record count (workaround to 2000 item request limit)
+        id_ranges = build_id_ranges(id_list, max_record_count)
+        feature_list = fetch_chunks_concurrently(
+            url, where_clause, fields, id_field, id_ranges, max_workers, layer_name, progress, cancel_event,
+            spatial_filter, encoding=choose_encoding(metadata), out_sr=out_sr, journal=journal, use_cache=use_cache
+        )
+
+        # Concatenate all GeoDataFrames (releasing the chunks as soon as they are combined); each chunk has its CRS
+        final_gdf = pd.concat(feature_list, ignore_index=True)
+        del feature_list
+    if final_gdf.crs is None:
+        final_gdf.set_crs(f"EPSG:{out_sr}", inplace=True)
+    final_gdf.attrs["fetch"] = fetch_info
+    return final_gdf
+
+# Build the query parameters for an envelope (bounding box) query
+def build_envelope_params(bounds, wkid=4326):
     bbox = {
         "xmin": bounds[0],
         "ymin": bounds[1],
         "xmax": bounds[2],
         "ymax": bounds[3],
-        "spatialReference": {"wkid": 4326}
+        "spatialReference": {"wkid": wkid}
     }
-
-    # Define the parameters for the API request
-    params = {
+    return {
         "where": "1=1",
         "geometryType": "esriGeometryEnvelope",
         "spatialRel": "esriSpatialRelIntersects",
@@ -285,81 +362,236 @@ def fetch_neighboring_municipalities(boundary_gdf, output_folder, project_number
         "f": "geojson"
     }
 
-    # Send the API request
-    response = requests.post(url, data=params, verify=False)
-    response.raise_for_status()  # Raise an error if the request failed
-    data = response.json()
-
-    # Check if features were returned
-    if not data['features']:
-        print("No features found for the specified query.")
-        print("Response data:", data)
+# Check whether the server left features out of a response because of its transfer limit
+def exceeded_transfer_limit(data):
+    return bool(data.get("exceededTransferLimit") or data.get("properties", {}).get("exceededTransferLimit"))
+
+# Send an envelope query and return its features, whether the transfer limit was hit and the response size
+def query_envelope(url, bounds, cancel_event=None, extra_params=None, wkid=4326, query_params=None):
+    params = {**build_envelope_params(bounds, wkid), **(query_params or {}), **(extra_params or {})}
+    response = http_client.post(f"{url}/query", data=params, verify=False, cancel_event=cancel_event)  # Raises an error if the request failed after retrying
+    data = http_client.read_json(response)
+    return data["features"], exceeded_transfer_limit(data), len(response.content)
+
+# Split an envelope into its four quadrants
+def split_envelope(bounds):
+    xmin, ymin, xmax, ymax = bounds
+    xmid = (xmin + xmax) / 2
+    ymid = (ymin + ymax) / 2
+    return [(xmin, ymin, xmid, ymid), (xmid, ymin, xmax, ymid), (xmin, ymid, xmid, ymax), (xmid, ymid, xmax, ymax)]
+
+# Remove features returned more than once (by paging or by neighboring quadrants), keyed on OBJECTID
+def drop_duplicate_features(features, id_field="OBJECTID"):
+    unique = {}
+    for feature in features:
+        feature_id = feature.get("id", feature.get("properties", {}).get(id_field))
+        unique[feature_id if feature_id is not None else id(feature)] = feature
+    return list(unique.values())
+
+# Page through an envelope query with resultOffset/resultRecordCount, fetching the pages in parallel
+def page_envelope(url, bounds, metadata, layer_name=None, progress=None, cancel_event=None, wkid=4326,
+                  query_params=None):
+    count_params = {"returnCountOnly": "true", "f": "json"}
+    response = http_client.post(
+        f"{url}/query", data={**build_envelope_params(bounds, wkid), **(query_params or {}), **count_params},
+        verify=False, cancel_event=cancel_event
+    )
+    count = http_client.read_json(response)["count"]
+    page_size = int(metadata["maxRecordCount"])
+    order_field = metadata.get("objectIdField", "OBJECTID")
+    offsets = list(range(0, count, page_size))
+
+    features = []
+    bytes_received = 0
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = [
+            run_report.submit(
+                executor, query_envelope, url, bounds, cancel_event,
+                {"resultOffset": offset, "resultRecordCount": page_size, "orderByFields": order_field},
+                wkid, query_params,
+            )
+            for offset in offsets
+        ]
+        try:
+            for pages_done, future in enumerate(as_completed(futures), start=1):
+                page, _, size = future.result()
+                features.extend(page)
+                bytes_received += size
+                report_progress(progress, layer_name, pages_done, len(offsets), len(features), bytes_received)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    return drop_duplicate_features(features, order_field)
+
+# Split an envelope into quadrants until every quadrant fits within the transfer limit.
+# Each round of quadrants is fetched in parallel; quadrants that are still truncated are split again.
+def split_envelope_query(url, bounds, layer_name=None, progress=None, cancel_event=None, wkid=4326,
+                         query_params=None):
+    features = []
+    bytes_received = 0
+    requests_done = 0
+    requests_total = 0
+    envelopes = split_envelope(bounds)
+    for depth in range(1, MAX_SPLIT_DEPTH + 1):
+        truncated = []
+        requests_total += len(envelopes)
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            futures = {
+                run_report.submit(executor, query_envelope, url, envelope, cancel_event, None, wkid, query_params):
+                    envelope
+                for envelope in envelopes
+            }
+            try:
+                for future in as_completed(futures):
+                    quadrant_features, exceeded, size = future.result()
+                    features.extend(quadrant_features)
+                    bytes_received += size
+                    requests_done += 1
+                    if exceeded:
+                        truncated.append(futures[future])
+                    report_progress(progress, layer_name, requests_done, requests_total, len(features), bytes_received)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        if not truncated:
+            break
+        if depth == MAX_SPLIT_DEPTH:
+            logging.warning(f"{layer_name}: {len(truncated)} areas still exceed the transfer limit, data may be incomplete")
+            break
+        envelopes = [quadrant for envelope in truncated for quadrant in split_envelope(envelope)]
+    return drop_duplicate_features(features)
+
+# Fetch every feature intersecting the bounding box. If the server truncates the response at its transfer limit,
+# the query is paged when the layer supports pagination and split into quadrants otherwise.
+# The bounds are in the spatial reference wkid; query_params are added to every request (for example the where
+# clause, the fields, and the spatial reference and precision returned).
+def fetch_envelope_features(url, bounds, layer_name=None, progress=None, cancel_event=None, wkid=4326,
+                            query_params=None):
+    features, exceeded, size = query_envelope(url, bounds, cancel_event, None, wkid, query_params)
+    if not exceeded:
+        report_progress(progress, layer_name, 1, 1, len(features), size)
+        return features
+
+    logging.info(f"{layer_name}: response exceeded the transfer limit, fetching the remaining features...")
+    metadata = http_client.read_json(http_client.get(url, params={"f": "json"}, verify=False, cancel_event=cancel_event))
+    if metadata.get("advancedQueryCapabilities", {}).get("supportsPagination"):
+        return page_envelope(url, bounds, metadata, layer_name, progress, cancel_event, wkid, query_params)
+    return split_envelope_query(url, bounds, layer_name, progress, cancel_event, wkid, query_params)
+
+# Fetch the features of a layer matching the where clause and intersecting a boundary's bounding box as a
+# GeoDataFrame in out_sr
+def fetch_boundary_envelope(url, boundary_gdf, layer_name, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR,
+                            generalize=False, where_clause="1=1", fields="*"):
+    wkid = boundary_gdf.crs.to_epsg() if boundary_gdf.crs is not None else 4326
+    query_params = {"where": where_clause, "outFields": fields, **build_output_params(out_sr, generalize)}
+    features = fetch_envelope_features(
+        url, boundary_gdf.total_bounds, layer_name, progress, cancel_event, wkid or 4326, query_params
+    )
+    if not features:
         return None
+    return set_response_crs(gpd.GeoDataFrame.from_features(features), out_sr=out_sr)
 
-    # Convert the response data to a GeoDataFrame
-    neighboring_gdf = gpd.GeoDataFrame.from_features(data['features'])
-    neighboring_gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    neighboring_output_folder = os.path.join(output_folder, f"Neighboring_Municipalities_{project_number}")
-    if not os.path.exists(neighboring_output_folder):
-        os.makedirs(neighboring_output_folder)
 
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    neighboring_output_filename = f"Neighboring_Municipalities_{project_number}.shp"
-    neighboring_output_path = os.path.join(neighboring_output_folder, neighboring_output_filename)
-    neighboring_gdf.to_file(neighboring_output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {neighboring_output_path}")
-    return neighboring_output_path
+# Fetch a layer with a single where query as a GeoDataFrame in out_sr. Small layers such as boundaries fit in one
+# response; if the server truncates it at its transfer limit, the layer is fetched in OBJECTID chunks instead.
+def fetch_where_layer(url, where_clause, layer_name, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR,
+                      fields="*"):
+    params = {
+        "where": where_clause, "outFields": fields, "returnGeometry": "true", "f": "geojson",
+        **build_output_params(out_sr),
+    }
+    response = send_query(url, params, cancel_event=cancel_event, verify=False)
+    data = http_client.read_json(response)
+    if exceeded_transfer_limit(data):
+        logging.info(f"{layer_name}: response exceeded the transfer limit, fetching the layer in chunks...")
+        return fetch_chunked_layer(
+            url, where_clause, layer_name, progress=progress, cancel_event=cancel_event, out_sr=out_sr, fields=fields
+        )
+    if not data["features"]:
+        return None
+    gdf = gpd.GeoDataFrame.from_features(data["features"])
+    report_progress(progress, layer_name, 1, 1, len(gdf), len(response.content))
+
+    # Set the coordinate reference system the server returned
+    return set_response_crs(gdf, data, out_sr)
+
+# Fetch a layer of the registry (see layer_registry.LAYERS) for a project's inputs, e.g. {"municipality_code": "0102"}.
+# Layers with a "boundary" filter only return the features intersecting boundary_gdf when it is given, and layers
+# with an "envelope" filter the features intersecting its bounding box. journal and previous apply to chunked
+# layers, and generalize to layers the server may simplify. With use_mirror a mirrored layer is read from its
+# partition in the local mirror when it has been synced, without any request. With use_cache=False a chunked layer
+# is fetched without the response cache. Returns None if no features match.
+def fetch_layer(name, inputs=None, boundary_gdf=None, max_workers=MAX_CONCURRENT_REQUESTS, progress=None,
+                cancel_event=None, out_sr=DEFAULT_OUT_SR, journal=None, previous=None, generalize=False,
+                use_mirror=False, use_cache=True):
+    layer = LAYERS[name]
+    if use_mirror:
+        gdf = layer_mirror.read_mirror(name, inputs or {}, boundary_gdf, out_sr)
+        if gdf is not None:
+            report_progress(progress, layer["title"], 1, 1, len(gdf), 0)
+            return gdf
+        logging.info(f"{layer['title']}: not in the local mirror, fetching it from the server")
+    where_clause = layer_where_clause(name, **(inputs or {}))
+    if layer["spatial_filter"] == "envelope":
+        gdf = fetch_boundary_envelope(
+            layer["url"], boundary_gdf, layer["title"], progress, cancel_event, out_sr,
+            generalize and layer["generalize"], where_clause, layer["fields"]
+        )
+    elif layer["chunked"]:
+        spatial_filter = None
+        if layer["spatial_filter"] == "boundary" and boundary_gdf is not None:
+            spatial_filter = build_polygon_filter(boundary_gdf)
+        gdf = fetch_chunked_layer(
+            layer["url"], where_clause, layer["title"], max_workers, progress, cancel_event, spatial_filter, out_sr,
+            journal, previous, layer["fields"], use_cache
+        )
+    else:
+        gdf = fetch_where_layer(
+            layer["url"], where_clause, layer["title"], progress, cancel_event, out_sr, layer["fields"]
+        )
+    if gdf is None:
+        logging.warning(f"{layer['title']}: no features found for the specified query")
+    return gdf
 
-# Fetch waterbodies data within the municipal_boundary bounding box
-def fetch_waterbodies_within_boundary(boundary_gdf, output_folder, project_number):
-    url = "https://mapsdep.nj.gov/arcgis/rest/services/Features/Hydrography/MapServer/33/query"
+# Fetch county boundary data
+def fetch_county_boundary(county_name, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR):
+    return fetch_layer("county", {"county_name": county_name}, progress=progress, cancel_event=cancel_event,
+                       out_sr=out_sr)
 
-    # Define the bounding box for the query
-    bounds = boundary_gdf.total_bounds
-    bbox = {
-        "xmin": bounds[0],
-        "ymin": bounds[1],
-        "xmax": bounds[2],
-        "ymax": bounds[3],
-        "spatialReference": {"wkid": 4326}
-    }
+# Fetch municipality boundary data
+def fetch_municipality_boundary(municipality_code, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR):
+    return fetch_layer("municipality", {"municipality_code": municipality_code}, progress=progress,
+                       cancel_event=cancel_event, out_sr=out_sr)
 
-    # Define the parameters for the API request
-    params = {
-        "where": "1=1",
-        "geometryType": "esriGeometryEnvelope",
-        "spatialRel": "esriSpatialRelIntersects",
-        "geometry": json.dumps(bbox),
-        "outFields": "*",
-        "returnGeometry": "true",
-        "f": "geojson"
-    }
+# Fetch parcels data
+def fetch_parcels(municipality_code, max_workers=MAX_CONCURRENT_REQUESTS, progress=None, cancel_event=None,
+                  out_sr=DEFAULT_OUT_SR, journal=None, previous=None, use_mirror=False):
+    return fetch_layer("parcels", {"municipality_code": municipality_code}, None, max_workers, progress, cancel_event,
+                       out_sr, journal, previous, use_mirror=use_mirror)
+
+# Fetch roads. When a boundary is given, only road segments intersecting its generalized outline are requested
+# from the server instead of every road in the county; the result still needs the exact clip to the boundary.
+def fetch_roads(gnis_code, max_workers=MAX_CONCURRENT_REQUESTS, progress=None, cancel_event=None, boundary_gdf=None,
+                out_sr=DEFAULT_OUT_SR, journal=None, previous=None, use_mirror=False):
+    return fetch_layer("roads", {"gnis_code": gnis_code}, boundary_gdf, max_workers, progress, cancel_event, out_sr,
+                       journal, previous, use_mirror=use_mirror)
 
-    # Send the API request
-    response = requests.post(url, data=params, verify=False)
-    response.raise_for_status()  # Raise an error if the request failed
-    data = response.json()
+# Fetch wetlands data within municipal_boundary bounding box
+def fetch_wetlands_within_boundary(boundary_gdf, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR,
+                                   generalize=False):
+    return fetch_layer("wetlands", boundary_gdf=boundary_gdf, progress=progress, cancel_event=cancel_event,
+                       out_sr=out_sr, generalize=generalize)
 
-    # Check if features were returned
-    if not data['features']:
-        print("No features found for the specified query.")
-        print("Response data:", data)
-        return None
+# Fetch neighboring municipalities data using municipal_boundary bounding box
+def fetch_neighboring_municipalities(boundary_gdf, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR,
+                                     generalize=False):
+    return fetch_layer("neighboring", boundary_gdf=boundary_gdf, progress=progress, cancel_event=cancel_event,
+                       out_sr=out_sr, generalize=generalize)
 
-    # Convert the response data to a GeoDataFrame
-    waterbodies_gdf = gpd.GeoDataFrame.from_features(data['features'])
-    waterbodies_gdf.set_crs("EPSG:4326", inplace=True)
-
-    # Create the output (sub)folder if it doesn't exist
-    waterbodies_output_folder = os.path.join(output_folder, f"Waterbodies_{project_number}")
-    if not os.path.exists(waterbodies_output_folder):
-        os.makedirs(waterbodies_output_folder)
-
-    # Define the output filename and save the GeoDataFrame as a shapefile
-    waterbodies_output_filename = f"Waterbodies_{project_number}.shp"
-    waterbodies_output_path = os.path.join(output_folder, waterbodies_output_filename)
-    waterbodies_gdf.to_file(waterbodies_output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {waterbodies_output_path}")
-    return waterbodies_output_path
+# Fetch waterbodies data within the municipal_boundary bounding box
+def fetch_waterbodies_within_boundary(boundary_gdf, progress=None, cancel_event=None, out_sr=DEFAULT_OUT_SR,
+                                      generalize=False):
+    return fetch_layer("waterbodies", boundary_gdf=boundary_gdf, progress=progress, cancel_event=cancel_event,
+                       out_sr=out_sr, generalize=generalize)
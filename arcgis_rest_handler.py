@@ -1,48 +1,23 @@
-import requests
-import geopandas as gpd
 import os
+import sys
+from api_handler import fetch_layer
+from file_manager import save_layer
 
-def fetch_county_geometry(output_folder):
-    # Define the URL for the ArcGIS REST service
-    url = ("https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/1/query"
-           "?where=GNIS_NAME+%3D+%27County+of+Atlantic%27&text=&objectIds=&time=&timeRelation=esriTimeRelationOverlaps"
-           "&geometry=&geometryType=esriGeometryPolygon&inSR=&spatialRel=esriSpatialRelIntersects&distance=&units=esriSRUnit_Foot"
-           "&relationParam=&outFields=*&returnGeometry=true&returnTrueCurves=false&maxAllowableOffset=&geometryPrecision=&outSR="
-           "&havingClause=&returnIdsOnly=false&returnCountOnly=false&orderByFields=&groupByFieldsForStatistics=&outStatistics="
-           "&returnZ=false&returnM=false&gdbVersion=&historicMoment=&returnDistinctValues=false&resultOffset=&resultRecordCount="
-           "&returnExtentOnly=false&sqlFormat=none&datumTransformation=&parameterValues=&rangeValues=&quantizationParameters="
-           "&featureEncoding=esriDefault&f=geojson")
-
-    # Make the request to the API
-    response = requests.get(url, verify=False)
-    response.raise_for_status()
-    data = response.json()
+# Fetch a county's boundary through the layer registry and save it as a shapefile in output_folder
+def fetch_county_geometry(output_folder, county_name):
+    gdf = fetch_layer("county", {"county_name": county_name})
 
     # Check if features are returned
-    if not data['features']:
-        print("No features found for the specified query.")
-        print("Response data:", data)
-        return
-
-    # Convert the features to a GeoDataFrame
-    gdf = gpd.GeoDataFrame.from_features(data['features'])
-
-    # Set the geometry column if it exists
-    if 'geometry' in gdf:
-        gdf.set_geometry('geometry', inplace=True)
+    if gdf is None:
+        return None
 
     # Ensure the output folder exists
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Define the output file path
-    output_filename = "County_of_Atlantic_boundary.shp"
-    output_path = os.path.join(output_folder, output_filename)
-
     # Save the GeoDataFrame as a shapefile
-    gdf.to_file(output_path, driver='ESRI Shapefile')
-    print(f"Data saved successfully to {output_path}")
+    return save_layer(gdf, output_folder, f"County_of_{county_name}_boundary")
 
-# Example usage
-output_folder = "C:/Users/tug37130/Documents/CED/Output_Testing"
-fetch_county_geometry(output_folder)
+# Example usage: python arcgis_rest_handler.py <output folder> <county name>
+if __name__ == "__main__":
+    fetch_county_geometry(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "Atlantic")
@@ -0,0 +1,462 @@
+import http.server
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+import geopandas as gpd
+import numpy as np
+import requests
+import shapely
+from pyproj import Transformer
+from shapely.geometry import Polygon, box
+from shapely.geometry.polygon import orient
+from layer_registry import LAYERS
+
+# Local stand-in for the ArcGIS REST layers the application queries. It serves layer metadata and queries with
+# where clauses, OBJECTID ranges, objectIds, envelope and polygon filters, returnIdsOnly, returnCountOnly,
+# paging, outSR, GeoJSON and (quantized) Esri JSON, truncating results at maxRecordCount with
+# exceededTransferLimit like the real servers. Latency and server errors can be injected. The data is synthetic,
+# generated from a seed, so every run serves exactly the same features.
+
+# Area of the synthetic county (WGS84), split into a 3 x 3 grid of municipalities coded 0101 to 0109
+COUNTY_BOUNDS = (-74.75, 39.35, -74.35, 39.65)
+COUNTY_NAME = "Atlantic"
+GNIS_CODE = "882270"
+MUNICIPALITY_CODES = [f"01{number:02d}" for number in range(1, 10)]
+
+# Municipality used by the benchmarks: the middle one, so it has neighbors on every side
+MUNICIPALITY_CODE = "0105"
+
+# Feature counts of each synthetic layer at scale 1
+BASE_COUNTS = {"parcels": 9000, "roads": 5000, "wetlands": 600, "waterbodies": 200}
+
+# lastEditDate reported for every layer (2024-01-01) until it is edited with MockArcGISServer.edit_layer
+LAST_EDIT_DATE = 1704067200000
+
+# Path of the request that replaces a layer of a running server, as if it had been edited
+EDIT_PATH = "/mock/edit"
+
+# Hosts of the real services; requests to them are sent to the mock server by create_session()
+SERVICE_HOSTS = sorted({urllib.parse.urlsplit(layer["url"]).netloc for layer in LAYERS.values()})
+
+# A layer served by the mock server
+class MockLayer:
+    def __init__(self, gdf, geometry_type, max_record_count=2000, supports_pagination=True,
+                 supports_quantization=True, edit_date_field=None, last_edit_date=LAST_EDIT_DATE):
+        self.gdf = gdf.reset_index(drop=True)
+        self.last_edit_date = last_edit_date
+        self.geometry_type = geometry_type
+        self.max_record_count = max_record_count
+        self.supports_pagination = supports_pagination
+        self.supports_quantization = supports_quantization
+        self.edit_date_field = edit_date_field
+        self.tree = shapely.STRtree(self.gdf.geometry.values)
+        self.object_ids = self.gdf["OBJECTID"].to_numpy()
+        self.properties = [json.dumps(record) for record in self.gdf.drop(columns="geometry").to_dict("records")]
+        self._projected = {4326: np.asarray(self.gdf.geometry.values, dtype=object)}
+        self._geojson = {}
+        self._lock = threading.Lock()
+
+    # Layer metadata, as returned for ?f=json
+    def metadata(self):
+        minx, miny, maxx, maxy = self.gdf.total_bounds
+        metadata = {
+            "currentVersion": 10.91,
+            "type": "Feature Layer",
+            "geometryType": self.geometry_type,
+            "objectIdField": "OBJECTID",
+            "maxRecordCount": self.max_record_count,
+            "supportedQueryFormats": "JSON, geoJSON, PBF",
+            "advancedQueryCapabilities": {
+                "supportsPagination": self.supports_pagination,
+                "supportsCoordinatesQuantization": self.supports_quantization,
+            },
+            "editingInfo": {"lastEditDate": self.last_edit_date},
+            "extent": {"xmin": minx, "ymin": miny, "xmax": maxx, "ymax": maxy, "spatialReference": {"wkid": 4326}},
+        }
+        if self.edit_date_field:
+            metadata["editFieldsInfo"] = {"editDateField": self.edit_date_field}
+        return metadata
+
+    # Geometries of the layer projected to a spatial reference
+    def projected(self, wkid):
+        with self._lock:
+            if wkid not in self._projected:
+                transformer = Transformer.from_crs(4326, wkid, always_xy=True)
+                self._projected[wkid] = shapely.transform(
+                    self._projected[4326], lambda coords: np.column_stack(transformer.transform(*coords.T))
+                )
+            return self._projected[wkid]
+
+    # GeoJSON geometries of the layer in a spatial reference
+    def geojson(self, wkid):
+        with self._lock:
+            cached = self._geojson.get(wkid)
+        if cached is None:
+            cached = shapely.to_geojson(self.projected(wkid))
+            with self._lock:
+                self._geojson[wkid] = cached
+        return cached
+
+# Evaluate a where clause made of comparisons joined with AND, as sent by the application
+def where_mask(gdf, where):
+    mask = np.ones(len(gdf), dtype=bool)
+    for clause in re.split(r"\s+AND\s+", where or "1=1", flags=re.IGNORECASE):
+        clause = clause.strip().strip("()").strip()
+        if clause in ("", "1=1"):
+            continue
+        match = re.fullmatch(
+            r"(\w+)\s*(>=|<=|<>|=|>|<)\s*(timestamp\s+)?(?:'([^']*)'|([-\d.]+))", clause, re.IGNORECASE
+        )
+        if match is None:
+            raise ValueError(f"Unable to parse the where clause: {clause}")
+        field, operator, is_timestamp, text, number = match.groups()
+        if field not in gdf:
+            raise ValueError(f"Invalid field: {field}")
+        if is_timestamp:
+            value = datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp() * 1000
+        elif text is not None:
+            value = text
+        else:
+            value = float(number)
+        column = gdf[field].to_numpy()
+        mask &= {
+            "=": column == value, "<>": column != value, ">=": column >= value,
+            "<=": column <= value, ">": column > value, "<": column < value,
+        }[operator]
+    return mask
+
+# Convert a query geometry to shapely in WGS84
+def query_geometry(params):
+    geometry = json.loads(params["geometry"])
+    wkid = (geometry.get("spatialReference") or {}).get("wkid") or int(params.get("inSR") or 4326)
+    if "rings" in geometry:
+        shape = shapely.union_all([Polygon(ring) for ring in geometry["rings"]])
+    else:
+        shape = box(geometry["xmin"], geometry["ymin"], geometry["xmax"], geometry["ymax"])
+    if wkid != 4326:
+        transformer = Transformer.from_crs(wkid, 4326, always_xy=True)
+        shape = shapely.transform(shape, lambda coords: np.column_stack(transformer.transform(*coords.T)))
+    return shape
+
+# Select the features of a layer matching the query parameters, as positions in OBJECTID order
+def select_features(layer, params):
+    mask = where_mask(layer.gdf, params.get("where"))
+    if params.get("objectIds"):
+        mask &= np.isin(layer.object_ids, [int(value) for value in params["objectIds"].split(",")])
+    if params.get("geometry"):
+        spatial = np.zeros(len(mask), dtype=bool)
+        spatial[layer.tree.query(query_geometry(params), predicate="intersects")] = True
+        mask &= spatial
+    positions = np.flatnonzero(mask)
+    return positions[np.argsort(layer.object_ids[positions], kind="stable")]
+
+# Convert a geometry to Esri JSON, quantized when quantization parameters are given
+def esri_geometry(geometry, key, quantization=None):
+    if key == "rings":
+        polygons = getattr(geometry, "geoms", [geometry])
+        parts = []
+        for polygon in polygons:
+            polygon = orient(polygon, sign=-1.0)  # Esri outer rings are clockwise
+            parts.append(np.asarray(polygon.exterior.coords))
+            parts.extend(np.asarray(ring.coords) for ring in polygon.interiors)
+    else:
+        parts = [np.asarray(line.coords) for line in getattr(geometry, "geoms", [geometry])]
+    if quantization is None:
+        return {key: [part[:, :2].tolist() for part in parts]}
+    extent = quantization["extent"]
+    tolerance = quantization["tolerance"]
+    encoded = []
+    for part in parts:
+        grid = np.column_stack([
+            np.round((part[:, 0] - extent["xmin"]) / tolerance),
+            np.round((extent["ymax"] - part[:, 1]) / tolerance),
+        ]).astype(np.int64)
+        grid[1:] = np.diff(grid, axis=0)
+        encoded.append(grid.tolist())
+    return {key: encoded}
+
+# Build the response body for a query
+def query_response(layer, params):
+    positions = select_features(layer, params)
+    if params.get("returnIdsOnly") == "true":
+        return {"objectIdFieldName": "OBJECTID", "objectIds": layer.object_ids[positions].tolist()}
+    if params.get("returnCountOnly") == "true":
+        return {"count": len(positions)}
+
+    offset = int(params.get("resultOffset") or 0)
+    limit = min(int(params.get("resultRecordCount") or layer.max_record_count), layer.max_record_count)
+    page = positions[offset:offset + limit]
+    exceeded = len(positions) > offset + limit
+    wkid = int(params.get("outSR") or 4326)
+
+    if params.get("f") == "geojson":
+        geometries = layer.geojson(wkid)
+        features = ",".join(
+            f'{{"type":"Feature","id":{layer.object_ids[position]},"geometry":{geometries[position]},'
+            f'"properties":{layer.properties[position]}}}'
+            for position in page
+        )
+        crs = f',"crs":{{"type":"name","properties":{{"name":"EPSG:{wkid}"}}}}' if wkid != 4326 else ""
+        extra = ',"properties":{"exceededTransferLimit":true}' if exceeded else ""
+        return f'{{"type":"FeatureCollection"{crs},"features":[{features}]{extra}}}'
+
+    key = "rings" if layer.geometry_type == "esriGeometryPolygon" else "paths"
+    quantization = json.loads(params["quantizationParameters"]) if params.get("quantizationParameters") else None
+    geometries = layer.projected(wkid)
+    records = layer.gdf.drop(columns="geometry").iloc[page].to_dict("records")
+    response = {
+        "objectIdFieldName": "OBJECTID",
+        "geometryType": layer.geometry_type,
+        "spatialReference": {"wkid": wkid, "latestWkid": wkid},
+        "features": [
+            {"attributes": record, "geometry": esri_geometry(geometries[position], key, quantization)}
+            for record, position in zip(records, page)
+        ],
+    }
+    if quantization is not None:
+        extent = quantization["extent"]
+        response["transform"] = {
+            "originPosition": "upperLeft",
+            "scale": [quantization["tolerance"], quantization["tolerance"]],
+            "translate": [extent["xmin"], extent["ymax"]],
+        }
+    if exceeded:
+        response["exceededTransferLimit"] = True
+    return response
+
+# Build the synthetic layers at a scale (1 gives about 9,000 parcels and 5,000 road segments), keyed by the
+# URL path of the real service they stand in for. last_edit_date is the lastEditDate they report; every parcel's
+# edit date is the day before.
+def build_layers(scale=1.0, seed=0, last_edit_date=LAST_EDIT_DATE):
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = COUNTY_BOUNDS
+    width, height = xmax - xmin, ymax - ymin
+
+    county = gpd.GeoDataFrame(
+        {
+            "OBJECTID": [1],
+            "COUNTY": [COUNTY_NAME.upper()],
+            "GNIS_NAME": [f"County of {COUNTY_NAME}"],
+            "GNIS": [GNIS_CODE],
+        },
+        geometry=[box(*COUNTY_BOUNDS)], crs=4326,
+    )
+    municipality_boxes = [
+        box(xmin + column * width / 3, ymin + row * height / 3,
+            xmin + (column + 1) * width / 3, ymin + (row + 1) * height / 3)
+        for row in range(3) for column in range(3)
+    ]
+    municipalities = gpd.GeoDataFrame(
+        {
+            "OBJECTID": range(1, 10),
+            "MUN_CODE": MUNICIPALITY_CODES,
+            "NAME": [f"Municipality {code}" for code in MUNICIPALITY_CODES],
+            "COUNTY": COUNTY_NAME.upper(),
+        },
+        geometry=municipality_boxes, crs=4326,
+    )
+
+    # Parcels: a grid of slightly inset lots over the county, each in the municipality holding its center
+    side = max(3, int(np.sqrt(BASE_COUNTS["parcels"] * scale)))
+    cell_x, cell_y = width / side, height / side
+    columns, rows = np.meshgrid(np.arange(side), np.arange(side))
+    left = xmin + columns.ravel() * cell_x
+    bottom = ymin + rows.ravel() * cell_y
+    lots = shapely.box(left + cell_x * 0.05, bottom + cell_y * 0.05, left + cell_x * 0.95, bottom + cell_y * 0.95)
+    municipality_index = (rows.ravel() * 3 // side) * 3 + columns.ravel() * 3 // side
+    parcel_count = len(lots)
+    parcels = gpd.GeoDataFrame(
+        {
+            "OBJECTID": np.arange(1, parcel_count + 1),
+            "PCL_MUN": np.asarray(MUNICIPALITY_CODES)[municipality_index],
+            "PAMS_PIN": [f"{MUNICIPALITY_CODES[m]}_{i}" for i, m in enumerate(municipality_index)],
+            "LAND_VAL": rng.integers(10_000, 900_000, parcel_count),
+            "EditDate": np.full(parcel_count, last_edit_date - 86_400_000),
+        },
+        geometry=lots, crs=4326,
+    )
+
+    # Roads: short three-vertex segments spread over the county
+    road_count = max(1, int(BASE_COUNTS["roads"] * scale))
+    starts = rng.random((road_count, 2)) * [width, height] + [xmin, ymin]
+    steps = rng.normal(0, width / 150, (road_count, 2, 2))
+    vertices = np.concatenate([starts[:, None, :], starts[:, None, :] + np.cumsum(steps, axis=1)], axis=1)
+    roads = gpd.GeoDataFrame(
+        {
+            "OBJECTID": np.arange(1, road_count + 1),
+            "COUNTY_L": GNIS_CODE,
+            "SLD_NAME": [f"Road {i}" for i in range(road_count)],
+            "ROAD_CLASS": rng.choice(["Local", "County", "State", "Interstate"], road_count, p=[0.7, 0.2, 0.08, 0.02]),
+        },
+        geometry=shapely.linestrings(vertices), crs=4326,
+    )
+
+    # Wetlands and waterbodies: round polygons of random sizes
+    def blobs(count, radius):
+        centers = rng.random((count, 2)) * [width, height] + [xmin, ymin]
+        return shapely.buffer(shapely.points(centers), rng.uniform(radius / 4, radius, count), quad_segs=8)
+
+    wetland_count = max(1, int(BASE_COUNTS["wetlands"] * scale))
+    wetlands = gpd.GeoDataFrame(
+        {"OBJECTID": np.arange(1, wetland_count + 1), "LABEL06": "WETLANDS", "TYPE06": "WETLANDS"},
+        geometry=blobs(wetland_count, width / 80), crs=4326,
+    )
+    waterbody_count = max(1, int(BASE_COUNTS["waterbodies"] * scale))
+    waterbodies = gpd.GeoDataFrame(
+        {"OBJECTID": np.arange(1, waterbody_count + 1), "NAME": [f"Lake {i}" for i in range(waterbody_count)]},
+        geometry=blobs(waterbody_count, width / 60), crs=4326,
+    )
+
+    polygon, polyline = "esriGeometryPolygon", "esriGeometryPolyline"
+    edited = {"last_edit_date": last_edit_date}
+    layers = {
+        "county": MockLayer(county, polygon, **edited),
+        "municipality": MockLayer(municipalities, polygon, **edited),
+        "roads": MockLayer(roads, polyline, max_record_count=1000, supports_quantization=False, **edited),
+        "parcels": MockLayer(parcels, polygon, max_record_count=2000, edit_date_field="EditDate", **edited),
+        "neighboring": MockLayer(municipalities, polygon, **edited),
+        "wetlands": MockLayer(
+            wetlands, polygon, max_record_count=250, supports_pagination=False, supports_quantization=False, **edited
+        ),
+        "waterbodies": MockLayer(waterbodies, polygon, max_record_count=100, supports_quantization=False, **edited),
+    }
+    return {urllib.parse.urlsplit(LAYERS[name]["url"]).path: layer for name, layer in layers.items()}
+
+# Request handler answering layer metadata and query requests for the layers of its server
+class MockRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def answer(self, params):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self.reply(503, {"error": {"code": 503, "message": "Injected server error"}})
+
+        path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        if path == EDIT_PATH:
+            return self.reply(200, edit_layer(server, params["layer"], float(params["scale"]), int(params["seed"])))
+        is_query = path.endswith("/query")
+        layer = server.layers.get(path[:-len("/query")] if is_query else path)
+        if layer is None:
+            return self.reply(404, {"error": {"code": 404, "message": f"No layer at {path}"}})
+        if not is_query:
+            return self.reply(200, layer.metadata())
+        try:
+            return self.reply(200, query_response(layer, params))
+        except (ValueError, KeyError) as e:
+            # ArcGIS reports bad queries as an error payload with HTTP 200
+            return self.reply(200, {"error": {"code": 400, "message": str(e)}})
+
+    def do_GET(self):
+        self.answer(dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        self.answer(dict(urllib.parse.parse_qsl(body)))
+
+# Replace a layer of a running server with the one built at another scale and seed, stamped with the current time
+# as its lastEditDate (and its parcels' edit dates), as if the layer had been edited on the server
+def edit_layer(server, name, scale, seed):
+    path = urllib.parse.urlsplit(LAYERS[name]["url"]).path
+    layer = build_layers(scale, seed, last_edit_date=int(time.time() * 1000))[path]
+    server.layers[path] = layer
+    return {"features": len(layer.gdf), "lastEditDate": layer.last_edit_date}
+
+# Build the layers and serve them until the process is stopped, reporting the port through the queue
+def serve(port_queue, scale, seed, latency, error_rate):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MockRequestHandler)
+    server.daemon_threads = True
+    server.layers = build_layers(scale, seed)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+# Transport adapter sending requests for the real service hosts to the mock server instead
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, netloc, **kwargs):
+        super().__init__(**kwargs)
+        self.netloc = netloc
+
+    def send(self, request, **kwargs):
+        parts = urllib.parse.urlsplit(request.url)
+        request.url = urllib.parse.urlunsplit(("http", self.netloc, parts.path, parts.query, ""))
+        return super().send(request, **kwargs)
+
+# Mock ArcGIS server, run in its own process so serving responses does not slow down the code being measured
+class MockArcGISServer:
+    def __init__(self, scale=1.0, seed=0, latency=0.0, error_rate=0.0):
+        self.scale = scale
+        self.seed = seed
+        self.latency = latency
+        self.error_rate = error_rate
+        self.process = None
+        self.port = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Start the server process and wait until it is listening
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve, args=(port_queue, self.scale, self.seed, self.latency, self.error_rate), daemon=True
+        )
+        self.process.start()
+        self.port = port_queue.get(timeout=120)
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    # Edit a layer of the running server: it is rebuilt at another scale and seed and reports a new lastEditDate
+    def edit_layer(self, name, scale=None, seed=None):
+        response = requests.post(
+            f"http://127.0.0.1:{self.port}{EDIT_PATH}",
+            data={"layer": name, "scale": scale or self.scale, "seed": self.seed + 1 if seed is None else seed},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    # Build an http_client session whose requests to the real service hosts go to this server
+    def create_session(self):
+        import http_client
+        session = http_client.create_session()
+        retry = session.get_adapter("https://").max_retries
+        for host in SERVICE_HOSTS:
+            session.mount(
+                f"https://{host}/",
+                RedirectAdapter(
+                    f"127.0.0.1:{self.port}",
+                    pool_connections=http_client.MAX_POOLED_HOSTS,
+                    pool_maxsize=http_client.MAX_CONNECTIONS_PER_HOST,
+                    pool_block=True,
+                    max_retries=retry,
+                ),
+            )
+        return session
@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The benchmarks import the application modules from the repository root
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIR)
+
+import api_handler
+import geo_processor
+import http_client
+import pipeline
+import response_cache
+import stormwater_analysis
+from benchmarks.mock_arcgis import COUNTY_NAME, GNIS_CODE, MUNICIPALITY_CODE, MockArcGISServer
+
+# Folder the results are written to unless --output is given, one file per commit
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Changes of the median time smaller than this (as a fraction) are reported as unchanged by --compare
+NOISE_THRESHOLD = 0.05
+
+# Import a module in a fresh interpreter, as the application does when it starts. The import fails if it loads any
+# of the forbidden modules, so the GUI cannot start pulling the geospatial stack in again unnoticed.
+def import_in_new_process(module, forbidden=()):
+    check = (
+        f"import sys, {module}; loaded = [name for name in {list(forbidden)!r} if name in sys.modules]; "
+        f"sys.exit(f'{module} imported {{loaded}}' if loaded else 0)"
+    )
+    subprocess.run([sys.executable, "-c", check], cwd=REPOSITORY_DIR, check=True)
+    return None
+
+# Benchmark cases: name -> function taking the shared inputs and returning the number of features produced
+def build_cases(inputs):
+    def run_process_case():
+        output_folder = tempfile.mkdtemp(prefix="swlayer_benchmark_")
+        try:
+            pipeline.run_process(
+                output_folder, COUNTY_NAME, MUNICIPALITY_CODE, f"Municipality {MUNICIPALITY_CODE}", GNIS_CODE, "BENCH",
+                target_crs=inputs["target_crs"],
+            )
+        finally:
+            shutil.rmtree(output_folder, ignore_errors=True)
+        return None
+
+    out_sr = inputs["out_sr"]
+    return {
+        "fetch_parcels": lambda: len(api_handler.fetch_parcels(MUNICIPALITY_CODE, out_sr=out_sr)),
+        "fetch_roads_county": lambda: len(api_handler.fetch_roads(GNIS_CODE, out_sr=out_sr)),
+        "fetch_roads_boundary": lambda: len(
+            api_handler.fetch_roads(GNIS_CODE, boundary_gdf=inputs["boundary"], out_sr=out_sr)
+        ),
+        "fetch_wetlands": lambda: len(api_handler.fetch_wetlands_within_boundary(inputs["boundary"], out_sr=out_sr)),
+        "fetch_neighboring": lambda: len(
+            api_handler.fetch_neighboring_municipalities(inputs["boundary"], out_sr=out_sr)
+        ),
+        "fetch_waterbodies": lambda: len(
+            api_handler.fetch_waterbodies_within_boundary(inputs["boundary"], out_sr=out_sr)
+        ),
+        "clip_roads": lambda: len(geo_processor.clip_layer(inputs["county_roads"], inputs["boundary"])),
+        "reproject_parcels": lambda: len(geo_processor.reproject_layer(inputs["parcels"], "EPSG:3424")),
+        "road_summary": lambda: len(
+            stormwater_analysis.road_summary(inputs["county_roads"], inputs["parcels"])["frontage"]
+        ),
+        "parcel_coverage": lambda: len(
+            stormwater_analysis.parcel_coverage(inputs["parcels"], inputs["wetlands"], inputs["waterbodies"])
+        ),
+        "run_process": run_process_case,
+        "startup_gui": lambda: import_in_new_process("gui", forbidden=("geopandas", "pandas", "requests")),
+        "startup_pipeline": lambda: import_in_new_process("pipeline"),
+    }
+
+# Time a case: the minimum and median of the repeats, after one untimed warm-up run
+def time_case(func, repeat):
+    features = func()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return {
+        "min_seconds": round(min(seconds), 4),
+        "median_seconds": round(statistics.median(seconds), 4),
+        "repeat": repeat,
+        "features": features,
+    }
+
+# Current commit and whether the working tree has uncommitted changes, if this is a git checkout
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+# Print each case of the results next to a baseline results file
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline["config"] != results["config"]:
+        print(f"Warning: {baseline_path} was run with different settings: {baseline['config']}")
+    print(f"\n{'Case':<24}{'Baseline (s)':>14}{'Current (s)':>14}{'Change':>10}")
+    for name, case in results["cases"].items():
+        before = baseline["cases"].get(name)
+        if before is None:
+            print(f"{name:<24}{'-':>14}{case['median_seconds']:>14.3f}{'new':>10}")
+            continue
+        change = case["median_seconds"] / before["median_seconds"] - 1 if before["median_seconds"] else 0
+        label = f"{change:+.0%}" if abs(change) >= NOISE_THRESHOLD else "~"
+        print(f"{name:<24}{before['median_seconds']:>14.3f}{case['median_seconds']:>14.3f}{label:>10}")
+
+# Run the benchmarks against the mock server and write the results as JSON
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fetchers, geoprocessing and a full run against a local mock ArcGIS server."
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the synthetic layers (default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server waits before each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of each case (default: 3)")
+    parser.add_argument("--target-crs", default="EPSG:4326", help="CRS the layers are requested in")
+    parser.add_argument("--cases", nargs="+", help="Only run these cases")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Measure downloads, not the local response cache, and keep the mock county list out of the real cache folder
+    response_cache.CACHE_ENABLED = False
+    response_cache.CACHE_DIR = tempfile.mkdtemp(prefix="swlayer_benchmark_cache_")
+    config = {
+        "scale": args.scale, "latency": args.latency, "error_rate": args.error_rate, "target_crs": args.target_crs,
+    }
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "cases": {},
+    }
+
+    with MockArcGISServer(args.scale, latency=args.latency, error_rate=args.error_rate) as server:
+        http_client.session = server.create_session()
+        out_sr = int(args.target_crs.upper().removeprefix("EPSG:"))
+        boundary = api_handler.fetch_municipality_boundary(MUNICIPALITY_CODE, out_sr=out_sr)
+        inputs = {
+            "target_crs": args.target_crs,
+            "out_sr": out_sr,
+            "boundary": boundary,
+            "county_roads": api_handler.fetch_roads(GNIS_CODE, out_sr=out_sr),
+            "parcels": api_handler.fetch_parcels(MUNICIPALITY_CODE, out_sr=out_sr),
+            "wetlands": api_handler.fetch_wetlands_within_boundary(boundary, out_sr=out_sr),
+            "waterbodies": api_handler.fetch_waterbodies_within_boundary(boundary, out_sr=out_sr),
+        }
+        cases = build_cases(inputs)
+        for name in args.cases or cases:
+            if name not in cases:
+                parser.error(f"Unknown case '{name}', expected one of: {', '.join(cases)}")
+            results["cases"][name] = time_case(cases[name], args.repeat)
+            case = results["cases"][name]
+            print(f"{name:<24}{case['median_seconds']:>10.3f} s (min {case['min_seconds']:.3f} s)")
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"{commit or 'results'}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\nResults saved to {output_path}")
+    if args.compare:
+        print_comparison(results, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import argparse
+import csv
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http_client import RunCancelled
+from pipeline import SharedLayers, run_process
+from file_manager import OUTPUT_FORMATS
+from run_report import PROFILERS
+from admin_lookup import load_lookup, validate_inputs
+from layer_mirror import sync_mirror
+from layer_registry import LAYERS
+
+# Columns of a project in a manifest
+MANIFEST_FIELDS = ["county", "municipality_code", "municipality_name", "gnis_code", "project_number", "output_folder"]
+
+# Columns every project must fill in; the county, municipality name and GNIS code can be left blank and are then
+# filled in from the municipality code
+REQUIRED_FIELDS = ["municipality_code", "project_number", "output_folder"]
+
+# Layers that can be kept in the local statewide mirror
+MIRROR_LAYERS = [name for name, layer in LAYERS.items() if layer["mirror"]]
+
+# Number of projects run at the same time unless --workers is given
+DEFAULT_WORKERS = 2
+
+# Counties with at least this many projects in a batch download their roads once for the whole county and clip
+# them per project, instead of asking the server for each municipality's roads separately
+COUNTY_ROADS_SHARE_THRESHOLD = 3
+
+# Read the projects from a CSV or YAML manifest
+def read_manifest(manifest_path):
+    if manifest_path.lower().endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("Reading a YAML manifest requires PyYAML (pip install pyyaml), or use a CSV manifest")
+        with open(manifest_path) as manifest_file:
+            data = yaml.safe_load(manifest_file) or []
+        projects = data.get("projects", []) if isinstance(data, dict) else data
+    else:
+        with open(manifest_path, newline="") as manifest_file:
+            projects = list(csv.DictReader(manifest_file))
+
+    # Values such as municipality codes must keep their leading zeros, so everything is read as text
+    projects = [{name: str(value).strip() for name, value in project.items() if name} for project in projects]
+    for number, project in enumerate(projects, start=1):
+        missing = [field for field in REQUIRED_FIELDS if not project.get(field)]
+        if missing:
+            raise ValueError(f"Project {number} in {manifest_path} is missing: {', '.join(missing)}")
+
+    # Projects must not share an output folder: the run journal (for resuming) and the refresh snapshot are kept
+    # per output folder, so one project's would replace another's, and the run report, log and layer names only
+    # differ by project number
+    folders = Counter(os.path.normcase(os.path.abspath(project["output_folder"])) for project in projects)
+    shared_folders = [folder for folder, count in folders.items() if count > 1]
+    if shared_folders:
+        raise ValueError(f"Each project needs its own output folder: {', '.join(shared_folders)}")
+    return projects
+
+# Check every project against the list of NJ counties and municipalities before any of them starts, filling in the
+# blank county, municipality name and GNIS code columns. Raises ValueError listing every project that does not match.
+def validate_projects(projects):
+    lookup = load_lookup()
+    errors = []
+    for number, project in enumerate(projects, start=1):
+        try:
+            project["county"], project["municipality_name"], project["gnis_code"] = validate_inputs(
+                project.get("county"), project["municipality_code"], project.get("municipality_name"),
+                project.get("gnis_code"), lookup
+            )
+        except ValueError as e:
+            errors.append(f"Project {number} ({project['project_number']}): {e}")
+    if errors:
+        raise ValueError("\n".join(errors))
+    return projects
+
+# Run one project and return its status line for the summary
+def run_project(project, shared_layers, filter_roads_by_boundary, cancel_event, output_format, target_crs="EPSG:4326",
+                generalize_context_layers=False, resume=False, refresh=False, profiler=None, use_mirror=False):
+    started = time.perf_counter()
+    os.makedirs(project["output_folder"], exist_ok=True)
+    try:
+        run_process(
+            project["output_folder"],
+            project["county"],
+            project["municipality_code"],
+            project["municipality_name"],
+            project["gnis_code"],
+            project["project_number"],
+            cancel_event=cancel_event,
+            filter_roads_by_boundary=filter_roads_by_boundary,
+            shared_layers=shared_layers,
+            output_format=output_format,
+            target_crs=project.get("target_crs") or target_crs,
+            generalize_context_layers=generalize_context_layers,
+            resume=resume,
+            refresh=refresh,
+            profiler=profiler,
+            use_mirror=use_mirror,
+            drainage_areas=project.get("drainage_areas") or None,
+        )
+        status = "OK"
+    except RunCancelled:
+        status = "Cancelled"
+    except Exception as e:
+        status = f"Failed: {e}"
+    return project, status, time.perf_counter() - started
+
+# Print the per-project timing and status summary
+def print_summary(results, elapsed):
+    print()
+    print(f"{'Project':<16}{'Municipality':<28}{'Time (s)':>10}  Status")
+    for project, status, seconds in results:
+        print(f"{project['project_number']:<16}{project['municipality_name'][:27]:<28}{seconds:>10.1f}  {status}")
+    succeeded = sum(1 for _, status, _ in results if status == "OK")
+    print(f"\n{succeeded} of {len(results)} projects completed in {elapsed:.1f} seconds")
+
+# Run every project in the manifest with a pool of workers, sharing county-level layers between projects
+def run_batch(projects, workers=DEFAULT_WORKERS, output_format="shapefile", target_crs="EPSG:4326",
+              generalize_context_layers=False, resume=False, refresh=False, profiler=None, use_mirror=False):
+    shared_layers = SharedLayers()
+    # Each project has its own cancel event, since a failing project stops only its own remaining tasks
+    cancel_events = [threading.Event() for _ in projects]
+    projects_per_county = Counter(project["gnis_code"] for project in projects)
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            executor.submit(
+                run_project,
+                project,
+                shared_layers,
+                projects_per_county[project["gnis_code"]] < COUNTY_ROADS_SHARE_THRESHOLD,
+                cancel_event,
+                output_format,
+                target_crs,
+                generalize_context_layers,
+                resume,
+                refresh,
+                profiler,
+                use_mirror,
+            )
+            for project, cancel_event in zip(projects, cancel_events)
+        ]
+        try:
+            results = [future.result() for future in futures]
+        except KeyboardInterrupt:
+            # Projects that have not started are skipped; running ones finish their current request and clean up
+            logging.warning("Cancelling the remaining projects...")
+            for cancel_event in cancel_events:
+                cancel_event.set()
+            for future in futures:
+                future.cancel()
+            results = [future.result() for future in futures if not future.cancelled()]
+
+    print_summary(results, time.perf_counter() - started)
+    return results
+
+# Headless entry point: python main.py --manifest projects.csv [--workers N] [--output-format FORMAT]
+# [--target-crs EPSG:3424] [--generalize-context] [--resume] [--refresh] [--profile PROFILER] [--use-mirror],
+# or python main.py --sync-mirror [LAYER ...] to download or update the local statewide mirror
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate stormwater layers for every project in a manifest without opening the GUI."
+    )
+    parser.add_argument(
+        "--manifest",
+        help="CSV or YAML file with the columns " + ", ".join(MANIFEST_FIELDS)
+             + " (county, municipality_name and gnis_code may be left blank), and optionally target_crs and "
+               "drainage_areas (a file of drainage area polygons to summarize the road length by)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help=f"Number of projects to run at the same time (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default="shapefile",
+        help="Shapefile per layer (default), one GeoPackage per project, or GeoParquet per layer",
+    )
+    parser.add_argument(
+        "--target-crs", default="EPSG:4326",
+        help="CRS the layers are requested in, e.g. EPSG:3424 for NJ State Plane feet (default: EPSG:4326). "
+             "A target_crs column in the manifest overrides it per project",
+    )
+    parser.add_argument(
+        "--generalize-context", action="store_true",
+        help="Let the server simplify the neighboring municipalities layer by about a metre",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Continue the projects whose last run failed or was cancelled, reusing the data it had downloaded",
+    )
+    parser.add_argument(
+        "--refresh", action="store_true",
+        help="Update projects generated before, downloading only the parcels and roads changed since their last run",
+    )
+    parser.add_argument(
+        "--profile", choices=PROFILERS,
+        help="Profile each stage and save the profiles next to the run report (stages then run one at a time)",
+    )
+    parser.add_argument(
+        "--use-mirror", action="store_true",
+        help="Read parcels and roads from the local statewide mirror when it has them, instead of the servers",
+    )
+    parser.add_argument(
+        "--sync-mirror", nargs="*", choices=MIRROR_LAYERS, metavar="LAYER",
+        help="Download the statewide layers (default: " + ", ".join(MIRROR_LAYERS) + ") into the local mirror, "
+             "or update them with the changes since the last sync, before running the manifest (if any)",
+    )
+    args = parser.parse_args(argv)
+    if args.manifest is None and args.sync_mirror is None:
+        parser.error("--manifest is required unless --sync-mirror is given")
+
+    if args.sync_mirror is not None:
+        sync_mirror(args.sync_mirror or None)
+        if args.manifest is None:
+            return 0
+
+    projects = validate_projects(read_manifest(args.manifest))
+    results = run_batch(
+        projects, args.workers, args.output_format, args.target_crs, args.generalize_context, args.resume,
+        args.refresh, args.profile, args.use_mirror
+    )
+    return 0 if all(status == "OK" for _, status, _ in results) else 1
@@ -0,0 +1,94 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import GeometryType
+
+# Esri JSON geometry types that can be decoded, with the key holding their coordinates
+GEOMETRY_PARTS = {
+    "esriGeometryPolygon": "rings",
+    "esriGeometryPolyline": "paths",
+}
+
+# Fewest vertices a ring or path needs to be kept; emptier parts (which the server can send, especially once
+# coordinates are quantized) are skipped
+MIN_PART_VERTICES = {"rings": 4, "paths": 2}
+
+# Decode quantized coordinates: the first vertex of each part is an offset from the origin of the quantization
+# grid and every following vertex is an offset from the previous one, all in grid units
+def dequantize(coords, part_offsets, transform):
+    starts = part_offsets[:-1]
+    running = np.cumsum(coords, axis=0)
+    part_base = np.repeat(running[starts] - coords[starts], np.diff(part_offsets), axis=0)
+    grid = running - part_base
+
+    scale_x, scale_y = transform["scale"][:2]
+    translate_x, translate_y = transform["translate"][:2]
+    x = grid[:, 0] * scale_x + translate_x
+    if transform.get("originPosition", "upperLeft") == "upperLeft":
+        y = translate_y - grid[:, 1] * scale_y
+    else:
+        y = grid[:, 1] * scale_y + translate_y
+    return np.column_stack([x, y])
+
+# Group Esri polygon rings into polygons. Outer rings are clockwise (negative signed area) and start a new
+# polygon; counter-clockwise rings are holes of the polygon before them.
+def group_rings(coords, ring_offsets, feature_ring_offsets):
+    x = coords[:, 0]
+    y = coords[:, 1]
+    cross = np.concatenate([[0.0], np.cumsum(x[:-1] * y[1:] - x[1:] * y[:-1])])
+    starts = ring_offsets[:-1]
+    ends = ring_offsets[1:]
+    signed_area = (cross[ends - 1] - cross[starts]) / 2
+
+    starts_polygon = signed_area < 0
+    starts_polygon[feature_ring_offsets[:-1][np.diff(feature_ring_offsets) > 0]] = True  # first ring of a feature
+    polygon_offsets = np.append(np.flatnonzero(starts_polygon), len(starts_polygon))
+    polygons_before_ring = np.concatenate([[0], np.cumsum(starts_polygon)])
+    return polygon_offsets, polygons_before_ring[feature_ring_offsets]
+
+# Convert an Esri JSON query response (quantized or not) to a GeoDataFrame.
+# Attributes become columns directly, and all geometries are built in one call from flat coordinate arrays
+# instead of creating a shapely object per feature. Features without geometry (or with only empty parts) get None.
+def esri_json_to_frame(data, crs="EPSG:4326"):
+    geometry_type = data.get("geometryType")
+    if geometry_type not in GEOMETRY_PARTS:
+        raise ValueError(f"Cannot decode Esri JSON geometry type {geometry_type}")
+    key = GEOMETRY_PARTS[geometry_type]
+    min_vertices = MIN_PART_VERTICES[key]
+    features = data.get("features", [])
+
+    attributes = pd.DataFrame([feature.get("attributes", {}) for feature in features])
+    parts = []
+    part_counts = []
+    for feature in features:
+        feature_parts = [
+            part for part in (feature.get("geometry") or {}).get(key) or [] if len(part) >= min_vertices
+        ]
+        part_counts.append(len(feature_parts))
+        parts.extend(feature_parts)
+
+    vertex_counts = [len(part) for part in parts]
+    part_offsets = np.concatenate([[0], np.cumsum(vertex_counts)]).astype(np.int64)
+    feature_part_offsets = np.concatenate([[0], np.cumsum(part_counts)]).astype(np.int64)
+    if parts:
+        coords = np.concatenate([np.asarray(part, dtype=float)[:, :2] for part in parts])
+    else:
+        coords = np.empty((0, 2))
+    if data.get("transform") and len(coords):
+        coords = dequantize(coords, part_offsets, data["transform"])
+
+    if key == "rings":
+        polygon_offsets, feature_polygon_offsets = group_rings(coords, part_offsets, feature_part_offsets)
+        geometry = shapely.from_ragged_array(
+            GeometryType.MULTIPOLYGON, coords, (part_offsets, polygon_offsets, feature_polygon_offsets)
+        )
+    else:
+        geometry = shapely.from_ragged_array(
+            GeometryType.MULTILINESTRING, coords, (part_offsets, feature_part_offsets)
+        )
+    geometry[np.asarray(part_counts, dtype=np.int64) == 0] = None
+
+    spatial_reference = data.get("spatialReference", {})
+    wkid = spatial_reference.get("latestWkid", spatial_reference.get("wkid"))
+    return gpd.GeoDataFrame(attributes, geometry=geometry, crs=f"EPSG:{wkid}" if wkid else crs)
@@ -1,7 +1,64 @@
-import geopandas as gpd
+import os
+import threading
+
+# Shapefile sidecar extensions written alongside each .shp
+SHAPEFILE_EXTENSIONS = [".shp", ".cpg", ".dbf", ".prj", ".shx"]
+
+# Output formats: a shapefile per layer in its own subfolder, one GeoPackage with a table per layer,
+# or a GeoParquet file per layer
+OUTPUT_FORMATS = ["shapefile", "geopackage", "geoparquet"]
+
+# Layers of the same GeoPackage are written one at a time, since SQLite allows a single writer
+_geopackage_locks = {}
+_geopackage_locks_lock = threading.Lock()
 
 # Function to save shapefile into the designated folder.
 def save_shapefile(gdf, output_folder):
     filename = f"{output_folder}/clipped_data_{gdf.crs.to_epsg()}.shp"
     gdf.to_file(filename)
     return filename
+
+# Get the lock for writing to a GeoPackage
+def geopackage_lock(path):
+    with _geopackage_locks_lock:
+        return _geopackage_locks.setdefault(os.path.normcase(os.path.abspath(path)), threading.Lock())
+
+# Save a layer in the chosen output format and return the path written.
+# Shapefiles go in their own subfolder of the output folder; GeoPackage layers are tables of
+# <geopackage_name>.gpkg with a spatial index; GeoParquet layers are <layer_name>.parquet files with bbox columns.
+def save_layer(gdf, output_folder, layer_name, output_format="shapefile", geopackage_name="Stormwater_Layers"):
+    if output_format == "geopackage":
+        output_path = os.path.join(output_folder, f"{geopackage_name}.gpkg")
+        with geopackage_lock(output_path):
+            gdf.to_file(output_path, layer=layer_name, driver="GPKG", SPATIAL_INDEX="YES")
+    elif output_format == "geoparquet":
+        output_path = os.path.join(output_folder, f"{layer_name}.parquet")
+        gdf.to_parquet(output_path, write_covering_bbox=True)
+    elif output_format == "shapefile":
+        layer_folder = os.path.join(output_folder, layer_name)
+        if not os.path.exists(layer_folder):
+            os.makedirs(layer_folder)
+        output_path = os.path.join(layer_folder, f"{layer_name}.shp")
+        gdf.to_file(output_path, driver='ESRI Shapefile')
+    else:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of: {', '.join(OUTPUT_FORMATS)}")
+    print(f"Data saved successfully to {output_path}")
+    return output_path
+
+# Save a table (a DataFrame without geometry) as <table_name>.csv in the output folder and return the path written.
+def save_table(df, output_folder, table_name):
+    output_path = os.path.join(output_folder, f"{table_name}.csv")
+    df.to_csv(output_path, index=False)
+    print(f"Data saved successfully to {output_path}")
+    return output_path
+
+# List the files that make up a saved shapefile.
+def shapefile_parts(shapefile):
+    base = os.path.splitext(shapefile)[0]
+    return [base + ext for ext in SHAPEFILE_EXTENSIONS]
+
+# List the files that make up a saved layer in any output format.
+def layer_files(output_path):
+    if output_path.lower().endswith(".shp"):
+        return shapefile_parts(output_path)
+    return [output_path]
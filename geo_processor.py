@@ -1,27 +1,105 @@
 import geopandas as gpd
+import numpy as np
 import os
 import logging
+import shapely
+import run_report
+from concurrent.futures import ThreadPoolExecutor
+from pyproj import CRS
 
-# Ensure each file is saved as 4326.
-def check_crs(shapefile, target_crs="EPSG:4326"):
+# Features crossing a clip boundary are intersected in batches of this many, on up to CLIP_WORKERS threads.
+# Shapely releases the GIL while it works through an array of geometries, so the batches run in parallel.
+CLIP_BATCH_SIZE = 10000
+CLIP_WORKERS = min(4, os.cpu_count() or 1)
+
+# Read a layer's CRS from its metadata without loading any features. Shapefiles only need their .prj file.
+def read_crs(path):
+    prj_path = os.path.splitext(path)[0] + ".prj"
+    if os.path.exists(prj_path):
+        with open(prj_path) as prj_file:
+            return CRS.from_wkt(prj_file.read())
+    try:
+        import pyogrio
+        crs = pyogrio.read_info(path)["crs"]
+        return CRS.from_user_input(crs) if crs else None
+    except ImportError:
+        return gpd.read_file(path).crs
+
+# Ensure each file is saved as 4326. Accepts a GeoDataFrame or the path of a saved layer.
+def check_crs(layer, target_crs="EPSG:4326"):
     try:
-        gdf = gpd.read_file(shapefile)
-        return gdf.crs == target_crs
+        crs = layer.crs if isinstance(layer, gpd.GeoDataFrame) else read_crs(layer)
+        if crs is None:
+            return False
+        target = CRS.from_user_input(target_crs)
+        # ESRI .prj files spell out the CRS without its EPSG name, so compare EPSG codes where both have one
+        if crs.to_epsg() is not None and target.to_epsg() is not None:
+            return crs.to_epsg() == target.to_epsg()
+        return crs.equals(target)
     except Exception as e:
         logging.error(f"An error occurred while checking CRS: {e}")
         return False
 
+# Project a GeoDataFrame if needed.
+def reproject_layer(gdf, target_crs="EPSG:4326"):
+    if gdf.crs is None:
+        logging.info("Setting CRS to WGS84 (EPSG:4326)...")
+        gdf = gdf.set_crs("EPSG:4326")
+    if check_crs(gdf, target_crs):
+        return gdf
+    logging.info(f"Reprojecting layer to {target_crs}...")
+    return gdf.to_crs(target_crs)
+
+# Sort features by how they lie against a boundary, using a spatial index so only features whose bounding box
+# overlaps the boundary are tested. Returns the positions of the features fully inside and of those crossing it;
+# every other feature is outside.
+def split_by_boundary(geometries, boundary):
+    candidates = np.sort(shapely.STRtree(geometries).query(boundary))
+    shapely.prepare(boundary)
+    inside = shapely.contains_properly(boundary, geometries[candidates])
+    rest = candidates[~inside]
+    crossing = rest[shapely.intersects(boundary, geometries[rest])]
+    return candidates[inside], crossing
+
+# Intersect geometries with a boundary, in parallel batches for large layers
+def intersect_batches(geometries, boundary):
+    if len(geometries) <= CLIP_BATCH_SIZE:
+        return shapely.intersection(geometries, boundary)
+    batches = [geometries[start:start + CLIP_BATCH_SIZE] for start in range(0, len(geometries), CLIP_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=CLIP_WORKERS) as executor:
+        return np.concatenate(list(executor.map(lambda batch: shapely.intersection(batch, boundary), batches)))
+
+# Clip a GeoDataFrame to a boundary GeoDataFrame. Gives the same result as gpd.clip, but features fully inside
+# the boundary are kept as they are and only the features crossing it are intersected.
+def clip_layer(gdf, boundary_gdf):
+    if boundary_gdf.crs is not None and gdf.crs != boundary_gdf.crs:
+        boundary_gdf = boundary_gdf.to_crs(gdf.crs)
+    boundary = boundary_gdf.union_all()
+    geometries = np.asarray(gdf.geometry.array, dtype=object)
+
+    with run_report.timed("clip"):
+        inside, crossing = split_by_boundary(geometries, boundary)
+        clipped = intersect_batches(geometries[crossing], boundary)
+        kept = ~shapely.is_empty(clipped)
+    logging.info(
+        f"Clipping: {len(inside)} features inside, {len(crossing)} crossing, "
+        f"{len(gdf) - len(inside) - len(crossing)} outside the boundary"
+    )
+
+    # Keep the features in their original order
+    rows = np.concatenate([inside, crossing[kept]])
+    order = np.argsort(rows, kind="stable")
+    clipped_gdf = gdf.iloc[rows[order]].copy()
+    clipped_gdf[gdf.geometry.name] = gpd.GeoSeries(
+        np.concatenate([geometries[inside], clipped[kept]])[order], index=clipped_gdf.index, crs=gdf.crs
+    )
+    return clipped_gdf
+
 # Project the file if needed.
 def reproject_shapefile(input_shapefile, output_shapefile, target_crs="EPSG:4326"):
     try:
         logging.info(f"Reprojecting {input_shapefile} to {target_crs}...")
-        gdf = gpd.read_file(input_shapefile)
-        
-        if gdf.crs is None:
-            logging.info(f"Setting CRS for {input_shapefile} to WGS84 (EPSG:4326)...")
-            gdf.set_crs("EPSG:4326", inplace=True)
-        
-        gdf = gdf.to_crs(target_crs)
+        gdf = reproject_layer(gpd.read_file(input_shapefile), target_crs)
         gdf.to_file(output_shapefile)
         logging.info(f"Reprojected shapefile saved as {output_shapefile}")
         return output_shapefile
@@ -36,8 +114,8 @@ def clip_shapefile(input_shapefile, boundary_shapefile, output_shapefile):
         gdf = gpd.read_file(input_shapefile)
         boundary_gdf = gpd.read_file(boundary_shapefile)
 
-        clipped_gdf = gpd.clip(gdf, boundary_gdf)
-        
+        clipped_gdf = clip_layer(gdf, boundary_gdf)
+
         output_folder = os.path.dirname(output_shapefile)
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
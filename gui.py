@@ -1,26 +1,24 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from geo_processor import reproject_shapefile, check_crs, clip_shapefile
-from logger import log_operations
-from api_handler import (
-    fetch_county_boundary,
-    fetch_parcels,
-    fetch_roads,
-    fetch_municipality_boundary,
-    fetch_wetlands_within_boundary,
-    fetch_neighboring_municipalities,
-    fetch_waterbodies_within_boundary
-)
-import geopandas as gpd
+from file_manager import OUTPUT_FORMATS
+from run_journal import read_journal
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 import webbrowser
 import sys
-import shutil
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
+# How often (in milliseconds) the GUI checks the worker thread for progress updates
+POLL_INTERVAL_MS = 100
+
+# Delay (in milliseconds) after the window opens before the geospatial stack is imported in the background
+WARM_UP_DELAY_MS = 100
+
 # Function to get the resource path
 def resource_path(relative_path):
     try:
@@ -29,6 +27,17 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+# Import the pipeline (and with it geopandas, shapely, pyproj and requests) and load the list of NJ counties and
+# municipalities on a background thread. The window only needs tkinter, so it opens straight away and the slow
+# imports are usually done by the time a run starts.
+def warm_up(state):
+    try:
+        import pipeline  # noqa: F401
+        from admin_lookup import load_lookup
+        state["lookup"] = load_lookup()
+    except Exception as e:
+        logging.warning(f"Could not prepare the application in the background: {e}")
+
 # Launch the GUI
 def launch_gui():
     root = tk.Tk()
@@ -43,6 +52,14 @@ def launch_gui():
         folder_selected = filedialog.askdirectory()
         output_folder.set(folder_selected)
 
+    # Function to select the drainage areas file
+    def select_drainage_areas():
+        file_selected = filedialog.askopenfilename(
+            filetypes=[("Polygon layers", "*.shp *.gpkg *.geojson *.json *.parquet"), ("All files", "*.*")]
+        )
+        if file_selected:
+            drainage_areas.set(file_selected)
+
     # Create and place widgets in the GUI
     # Create a frame to hold the description and ReadMe link
     frame = tk.Frame(root)
@@ -69,7 +86,8 @@ def launch_gui():
     # Municipality code dialogue
     tk.Label(root, text="Municipality Code").grid(row=3, column=0, sticky="e")
     municipality_code = tk.StringVar()
-    tk.Entry(root, textvariable=municipality_code, width=50).grid(row=3, column=1)
+    municipality_code_entry = tk.Entry(root, textvariable=municipality_code, width=50)
+    municipality_code_entry.grid(row=3, column=1)
 
     # Municipality name dialogue
     tk.Label(root, text="Municipality Name").grid(row=4, column=0, sticky="e")
@@ -81,25 +99,216 @@ def launch_gui():
     gnis_code = tk.StringVar()
     tk.Entry(root, textvariable=gnis_code, width=50).grid(row=5, column=1)
 
+    # Fill in the county, municipality name and GNIS code left blank from the municipality code, once the list of
+    # NJ counties and municipalities has been loaded (it is loaded in the background when the window opens)
+    def fill_from_municipality_code(event=None):
+        lookup = warm_state["lookup"]
+        municipality = lookup["municipalities"].get(municipality_code.get().strip()) if lookup else None
+        if municipality is None:
+            return
+        county = lookup["counties"].get(municipality["county"])
+        if not municipality_name.get().strip():
+            municipality_name.set(municipality["name"])
+        if county is not None and not county_name.get().strip():
+            county_name.set(county["name"])
+        if county is not None and not gnis_code.get().strip():
+            gnis_code.set(county["gnis_code"])
+
+    municipality_code_entry.bind("<FocusOut>", fill_from_municipality_code)
+    warm_state = {"lookup": None}
+
     # Project number dialogue
     tk.Label(root, text="Project Number").grid(row=6, column=0, sticky="e")
     project_number = tk.StringVar()
     tk.Entry(root, textvariable=project_number, width=50).grid(row=6, column=1)
 
-    # Initiate application once the "Run" button is clicked
-    tk.Button(
-        root,
-        text="Run",
-        command=lambda: run_process(
+    # Output format dialogue
+    tk.Label(root, text="Output Format").grid(row=7, column=0, sticky="e")
+    output_format = tk.StringVar(value=OUTPUT_FORMATS[0])
+    tk.OptionMenu(root, output_format, *OUTPUT_FORMATS).grid(row=7, column=1, sticky="w")
+
+    # Output CRS dialogue: the layers are requested from the servers in this CRS (NJ State Plane feet is 3424)
+    tk.Label(root, text="Output CRS (EPSG code)").grid(row=8, column=0, sticky="e")
+    target_epsg = tk.StringVar(value="4326")
+    tk.Entry(root, textvariable=target_epsg, width=50).grid(row=8, column=1)
+
+    # Generalization of context layers
+    generalize_context = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        root, text="Simplify neighboring municipalities (about 1 m)", variable=generalize_context
+    ).grid(row=9, column=1, sticky="w")
+
+    # Refresh: only download the parcel and road changes since the last run into this output folder
+    refresh = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        root, text="Only download changes since the last run (refresh)", variable=refresh
+    ).grid(row=10, column=1, sticky="w")
+
+    # Mirror: read parcels and roads from the local statewide mirror (synced with main.py --sync-mirror)
+    use_mirror = tk.BooleanVar(value=False)
+    tk.Checkbutton(
+        root, text="Use the local parcels and roads mirror when available", variable=use_mirror
+    ).grid(row=11, column=1, sticky="w")
+
+    # Drainage areas: optional polygons the road length summary is also broken down by
+    tk.Label(root, text="Drainage Areas (optional)").grid(row=12, column=0, sticky="e")
+    drainage_areas = tk.StringVar()
+    tk.Entry(root, textvariable=drainage_areas, width=50).grid(row=12, column=1)
+    tk.Button(root, text="Browse", command=select_drainage_areas).grid(row=12, column=2)
+
+    # Progress area: the latest status message and one line per layer being downloaded
+    status = tk.StringVar(value="Ready")
+    tk.Label(root, textvariable=status, anchor="w").grid(row=14, column=0, columnspan=3, sticky="we", padx=10)
+    progress_frame = tk.Frame(root)
+    progress_frame.grid(row=15, column=0, columnspan=3, sticky="we", padx=10, pady=(0, 10))
+    layer_progress = {}
+
+    # State of the current run, shared with the worker thread through queues
+    run_state = {"thread": None, "cancel_event": None}
+    events = queue.Queue()
+    log_records = queue.Queue()
+    log_handler = logging.handlers.QueueHandler(log_records)
+    log_handler.setLevel(logging.INFO)
+
+    # Show a layer's progress (chunks done / total, features, bytes) in the progress area
+    def update_layer_progress(layer_name, chunks_done, chunks_total, features, bytes_received):
+        if layer_name not in layer_progress:
+            layer_progress[layer_name] = tk.StringVar()
+            tk.Label(progress_frame, textvariable=layer_progress[layer_name], anchor="w").pack(fill=tk.X)
+        layer_progress[layer_name].set(
+            f"{layer_name}: {chunks_done}/{chunks_total} requests, {features:,} features, "
+            f"{bytes_received / (1024 * 1024):.1f} MB"
+        )
+
+    # Run the pipeline on the worker thread and report the outcome back to the GUI
+    def worker(args, options, cancel_event):
+        try:
+            # Already imported by warm_up unless the run was started straight away
+            from http_client import RunCancelled
+            from pipeline import run_process
+        except Exception as e:
+            events.put(("error", str(e)))
+            return
+        try:
+            run_process(
+                *args,
+                progress=lambda *update: events.put(("progress", update)),
+                cancel_event=cancel_event,
+                **options,
+            )
+            events.put(("done", args[0]))
+        except RunCancelled:
+            events.put(("cancelled", None))
+        except Exception as e:
+            events.put(("error", str(e)))
+
+    # Start a run in the background so the window stays responsive
+    def start_run(resume=False):
+        if run_state["thread"] is not None:
+            return
+        for widget in progress_frame.winfo_children():
+            widget.destroy()
+        layer_progress.clear()
+        args = (
             output_folder.get(),
             county_name.get(),
             municipality_code.get(),
             municipality_name.get(),
             gnis_code.get(),
             project_number.get(),
-        ),
-    ).grid(row=7, column=1, pady=(10, 10))
+        )
+        options = {
+            "output_format": output_format.get(),
+            "target_crs": f"EPSG:{target_epsg.get().strip().upper().removeprefix('EPSG:')}",
+            "generalize_context_layers": generalize_context.get(),
+            "resume": resume,
+            "refresh": refresh.get(),
+            "use_mirror": use_mirror.get(),
+            "drainage_areas": drainage_areas.get().strip() or None,
+        }
+        run_state["cancel_event"] = threading.Event()
+        run_state["thread"] = threading.Thread(
+            target=worker, args=(args, options, run_state["cancel_event"]), daemon=True
+        )
+        logging.getLogger().addHandler(log_handler)
+        run_button.config(state=tk.DISABLED)
+        resume_button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+        status.set("Starting...")
+        run_state["thread"].start()
+        root.after(POLL_INTERVAL_MS, poll_worker)
+
+    # Fill in the form from the run left unfinished in the output folder and continue it
+    def resume_run():
+        journal = read_journal(output_folder.get())
+        if journal is None:
+            messagebox.showinfo("Resume last run", "There is no unfinished run in this output folder.")
+            return
+        run = journal["run"]
+        for variable, name in [
+            (county_name, "county_name"),
+            (municipality_code, "municipality_code"),
+            (municipality_name, "municipality_name"),
+            (gnis_code, "gnis_code"),
+            (project_number, "project_number"),
+            (output_format, "output_format"),
+        ]:
+            variable.set(run[name])
+        target_epsg.set(run["target_crs"].upper().removeprefix("EPSG:"))
+        generalize_context.set(run["generalize_context_layers"])
+        refresh.set(run.get("refresh", False))
+        use_mirror.set(run.get("use_mirror", False))
+        drainage_areas.set(run.get("drainage_areas") or "")
+        start_run(resume=True)
+
+    # Ask the worker to stop; in-flight requests are abandoned and no layers are added to the output folder
+    def cancel_run():
+        if run_state["cancel_event"] is not None:
+            run_state["cancel_event"].set()
+            cancel_button.config(state=tk.DISABLED)
+            status.set("Cancelling...")
+
+    # Reset the buttons once the worker has finished
+    def finish_run():
+        logging.getLogger().removeHandler(log_handler)
+        run_state["thread"] = None
+        run_state["cancel_event"] = None
+        run_button.config(state=tk.NORMAL)
+        resume_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+
+    # Apply queued log messages and progress updates from the worker thread
+    def poll_worker():
+        while not log_records.empty():
+            record = log_records.get_nowait()
+            if not (run_state["cancel_event"] is not None and run_state["cancel_event"].is_set()):
+                status.set(record.getMessage())
+        while not events.empty():
+            kind, payload = events.get_nowait()
+            if kind == "progress":
+                update_layer_progress(*payload)
+                continue
+            finish_run()
+            if kind == "done":
+                status.set("Process completed successfully")
+                show_success_message(payload)
+            elif kind == "cancelled":
+                status.set("Run cancelled, no layers were saved. Use \"Resume last run\" to continue it")
+            else:
+                status.set("Run failed")
+                messagebox.showerror("Error", payload)
+            return
+        root.after(POLL_INTERVAL_MS, poll_worker)
 
+    # Initiate application once the "Run" button is clicked
+    run_button = tk.Button(root, text="Run", command=start_run)
+    run_button.grid(row=13, column=1, pady=(10, 10))
+    resume_button = tk.Button(root, text="Resume last run", command=resume_run)
+    resume_button.grid(row=13, column=0, pady=(10, 10))
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_run, state=tk.DISABLED)
+    cancel_button.grid(row=13, column=2, pady=(10, 10))
+
+    root.after(WARM_UP_DELAY_MS, lambda: threading.Thread(target=warm_up, args=(warm_state,), daemon=True).start())
     root.mainloop()
 
 # Function to display the success message
@@ -109,345 +318,5 @@ def show_success_message(output_folder):
     tk.Label(success_window, text=f"Application complete: data saved in {output_folder}").pack(pady=20, padx=20)
     tk.Button(success_window, text="OK", command=success_window.destroy).pack(pady=(0, 20))
 
-# Primary function to run the application
-def run_process(
-    output_folder, county_name, municipality_code, municipality_name, gnis_code, project_number
-):
-    created_files = []
-    wetlands_files = []
-    neighboring_files = []
-    waterbodies_files = []
-    parcels_files = []
-    roads_files = []
-
-    try:
-        target_crs = "EPSG:4326"
-
-        # Function to ensure the CRS of a file is correct
-        def ensure_crs(file_path, output_name):
-            if not check_crs(file_path, target_crs):
-                output_path = os.path.join(output_folder, output_name)
-                created_files.append(output_path)
-                return reproject_shapefile(file_path, output_path, target_crs)
-            return file_path
-
-        logging.info("Checking and reprojecting shapefiles to target CRS if necessary...")
-
-        # Fetch and process county boundary data
-        logging.info("Fetching county boundary data from ArcGIS REST service...")
-        try:
-            county_boundary_file = fetch_county_boundary(
-                county_name, output_folder, project_number
-            )
-            if county_boundary_file is None:
-                raise ValueError("Error: Please ensure county name is correct")
-            created_files.append(county_boundary_file)
-            logging.info("County boundary data fetched and saved successfully")
-        except Exception as e:
-            raise ValueError("Error: Please ensure county name is correct") from e
-
-        logging.info("Reprojecting county boundary to target CRS if necessary...")
-        county_boundary_file = ensure_crs(
-            county_boundary_file, f"reprojected_County_of_{county_name}_Boundary_{project_number}.shp"
-        )
-        logging.info("County boundary reprojected successfully")
-
-        # Fetch and process parcels data
-        logging.info("Fetching parcels data from ArcGIS REST service...")
-        try:
-            parcels_file = fetch_parcels(municipality_code, output_folder, project_number)
-            if parcels_file is None:
-                raise ValueError("Error: Please ensure municipality code is correct")
-            parcels_files.append(parcels_file)
-            for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                parcels_files.append(parcels_file.replace(".shp", ext))
-            logging.info("Parcels data fetched and saved successfully")
-        except Exception as e:
-            raise ValueError("Error: Please ensure municipality code is correct") from e
-
-        logging.info("Reprojecting parcels to target CRS if necessary...")
-        parcels_file = ensure_crs(parcels_file, f"reprojected_Parcels_{project_number}.shp")
-        logging.info("Parcels reprojected successfully")
-
-        # Fetch and process roads data
-        logging.info("Fetching roads data from ArcGIS REST service...")
-        try:
-            roads_file = fetch_roads(gnis_code, output_folder, project_number)
-            if roads_file is None:
-                raise ValueError("Error: Please ensure GNIS code is correct")
-            roads_files.append(roads_file)
-            for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                roads_files.append(roads_file.replace(".shp", ext))
-            logging.info("Roads data fetched and saved successfully")
-        except Exception as e:
-            raise ValueError("Error: Please ensure GNIS code is correct") from e
-
-        logging.info("Reprojecting roads to target CRS if necessary...")
-        roads_file = ensure_crs(roads_file, f"reprojected_Roads_{project_number}.shp")
-        logging.info("Roads reprojected successfully")
-
-        # Fetch and process municipality boundary data
-        logging.info("Fetching municipality boundary data from ArcGIS REST service...")
-        try:
-            municipality_boundary_file = fetch_municipality_boundary(
-                municipality_code, output_folder, municipality_name, project_number
-            )
-            if municipality_boundary_file is None:
-                raise ValueError("Error: Please ensure municipality name and code are correct")
-            created_files.append(municipality_boundary_file)
-            logging.info("Municipality boundary data fetched and saved successfully")
-        except Exception as e:
-            raise ValueError("Error: Please ensure municipality name and code are correct") from e
-
-        logging.info("Reprojecting municipality boundary to target CRS if necessary...")
-        municipality_boundary_file = ensure_crs(
-            municipality_boundary_file,
-            f"reprojected_{municipality_name.replace(' ', '_')}_Boundary_{project_number}.shp",
-        )
-        logging.info("Municipality boundary reprojected successfully")
-
-        # Fetch and process wetlands data
-        logging.info("Fetching wetlands data from ArcGIS REST service...")
-        try:
-            municipality_boundary_gdf = gpd.read_file(municipality_boundary_file)
-            wetlands_file = fetch_wetlands_within_boundary(
-                municipality_boundary_gdf, output_folder, project_number
-            )
-            if wetlands_file is None:
-                raise ValueError("Error: Failed to fetch wetlands data")
-            wetlands_files.append(wetlands_file)
-            for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                wetlands_files.append(wetlands_file.replace(".shp", ext))
-            logging.info(f"Wetlands data fetched and saved successfully: {wetlands_file}")
-        except Exception as e:
-            raise ValueError("Error: Failed to fetch wetlands data") from e
-
-        # Fetch and process neighboring municipalities data
-        logging.info("Fetching neighboring municipalities data from ArcGIS REST service...")
-        try:
-            neighboring_file = fetch_neighboring_municipalities(
-                municipality_boundary_gdf, output_folder, project_number
-            )
-            if neighboring_file is None:
-                raise ValueError("Error: Failed to fetch neighboring municipalities data")
-            neighboring_files.append(neighboring_file)
-            for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                neighboring_files.append(neighboring_file.replace(".shp", ext))
-            logging.info(
-                f"Neighboring municipalities data fetched and saved successfully: {neighboring_file}"
-            )
-        except Exception as e:
-            raise ValueError("Error: Failed to fetch neighboring municipalities data") from e
-
-        # Fetch and process waterbodies
-        logging.info("Fetching waterbodies data from ArcGIS REST service...")
-        try:
-            waterbodies_file = fetch_waterbodies_within_boundary(
-                municipality_boundary_gdf, output_folder, project_number
-            )
-            if waterbodies_file is None:
-                raise ValueError("Error: Failed to fetch waterbodies data")
-            waterbodies_files.append(waterbodies_file)
-            for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                waterbodies_files.append(waterbodies_file.replace(".shp", ext))
-            logging.info(f"Waterbodies data fetched and saved successfully: {waterbodies_file}")
-        except Exception as e:
-            raise ValueError("Error: Failed to fetch waterbodies data") from e
-
-        # Clip roads layer to municipality boundary
-        logging.info("Clipping roads layer to municipality boundary...")
-        clipped_roads_file = clip_shapefile(
-            roads_file,
-            municipality_boundary_file,
-            os.path.join(output_folder, f"Roads_{project_number}", f"Roads_{project_number}.shp"),
-        )
-        logging.info("Roads layer clipped successfully")
-
-        # Clip parcels layer to municipality boundary
-        logging.info("Clipping parcels layer to municipality boundary...")
-        clipped_parcels_file = clip_shapefile(
-            parcels_file,
-            municipality_boundary_file,
-            os.path.join(
-                output_folder, f"Parcels_{project_number}", f"Parcels_{project_number}.shp"
-            ),
-        )
-        logging.info("Parcels layer clipped successfully")
-
-        # Move and organize files into subfolders using the given file's basename. Ensure data does not appear in the output folder location.
-        for file_path in created_files:
-            try:
-                dir_name = os.path.basename(file_path).replace("reprojected_", "").replace(
-                    ".shp", ""
-                )
-                layer_output_folder = os.path.join(output_folder, dir_name)
-                if not os.path.exists(layer_output_folder):
-                    os.makedirs(layer_output_folder)
-                for ext in [".shp", ".cpg", ".dbf", ".prj", ".shx"]:
-                    base_file = file_path.replace(".shp", ext)
-                    if os.path.exists(base_file):
-                        shutil.move(base_file, os.path.join(layer_output_folder, os.path.basename(base_file)))
-                logging.info(f"Moved files to: {layer_output_folder}")
-            except Exception as e:
-                logging.error(f"An error occurred while moving {file_path}: {e}")
-
-        for file_path in wetlands_files:
-            try:
-                dir_name = f"Wetlands_{project_number}"
-                layer_output_folder = os.path.join(output_folder, dir_name)
-                if not os.path.exists(layer_output_folder):
-                    os.makedirs(layer_output_folder)
-                for ext in [".shp", ".cpg", ".dbf", ".prj", ".shx"]:
-                    base_file = file_path.replace(".shp", ext)
-                    if os.path.exists(base_file):
-                        shutil.move(base_file, os.path.join(layer_output_folder, os.path.basename(base_file)))
-                logging.info(f"Moved files to: {layer_output_folder}")
-            except Exception as e:
-                logging.error(f"An error occurred while moving wetlands file: {e}")
-
-        for file_path in neighboring_files:
-            try:
-                dir_name = f"Neighboring_Municipalities_{project_number}"
-                layer_output_folder = os.path.join(output_folder, dir_name)
-                if not os.path.exists(layer_output_folder):
-                    os.makedirs(layer_output_folder)
-                for ext in [".shp", ".cpg", ".dbf", ".prj", ".shx"]:
-                    base_file = file_path.replace(".shp", ext)
-                    if os.path.exists(base_file):
-                        shutil.move(base_file, os.path.join(layer_output_folder, os.path.basename(base_file)))
-                logging.info(f"Moved files to: {layer_output_folder}")
-            except Exception as e:
-                logging.error(f"An error occurred while moving neighboring municipalities file: {e}")
-
-        for file_path in waterbodies_files:
-            try:
-                dir_name = f"Waterbodies_{project_number}"
-                layer_output_folder = os.path.join(output_folder, dir_name)
-                if not os.path.exists(layer_output_folder):
-                    os.makedirs(layer_output_folder)
-                for ext in [".shp", ".cpg", ".dbf", ".prj", ".shx"]:
-                    base_file = file_path.replace(".shp", ext)
-                    if os.path.exists(base_file):
-                        shutil.move(base_file, os.path.join(layer_output_folder, os.path.basename(base_file)))
-                logging.info(f"Moved files to: {layer_output_folder}")
-            except Exception as e:
-                logging.error(f"An error occurred while moving waterbodies file: {e}")
-
-        for file_path in parcels_files:
-            try:
-                dir_name = f"Parcels_{project_number}"
-                layer_output_folder = os.path.join(output_folder, dir_name)
-                if not os.path.exists(layer_output_folder):
-                    os.makedirs(layer_output_folder)
-                for ext in [".shp", ".cpg", ".dbf", ".prj", ".shx"]:
-                    base_file = file_path.replace(".shp", ext)
-                    if os.path.exists(base_file):
-                        shutil.move(base_file, os.path.join(layer_output_folder, os.path.basename(base_file)))
-                logging.info(f"Moved files to: {layer_output_folder}")
-            except Exception as e:
-                logging.error(f"An error occurred while moving parcels file: {e}")
-
-        for file_path in roads_files:
-            try:
-                dir_name = f"Roads_{project_number}"
-                layer_output_folder = os.path.join(output_folder, dir_name)
-                if not os.path.exists(layer_output_folder):
-                    os.makedirs(layer_output_folder)
-                for ext in [".shp", ".cpg", ".dbf", ".prj", ".shx"]:
-                    base_file = file_path.replace(".shp", ext)
-                    if os.path.exists(base_file):
-                        shutil.move(base_file, os.path.join(layer_output_folder, os.path.basename(base_file)))
-                logging.info(f"Moved files to: {layer_output_folder}")
-            except Exception as e:
-                logging.error(f"An error occurred while moving roads file: {e}")
-
-        # Remove intermediary files (ex: reprojected/clipped layers)
-        for file_path in created_files:
-            try:
-                os.remove(file_path)
-                for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                    os.remove(file_path.replace(".shp", ext))
-                logging.info(f"Removed intermediary file: {file_path}")
-            except Exception as e:
-                logging.error(f"An error occurred while removing {file_path}: {e}")
-
-        # Remove empty directories if necessary
-        for root, dirs, files in os.walk(output_folder):
-            for dir in dirs:
-                dir_path = os.path.join(root, dir)
-                if not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-                    logging.info(f"Removed empty directory: {dir_path}")
-
-        log_operations(output_folder, project_number)
-        logging.info("Process completed successfully")
-        
-        # Show success message
-        show_success_message(output_folder)
-
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-        messagebox.showerror("Error", str(e))
-
-        # If the application does not run properly, remove any created files. Ensure the user does not need to manually remove any files that were created.
-        for file_path in created_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    for ext in [".cpg", ".dbf", ".prj", ".shx"]:
-                        os.remove(file_path.replace(".shp", ext))
-                    logging.info(f"Removed file due to error: {file_path}")
-            except Exception as ex:
-                logging.error(f"An error occurred while deleting file {file_path}: {ex}")
-
-        for file_path in wetlands_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logging.info(f"Removed wetlands file due to error: {file_path}")
-            except Exception as ex:
-                logging.error(f"An error occurred while deleting wetlands file {file_path}: {ex}")
-
-        for file_path in neighboring_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logging.info(f"Removed neighboring municipalities file due to error: {file_path}")
-            except Exception as ex:
-                logging.error(f"An error occurred while deleting neighboring municipalities file {file_path}: {ex}")
-
-        for file_path in waterbodies_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logging.info(f"Removed waterbodies file due to error: {file_path}")
-            except Exception as ex:
-                logging.error(f"An error occurred while deleting waterbodies file {file_path}: {ex}")
-
-        for file_path in parcels_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logging.info(f"Removed parcels file due to error: {file_path}")
-            except Exception as ex:
-                logging.error(f"An error occurred while deleting parcels file {file_path}: {ex}")
-
-        for file_path in roads_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logging.info(f"Removed roads file due to error: {file_path}")
-            except Exception as ex:
-                logging.error(f"An error occurred while deleting roads file {file_path}: {ex}")
-
-        for root, dirs, files in os.walk(output_folder):
-            for dir in dirs:
-                dir_path = os.path.join(root, dir)
-                try:
-                    shutil.rmtree(dir_path)
-                    logging.info(f"Removed directory due to error: {dir_path}")
-                except Exception as ex:
-                    logging.error(f"An error occurred while deleting directory {dir_path}: {ex}")
-
 if __name__ == "__main__":
     launch_gui()
@@ -0,0 +1,254 @@
+import logging
+import time
+import threading
+import urllib.parse
+import requests
+import response_cache
+import run_report
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Seconds to wait for a connection and for each read from the server before the request fails
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# Connection pool limits: number of hosts kept in the pool and open connections per host
+MAX_POOLED_HOSTS = 10
+MAX_CONNECTIONS_PER_HOST = 8
+
+# Retry policy for throttling (429), server errors (5xx) and dropped connections.
+# Waits grow exponentially with BACKOFF_FACTOR (1, 2, 4, 8... seconds) unless the server sends Retry-After.
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Size of the pieces a response body is read in; cancellation is checked between pieces
+READ_CHUNK_SIZE = 64 * 1024
+
+# How long a layer's lastEditDate is trusted before the layer metadata is requested again. Runs start by
+# forgetting the dates seen before (see forget_last_edit_dates), so this only spares the requests within a run.
+LAST_EDIT_CHECK_SECONDS = 5 * 60
+
+# Raised when a run is cancelled by the user while requests are in flight
+class RunCancelled(Exception):
+    pass
+
+# Raised for the error payloads ArcGIS returns with HTTP 200 (for example an unsupported query parameter)
+class ArcGISError(requests.exceptions.HTTPError):
+    pass
+
+# Stop the current run if the user has cancelled it
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise RunCancelled("The run was cancelled")
+
+# Build a pooled session that retries failed requests with exponential backoff
+def create_session():
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "POST"]),  # ArcGIS query requests are read-only, so POST is safe to repeat
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=MAX_POOLED_HOSTS,
+        pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+        pool_block=True,
+        max_retries=retry,
+    )
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    return new_session
+
+# Shared session used by every fetcher so connections and TLS sessions are reused
+session = create_session()
+
+# Read the response body piece by piece so a cancelled run stops downloading straight away
+def read_body(response, cancel_event=None):
+    body = bytearray()
+    try:
+        for piece in response.iter_content(READ_CHUNK_SIZE):
+            check_cancelled(cancel_event)
+            body.extend(piece)
+    finally:
+        response.close()
+    response._content = bytes(body)
+    return response
+
+# Count the retries urllib3 made before it returned a response
+def retry_count(response):
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+# Send a request through the shared session and return the response once it has been fully received.
+# Connection resets while the body is being read are not covered by urllib3's retry, so they are retried here.
+# The time spent waiting for the server and downloading the body is recorded in the run report.
+def send(method, url, params=None, data=None, verify=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), cancel_event=None,
+         headers=None):
+    attempt = 0
+    while True:
+        check_cancelled(cancel_event)
+        try:
+            started = time.perf_counter()
+            response = session.request(
+                method, url, params=params, data=data, verify=verify, timeout=timeout, stream=True, headers=headers
+            )
+            received_headers = time.perf_counter()
+            if not response.ok:
+                response.close()
+                run_report.record_request(
+                    method, url, response.status_code, received_headers - started, 0, 0, attempt + retry_count(response)
+                )
+            response.raise_for_status()  # Raise an error if the request still failed after the retries
+            read_body(response, cancel_event)
+            run_report.record_request(
+                method, url, response.status_code, received_headers - started,
+                time.perf_counter() - received_headers, len(response.content), attempt + retry_count(response)
+            )
+            return response
+        except requests.exceptions.ChunkedEncodingError as e:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise
+            wait = BACKOFF_FACTOR * (2 ** (attempt - 1))
+            logging.warning(f"Connection to {url} was interrupted ({e}), retrying in {wait} seconds...")
+            if cancel_event is not None:
+                cancel_event.wait(wait)
+            else:
+                time.sleep(wait)
+
+# Recently seen lastEditDate values per layer URL: layer URL -> (time checked, lastEditDate)
+_last_edit_dates = {}
+_last_edit_lock = threading.Lock()
+
+# Check whether a URL is a layer query (.../FeatureServer/0/query); only query responses are cached
+def is_query_url(url):
+    return urllib.parse.urlsplit(url).path.rstrip("/").endswith("/query")
+
+# Forget the lastEditDate values seen so far, so the next request of each layer checks it again. Called when a run
+# or a mirror sync starts, so an edit made since the last one is always noticed.
+def forget_last_edit_dates():
+    with _last_edit_lock:
+        _last_edit_dates.clear()
+
+# Get the lastEditDate of the layer a query URL belongs to, or None if it is not a query or the layer has none
+def layer_last_edit_date(url, verify=True, cancel_event=None):
+    if not is_query_url(url):
+        return None
+    layer_url = url.split("?")[0].rstrip("/")[:-len("/query")]
+    with _last_edit_lock:
+        checked = _last_edit_dates.get(layer_url)
+    if checked is not None and time.time() - checked[0] < LAST_EDIT_CHECK_SECONDS:
+        return checked[1]
+    try:
+        metadata = read_json(send("GET", layer_url, params={"f": "json"}, verify=verify, cancel_event=cancel_event))
+        last_edit_date = metadata.get("editingInfo", {}).get("lastEditDate")
+    except RunCancelled:
+        raise
+    except Exception as e:
+        logging.warning(f"Could not read the last edit date of {layer_url}: {e}")
+        last_edit_date = None
+    with _last_edit_lock:
+        _last_edit_dates[layer_url] = (time.time(), last_edit_date)
+    return last_edit_date
+
+# Build a response object for a body read from the cache
+def cached_response(url, body):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = "utf-8"
+    response._content = body
+    return response
+
+# Read a response from the cache, recording it in the run report. Returns None when the entry cannot be read,
+# for example because another thread or process evicted it after it was looked up; the caller then sends the
+# request as for a cache miss.
+def read_cached(method, url, key):
+    started = time.perf_counter()
+    try:
+        body = response_cache.read(key)
+    except (OSError, EOFError) as e:
+        logging.warning(f"Could not read the cached response from {url} ({e}), requesting it again")
+        return None
+    response = cached_response(url, body)
+    run_report.record_request(method, url, 200, 0, time.perf_counter() - started, len(response.content), from_cache=True)
+    return response
+
+# Check for an ArcGIS error payload, which is returned with HTTP 200 and must not be cached
+def is_error_payload(body):
+    return body.lstrip()[:9] == b'{"error":'
+
+# Raise the ArcGIS error in a response, if it is one, without parsing the whole body
+def raise_for_arcgis_error(response):
+    if is_error_payload(response.content):
+        read_json(response)
+
+# Send a query request, answering it from the on-disk cache when possible. Only layer queries are cached: other
+# requests, such as the layer metadata holding the lastEditDate, always go to the server.
+# An entry is used whenever the layer's editingInfo.lastEditDate is the one it was stored with, whatever its age,
+# and never once the layer has been edited. Entries of layers without a lastEditDate are used while younger than
+# the TTL, and after that only if the server answers 304 to the stored ETag.
+def cached_request(method, url, params=None, data=None, verify=True, cancel_event=None):
+    if not is_query_url(url):
+        return send(method, url, params=params, data=data, verify=verify, cancel_event=cancel_event)
+    key = response_cache.cache_key(method, url, params if params is not None else data)
+    entry = response_cache.lookup(key)
+    # Read before the query is sent, so a response is never stored with an edit date newer than its data
+    last_edit_date = layer_last_edit_date(url, verify, cancel_event)
+    headers = None
+    if entry is not None:
+        if last_edit_date is not None:
+            fresh = entry["last_edit_date"] == last_edit_date
+        else:
+            fresh = entry["age"] < response_cache.CACHE_TTL_SECONDS
+        if fresh:
+            if last_edit_date is not None:
+                response_cache.touch(key, revalidated=True)
+            response = read_cached(method, url, key)
+            if response is not None:
+                return response
+        elif entry["etag"]:
+            headers = {"If-None-Match": entry["etag"]}
+
+    response = send(method, url, params=params, data=data, verify=verify, cancel_event=cancel_event, headers=headers)
+    if response.status_code == 304 and entry is not None:
+        response_cache.touch(key, revalidated=True)
+        response = read_cached(method, url, key)
+        if response is not None:
+            return response
+        response = send(method, url, params=params, data=data, verify=verify, cancel_event=cancel_event)
+
+    if not is_error_payload(response.content):
+        try:
+            response_cache.store(key, url, response.content, response.headers.get("ETag"), last_edit_date)
+        except OSError as e:
+            logging.warning(f"Could not cache the response from {url}: {e}")
+    return response
+
+# Send a request, through the response cache unless use_cache is False or the cache is turned off
+def request(method, url, params=None, data=None, verify=True, cancel_event=None, use_cache=True):
+    if use_cache and response_cache.CACHE_ENABLED:
+        return cached_request(method, url, params=params, data=data, verify=verify, cancel_event=cancel_event)
+    return send(method, url, params=params, data=data, verify=verify, cancel_event=cancel_event)
+
+# Send a GET request and return the response
+def get(url, params=None, verify=True, cancel_event=None, use_cache=True):
+    return request("GET", url, params=params, verify=verify, cancel_event=cancel_event, use_cache=use_cache)
+
+# Send a POST request with form data and return the response
+def post(url, data=None, verify=True, cancel_event=None, use_cache=True):
+    return request("POST", url, data=data, verify=verify, cancel_event=cancel_event, use_cache=use_cache)
+
+# Parse an ArcGIS JSON response, raising an error for the error payloads ArcGIS returns with HTTP 200
+def read_json(response):
+    data = response.json()
+    if isinstance(data, dict) and "error" in data:
+        error = data["error"]
+        raise ArcGISError(
+            f"ArcGIS error {error.get('code')} from {response.url}: {error.get('message')}", response=response
+        )
+    return data
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+import time
+import geopandas as gpd
+import http_client
+from admin_lookup import load_lookup
+from layer_registry import LAYERS
+
+# Local copy of the statewide parcels and roads, one GeoParquet file per municipality (parcels) or county (roads).
+# A run with use_mirror reads its municipality's partition from disk instead of querying the servers, so it is
+# limited by disk speed and keeps working while the state servers are down. The layers mirrored, and the input
+# their partitions are keyed on, are set by the "mirror" entry of each layer in layer_registry.LAYERS.
+
+# Where the mirror is kept (override with the SWLAYER_MIRROR_DIR environment variable)
+MIRROR_DIR = os.environ.get(
+    "SWLAYER_MIRROR_DIR",
+    os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "SWLayerGenerator", "mirror"),
+)
+
+# Name of the file listing, per mirrored layer, when it was synced and how each partition was fetched
+MANIFEST_FILE = "manifest.json"
+
+# Spatial reference the partitions are stored in; runs in another CRS reproject the partition they read
+MIRROR_SR = 4326
+
+# Features per Parquet row group. Partitions are sorted along a Hilbert curve before writing, so each row group
+# covers a small area and reading a boundary's bounding box skips the row groups outside it.
+ROW_GROUP_SIZE = 5000
+
+# Serializes updates of the manifest
+_lock = threading.Lock()
+
+# Path of a layer's partition for a municipality code or county GNIS code
+def partition_path(name, code):
+    return os.path.join(MIRROR_DIR, name, f"{code}.parquet")
+
+# Read the manifest, or an empty one if nothing has been synced
+def read_manifest():
+    try:
+        with open(os.path.join(MIRROR_DIR, MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+# Write the manifest, replacing it in one step
+def write_manifest(manifest):
+    os.makedirs(MIRROR_DIR, exist_ok=True)
+    temporary_path = os.path.join(MIRROR_DIR, f"{MANIFEST_FILE}.tmp")
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(temporary_path, os.path.join(MIRROR_DIR, MANIFEST_FILE))
+
+# Read a layer's partition, or None if it has not been synced. With bounds (xmin, ymin, xmax, ymax in MIRROR_SR)
+# only the features intersecting them are read. A whole partition keeps the details of how it was fetched in
+# attrs["fetch"], so the next sync can refresh it with only the changes.
+def read_partition(name, code, bounds=None):
+    path = partition_path(name, code)
+    partition = read_manifest().get(name, {}).get("partitions", {}).get(str(code))
+    if partition is None or not os.path.exists(path):
+        return None
+    gdf = gpd.read_parquet(path, bbox=tuple(bounds) if bounds is not None else None)
+    fetch_info = partition.get("fetch")
+    if fetch_info is not None:
+        gdf = gdf.sort_values(fetch_info["id_field"], ignore_index=True)
+        if bounds is None:
+            gdf.attrs["fetch"] = fetch_info
+    return gdf
+
+# Write a layer's partition and record it in the manifest
+def write_partition(name, code, gdf):
+    path = partition_path(name, code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{threading.get_ident()}.tmp"
+    ordered = gdf.iloc[gdf.geometry.hilbert_distance().argsort()] if len(gdf) else gdf
+    try:
+        ordered.to_parquet(temporary_path, write_covering_bbox=True, row_group_size=ROW_GROUP_SIZE)
+    except ImportError:
+        raise ValueError("The local mirror requires pyarrow (pip install pyarrow)")
+    os.replace(temporary_path, path)
+    with _lock:
+        manifest = read_manifest()
+        layer = manifest.setdefault(name, {"partitions": {}})
+        layer["partitions"][str(code)] = {
+            "features": len(gdf),
+            "synced_at": time.time(),
+            "fetch": gdf.attrs.get("fetch"),
+        }
+        write_manifest(manifest)
+
+# Codes of the partitions of a mirrored layer: every municipality code, or every county GNIS code
+def partition_codes(name, lookup):
+    if LAYERS[name]["mirror"] == "municipality_code":
+        return sorted(lookup["municipalities"])
+    return sorted({county["gnis_code"] for county in lookup["counties"].values() if county["gnis_code"]})
+
+# Download a mirrored layer, partition by partition. Partitions synced before are refreshed with only the features
+# added, edited or deleted since, and the whole layer is skipped when the server reports no edit since the last
+# sync. An interrupted sync picks up where it stopped.
+# Every request bypasses the response cache: a sync must see the server as it is now, and pushing the whole state
+# through the cache would evict the entries of every project. The layer is only marked complete, with the
+# lastEditDate read when the sync started, once every partition has been fetched; if the layer is edited during
+# the sync, the next sync sees a newer date and runs again.
+def sync_layer(name, max_workers=None, progress=None, cancel_event=None):
+    from api_handler import MAX_CONCURRENT_REQUESTS, fetch_layer
+
+    layer = LAYERS[name]
+    if not layer.get("mirror"):
+        raise ValueError(f"The {name} layer is not mirrored")
+    lookup = load_lookup(cancel_event)
+    if lookup is None:
+        raise ValueError("The list of NJ counties and municipalities is needed to sync the mirror")
+    http_client.forget_last_edit_dates()
+    last_edit_date = http_client.layer_last_edit_date(f"{layer['url']}/query", cancel_event=cancel_event)
+    synced = read_manifest().get(name, {})
+    if last_edit_date is not None and synced.get("complete") and synced.get("last_edit_date") == last_edit_date:
+        logging.info(f"{layer['title']}: the mirror is up to date")
+        return
+
+    # Until every partition has been fetched again, the layer is not up to date whatever the server reports
+    with _lock:
+        manifest = read_manifest()
+        manifest.setdefault(name, {"partitions": {}}).update({"complete": False, "last_edit_date": None})
+        write_manifest(manifest)
+
+    codes = partition_codes(name, lookup)
+    for number, code in enumerate(codes, start=1):
+        http_client.check_cancelled(cancel_event)
+        logging.info(f"Syncing {layer['title'].lower()} for {layer['mirror']} {code} ({number} of {len(codes)})...")
+        gdf = fetch_layer(
+            name, {layer["mirror"]: code}, max_workers=max_workers or MAX_CONCURRENT_REQUESTS, progress=progress,
+            cancel_event=cancel_event, out_sr=MIRROR_SR, previous=read_partition(name, code), use_cache=False
+        )
+        if gdf is None:
+            gdf = gpd.GeoDataFrame(geometry=[], crs=f"EPSG:{MIRROR_SR}")
+        write_partition(name, code, gdf)
+
+    with _lock:
+        manifest = read_manifest()
+        manifest.setdefault(name, {"partitions": {}}).update(
+            {"complete": True, "last_edit_date": last_edit_date, "synced_at": time.time()}
+        )
+        write_manifest(manifest)
+    logging.info(f"{layer['title']}: mirror synced ({len(codes)} partitions)")
+
+# Sync the mirrored layers given by name (all of them by default)
+def sync_mirror(names=None, max_workers=None, progress=None, cancel_event=None):
+    for name in names or [name for name, layer in LAYERS.items() if layer.get("mirror")]:
+        sync_layer(name, max_workers, progress, cancel_event)
+
+# Read a layer for a project from the mirror in out_sr, or None if the layer is not mirrored or its partition has
+# not been synced. With boundary_gdf only the features within the boundary's bounding box are read.
+def read_mirror(name, inputs, boundary_gdf=None, out_sr=MIRROR_SR):
+    layer = LAYERS[name]
+    if not layer.get("mirror") or not inputs.get(layer["mirror"]):
+        return None
+    bounds = boundary_gdf.to_crs(f"EPSG:{MIRROR_SR}").total_bounds if boundary_gdf is not None else None
+    gdf = read_partition(name, inputs[layer["mirror"]], bounds)
+    if gdf is None:
+        return None
+    synced_at = read_manifest()[name]["partitions"][str(inputs[layer["mirror"]])]["synced_at"]
+    logging.info(
+        f"{layer['title']}: read {len(gdf):,} features from the local mirror (synced "
+        f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(synced_at))})"
+    )
+    if gdf.crs is None:
+        gdf = gdf.set_crs(f"EPSG:{MIRROR_SR}")
+    if out_sr != MIRROR_SR:
+        fetch_info = gdf.attrs.get("fetch")
+        gdf = gdf.to_crs(f"EPSG:{out_sr}")
+        if fetch_info is not None:
+            gdf.attrs["fetch"] = {**fetch_info, "out_sr": out_sr}
+    return gdf
@@ -0,0 +1,112 @@
+# Layers the application downloads, keyed by the name used for their run stage, journal entry and snapshot.
+# Every layer is fetched by api_handler.fetch_layer, so a new layer only needs an entry here to be requested in
+# the run's CRS, cached, retried, reported and (for context layers) saved by every run.
+#
+# title:          name shown in progress updates, the log and error messages
+# url:            ArcGIS REST layer (FeatureServer or MapServer) the features come from
+# where:          where clause, with {county_name}, {municipality_code}, {municipality_name} or {gnis_code} filled in
+#                 from the project's inputs
+# fields:         outFields of the query
+# spatial_filter: None, "boundary" (features intersecting the municipality boundary, when one is given) or
+#                 "envelope" (features intersecting the municipality boundary's bounding box)
+# chunked:        fetch the layer in parallel OBJECTID chunks that can be resumed and refreshed; other layers are
+#                 fetched with one query, paged or split when the server truncates it
+# generalize:     the server may simplify the layer when the run asks for generalized context layers
+# mirror:         input the layer's partitions in the local mirror are keyed on (see layer_mirror), or None if the
+#                 layer is not mirrored
+# output_name:    name of the saved layer, with {project_number} and the inputs above filled in. Layers with an
+#                 "envelope" filter are saved as they are; the others are saved (or clipped) by the pipeline.
+LAYERS = {
+    "county": {
+        "title": "County Boundary",
+        "url": "https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/1",
+        "where": "GNIS_NAME = 'County of {county_name}'",
+        "fields": "*",
+        "spatial_filter": None,
+        "chunked": False,
+        "generalize": False,
+        "mirror": None,
+        "output_name": "County_of_{county_name}_Boundary_{project_number}",
+    },
+    "municipality": {
+        "title": "Municipality Boundary",
+        "url": "https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/2",
+        "where": "MUN_CODE = '{municipality_code}'",
+        "fields": "*",
+        "spatial_filter": None,
+        "chunked": False,
+        "generalize": False,
+        "mirror": None,
+        "output_name": "{municipality_name}_Boundary_{project_number}",
+    },
+    "parcels": {
+        "title": "Parcels",
+        "url": "https://services2.arcgis.com/XVOqAjTOJ5P6ngMu/ArcGIS/rest/services/"
+               "Hosted_Parcels_Test_WebMer_20201016/FeatureServer/0",
+        "where": "PCL_MUN='{municipality_code}'",
+        "fields": "*",
+        "spatial_filter": None,
+        "chunked": True,
+        "generalize": False,
+        "mirror": "municipality_code",
+        "output_name": "Parcels_{project_number}",
+    },
+    "roads": {
+        "title": "Roads",
+        "url": "https://maps.nj.gov/arcgis/rest/services/Framework/Transportation/MapServer/14",
+        "where": "COUNTY_L='{gnis_code}'",
+        "fields": "*",
+        "spatial_filter": "boundary",
+        "chunked": True,
+        "generalize": False,
+        "mirror": "gnis_code",
+        "output_name": "Roads_{project_number}",
+    },
+    "wetlands": {
+        "title": "Wetlands",
+        "url": "https://mapsdep.nj.gov/arcgis/rest/services/Features/Land_lu/MapServer/2",
+        "where": "1=1",
+        "fields": "*",
+        "spatial_filter": "envelope",
+        "chunked": False,
+        "generalize": False,
+        "mirror": None,
+        "output_name": "Wetlands_{project_number}",
+    },
+    "neighboring": {
+        "title": "Neighboring Municipalities",
+        "url": "https://services2.arcgis.com/XVOqAjTOJ5P6ngMu/ArcGIS/rest/services/"
+               "NJ_Municipal_Boundaries_3424/FeatureServer/0",
+        "where": "1=1",
+        "fields": "*",
+        "spatial_filter": "envelope",
+        "chunked": False,
+        "generalize": True,
+        "mirror": None,
+        "output_name": "Neighboring_Municipalities_{project_number}",
+    },
+    "waterbodies": {
+        "title": "Waterbodies",
+        "url": "https://mapsdep.nj.gov/arcgis/rest/services/Features/Hydrography/MapServer/33",
+        "where": "1=1",
+        "fields": "*",
+        "spatial_filter": "envelope",
+        "chunked": False,
+        "generalize": False,
+        "mirror": None,
+        "output_name": "Waterbodies_{project_number}",
+    },
+}
+
+# Names of the layers fetched within the municipality boundary's bounding box and saved as they are
+def context_layers():
+    return [name for name, layer in LAYERS.items() if layer["spatial_filter"] == "envelope"]
+
+# Where clause of a layer for a project's inputs
+def where_clause(name, **inputs):
+    return LAYERS[name]["where"].format(**inputs)
+
+# Name a layer is saved under for a project; spaces in the inputs become underscores
+def output_name(name, project_number, **inputs):
+    values = {key: str(value).replace(" ", "_") for key, value in inputs.items()}
+    return LAYERS[name]["output_name"].format(project_number=project_number, **values)
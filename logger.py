@@ -1,15 +1,21 @@
 import datetime
+from layer_registry import LAYERS
 
 # Create an output text file in the output_folder that logs basic information such as the project number, output folder, time of completion, and API resources.
-def log_operations(output_folder, project_number):
+# With the run report, a short summary of each stage is added; the full details are in the JSON report.
+def log_operations(output_folder, project_number, report=None):
     with open(f"{output_folder}/SWAuto_Log_{project_number}.txt", "w") as log_file:
         log_file.write(f"Operations Log - Date and Time Completed: {datetime.datetime.now()}\n")
         log_file.write(f"Output Folder: {output_folder}\n")
         log_file.write(f"Project Number: {project_number}\n")
         log_file.write("\nData Sources:\n")
-        log_file.write(f"Municipality, Neighboring Municipalities: https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/2\n")
-        log_file.write(f"County: https://maps.nj.gov/arcgis/rest/services/Framework/Government_Boundaries/MapServer/1\n")
-        log_file.write(f"Roads: https://maps.nj.gov/arcgis/rest/services/Framework/Transportation/MapServer/14\n")
-        log_file.write(f"Parcels: https://services2.arcgis.com/XVOqAjTOJ5P6ngMu/ArcGIS/rest/services/Hosted_Parcels_Test_WebMer_20201016/FeatureServer/0\n")
-        log_file.write(f"Wetlands: https://mapsdep.nj.gov/arcgis/rest/services/Features/Land_lu/MapServer/2/query\n")
-        log_file.write(f"Waterbodies: https://mapsdep.nj.gov/arcgis/rest/services/Features/Hydrography/MapServer/33\n")
+        for layer in LAYERS.values():
+            log_file.write(f"{layer['title']}: {layer['url']}\n")
+        if report is not None:
+            log_file.write("\nStages (seconds, requests, MB received, features):\n")
+            for stage in report.to_dict()["stages"]:
+                log_file.write(
+                    f"{stage['name']}: {stage['seconds']} s, {stage['requests']} requests, "
+                    f"{stage['bytes_received'] / (1024 * 1024):.1f} MB, "
+                    f"{stage['features_saved'] if stage['features_saved'] is not None else stage['features_fetched']}\n"
+                )
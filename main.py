@@ -1,6 +1,11 @@
-from gui import launch_gui
+import sys
 
 def main():
+    # With arguments (for example --manifest projects.csv) run headless batches, otherwise open the GUI
+    if len(sys.argv) > 1:
+        from cli import main as run_cli
+        sys.exit(run_cli(sys.argv[1:]))
+    from gui import launch_gui
     launch_gui()
 
 if __name__ == "__main__":
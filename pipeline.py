@@ -0,0 +1,366 @@
+from geo_processor import reproject_layer, clip_layer
+from file_manager import save_layer, save_table
+from logger import log_operations
+import http_client
+from http_client import RunCancelled, check_cancelled
+from scheduler import run_tasks
+from run_report import RunReport, record_features_saved, timed
+from admin_lookup import load_lookup, validate_inputs
+from staging import StagingArea
+from stormwater_analysis import parcel_coverage, read_drainage_areas, road_summary
+from run_journal import RunJournal, fetch_staged, read_snapshot, write_snapshot
+from layer_registry import LAYERS, context_layers, output_name
+from api_handler import (
+    fetch_county_boundary,
+    fetch_layer,
+    fetch_parcels,
+    fetch_roads,
+    fetch_municipality_boundary
+)
+from pyproj import CRS
+import logging
+import os
+import requests
+import threading
+from concurrent.futures import Future
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# County-level layers fetched once and shared by every project in a batch that needs them.
+# If several projects ask for the same layer at once, the first one fetches it and the others wait for it.
+class SharedLayers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._layers = {}
+
+    # Return the layer stored under key, calling fetch to get it if no project has fetched it yet
+    def get(self, key, fetch):
+        while True:
+            with self._lock:
+                future = self._layers.get(key)
+                is_owner = future is None
+                if is_owner:
+                    future = Future()
+                    self._layers[key] = future
+            if is_owner:
+                try:
+                    layer = fetch()
+                except BaseException as e:
+                    # Failed fetches are not shared: the next project to ask tries again
+                    with self._lock:
+                        del self._layers[key]
+                    future.set_exception(e)
+                    raise
+                future.set_result(layer)
+                return layer
+            try:
+                return future.result()
+            except Exception:
+                continue
+
+# Call fetch directly, or through the shared layers of a batch when there are any
+def fetch_shared(shared_layers, key, fetch):
+    if shared_layers is None:
+        return fetch()
+    return shared_layers.get(key, fetch)
+
+# Error to report when a layer's server could not be reached, or None for any other error. Connection failures,
+# timeouts and HTTP errors left after the retries are not caused by the inputs; errors returned by the ArcGIS
+# service itself (http_client.ArcGISError) usually are, so they keep the input-validation message.
+def unreachable_error(e, layer_name):
+    if not isinstance(e, requests.RequestException) or isinstance(e, http_client.ArcGISError):
+        return None
+    url = e.request.url if e.request is not None and e.request.url else LAYERS[layer_name]["url"]
+    return ValueError(
+        f"Error: Could not reach the server at {url.split('?')[0]} ({e}). Please check the network connection "
+        f"and try again"
+    )
+
+# Write the JSON run report next to the run log. A report that cannot be written does not fail the run.
+def write_report(report, output_folder, project_number):
+    try:
+        report.write(os.path.join(output_folder, f"SWAuto_Report_{project_number}.json"))
+    except OSError as e:
+        logging.error(f"An error occurred while writing the run report: {e}")
+
+# Primary function to run the application, called from the GUI's worker thread or by the batch CLI. Validates the
+# inputs, fetches every layer in target_crs and runs the clipping and analysis stages (see the task list below),
+# writing the layers into a local staging folder that is moved into the output folder only when the whole run
+# succeeds. resume, refresh and use_mirror reuse earlier downloads (see run_journal and layer_mirror); a JSON run
+# report is written next to the run log either way. Setting cancel_event stops the run.
+def run_process(
+    output_folder, county_name, municipality_code, municipality_name, gnis_code, project_number,
+    progress=None, cancel_event=None, filter_roads_by_boundary=True, shared_layers=None, output_format="shapefile",
+    target_crs="EPSG:4326", generalize_context_layers=False, resume=False, refresh=False, profiler=None,
+    use_mirror=False, drainage_areas=None
+):
+    run = {
+        "output_folder": output_folder,
+        "county_name": county_name,
+        "municipality_code": municipality_code,
+        "municipality_name": municipality_name,
+        "gnis_code": gnis_code,
+        "project_number": project_number,
+        "filter_roads_by_boundary": filter_roads_by_boundary,
+        "output_format": output_format,
+        "target_crs": target_crs,
+        "generalize_context_layers": generalize_context_layers,
+        "refresh": refresh,
+        "use_mirror": use_mirror,
+        "drainage_areas": drainage_areas,
+    }
+
+    # Stops the remaining layer tasks if one of them fails
+    if cancel_event is None:
+        cancel_event = threading.Event()
+
+    profiler = profiler or os.environ.get("SWLAYER_PROFILE") or None
+    report = RunReport(run, profiler, os.path.join(output_folder, f"SWAuto_Profile_{project_number}"))
+    report_token = report.activate()
+    # Check every layer's lastEditDate again, so cached responses of layers edited since the last run are not used
+    http_client.forget_last_edit_dates()
+    staging = None
+    try:
+        county_name, municipality_name, gnis_code = validate_inputs(
+            county_name, municipality_code, municipality_name, gnis_code, load_lookup(cancel_event)
+        )
+        run.update(county_name=county_name, municipality_name=municipality_name, gnis_code=gnis_code)
+        drainage_areas_gdf = read_drainage_areas(drainage_areas) if drainage_areas else None
+        out_sr = CRS.from_user_input(target_crs).to_epsg()
+        if out_sr is None:
+            raise ValueError(f"Error: The output CRS {target_crs} has no EPSG code")
+        journal = RunJournal(output_folder, run, resume)
+        staging = StagingArea(output_folder)
+        inputs = {
+            "county_name": county_name,
+            "municipality_code": municipality_code,
+            "municipality_name": municipality_name,
+            "gnis_code": gnis_code,
+        }
+
+        # Save a finished layer into the staging folder; the layers are moved to the output folder once all of them
+        # are saved. Layers already arrive in target_crs; reprojecting only happens for a server that ignored outSR.
+        def save(gdf, layer_name):
+            check_cancelled(cancel_event)
+            with timed("save"):
+                gdf = reproject_layer(gdf, target_crs)
+                output_path = save_layer(
+                    gdf, staging.folder, layer_name, output_format,
+                    geopackage_name=f"Stormwater_Layers_{project_number}"
+                )
+            record_features_saved(len(gdf))
+            return output_path
+
+        # Fetch and process county boundary data
+        def county_task():
+            logging.info("Fetching county boundary data from ArcGIS REST service...")
+            try:
+                county_boundary_gdf = fetch_staged(journal, "county", lambda: fetch_shared(
+                    shared_layers, ("county", county_name, out_sr),
+                    lambda: fetch_county_boundary(
+                        county_name, progress=progress, cancel_event=cancel_event, out_sr=out_sr
+                    ),
+                ))
+                if county_boundary_gdf is None:
+                    raise ValueError("Error: Please ensure county name is correct")
+                logging.info("County boundary data fetched successfully")
+            except RunCancelled:
+                raise
+            except Exception as e:
+                raise unreachable_error(e, "county") or ValueError("Error: Please ensure county name is correct") from e
+
+            return save(county_boundary_gdf, output_name("county", project_number, **inputs))
+
+        # The unclipped layer kept by the last successful run, when refreshing
+        def previous_layer(name):
+            return read_snapshot(output_folder, name) if refresh else None
+
+        # Unclipped layers to keep for the next refresh, written with the other layers once every task has succeeded
+        snapshots = {}
+
+        # Fetch and process parcels data
+        def parcels_task():
+            logging.info("Fetching parcels data from ArcGIS REST service...")
+            try:
+                parcels_gdf = fetch_staged(journal, "parcels", lambda: fetch_parcels(
+                    municipality_code, progress=progress, cancel_event=cancel_event, out_sr=out_sr, journal=journal,
+                    previous=previous_layer("parcels"), use_mirror=use_mirror
+                ))
+                if parcels_gdf is None:
+                    raise ValueError("Error: Please ensure municipality code is correct")
+                logging.info("Parcels data fetched successfully")
+            except RunCancelled:
+                raise
+            except Exception as e:
+                raise unreachable_error(e, "parcels") or ValueError(
+                    "Error: Please ensure municipality code is correct"
+                ) from e
+            snapshots["parcels"] = parcels_gdf
+            return parcels_gdf
+
+        # Fetch and process roads data. With filter_roads_by_boundary only the roads crossing the municipality
+        # boundary are downloaded, otherwise every road in the county is.
+        def roads_task(municipality_boundary_gdf=None):
+            logging.info("Fetching roads data from ArcGIS REST service...")
+            try:
+                if municipality_boundary_gdf is not None:
+                    roads_gdf = fetch_staged(journal, "roads", lambda: fetch_roads(
+                        gnis_code, progress=progress, cancel_event=cancel_event, boundary_gdf=municipality_boundary_gdf,
+                        out_sr=out_sr, journal=journal, previous=previous_layer("roads"), use_mirror=use_mirror
+                    ))
+                else:
+                    roads_gdf = fetch_staged(journal, "roads", lambda: fetch_shared(
+                        shared_layers, ("roads", gnis_code, out_sr),
+                        lambda: fetch_roads(
+                            gnis_code, progress=progress, cancel_event=cancel_event, out_sr=out_sr, journal=journal,
+                            previous=previous_layer("roads"), use_mirror=use_mirror
+                        ),
+                    ))
+                if roads_gdf is None:
+                    raise ValueError("Error: Please ensure GNIS code is correct")
+                logging.info("Roads data fetched successfully")
+            except RunCancelled:
+                raise
+            except Exception as e:
+                raise unreachable_error(e, "roads") or ValueError("Error: Please ensure GNIS code is correct") from e
+            if municipality_boundary_gdf is not None or shared_layers is None:
+                snapshots["roads"] = roads_gdf
+            return roads_gdf
+
+        # Fetch and process municipality boundary data
+        def municipality_task():
+            logging.info("Fetching municipality boundary data from ArcGIS REST service...")
+            try:
+                municipality_boundary_gdf = fetch_staged(journal, "municipality", lambda: fetch_municipality_boundary(
+                    municipality_code, progress=progress, cancel_event=cancel_event, out_sr=out_sr
+                ))
+                if municipality_boundary_gdf is None:
+                    raise ValueError("Error: Please ensure municipality name and code are correct")
+                logging.info("Municipality boundary data fetched successfully")
+            except RunCancelled:
+                raise
+            except Exception as e:
+                raise unreachable_error(e, "municipality") or ValueError(
+                    "Error: Please ensure municipality name and code are correct"
+                ) from e
+
+            save(municipality_boundary_gdf, output_name("municipality", project_number, **inputs))
+            return municipality_boundary_gdf
+
+        # Build the task fetching and saving a context layer: the features of a layer in the registry (wetlands,
+        # neighboring municipalities, waterbodies...) within the municipality boundary's bounding box. The task
+        # returns the layer, for the analysis stages that use it.
+        def context_task(name):
+            title = LAYERS[name]["title"]
+
+            def task(municipality_boundary_gdf):
+                logging.info(f"Fetching {title.lower()} data from ArcGIS REST service...")
+                try:
+                    gdf = fetch_staged(journal, name, lambda: fetch_layer(
+                        name, inputs, municipality_boundary_gdf, progress=progress, cancel_event=cancel_event,
+                        out_sr=out_sr, generalize=generalize_context_layers
+                    ))
+                    if gdf is None:
+                        raise ValueError(f"Error: Failed to fetch {title.lower()} data")
+                    output_file = save(gdf, output_name(name, project_number, **inputs))
+                    logging.info(f"{title} data fetched and saved successfully: {output_file}")
+                except RunCancelled:
+                    raise
+                except Exception as e:
+                    raise unreachable_error(e, name) or ValueError(
+                        f"Error: Failed to fetch {title.lower()} data"
+                    ) from e
+                return gdf
+            return task
+
+        # Clip roads layer to municipality boundary
+        def clip_roads_task(roads_gdf, municipality_boundary_gdf):
+            check_cancelled(cancel_event)
+            logging.info("Clipping roads layer to municipality boundary...")
+            clipped_roads_gdf = clip_layer(roads_gdf, municipality_boundary_gdf)
+            save(clipped_roads_gdf, output_name("roads", project_number, **inputs))
+            logging.info("Roads layer clipped successfully")
+            return clipped_roads_gdf
+
+        # Summarize the length of the clipped roads per road class, parcel frontage and drainage area, and save the
+        # tables as CSV files into the staging folder with the layers
+        def road_summary_task(clipped_roads_gdf, clipped_parcels_gdf):
+            check_cancelled(cancel_event)
+            logging.info("Summarizing road centerline lengths...")
+            tables = road_summary(clipped_roads_gdf, clipped_parcels_gdf, drainage_areas_gdf)
+            table_names = {
+                "class": f"Road_Length_By_Class_{project_number}",
+                "frontage": f"Road_Frontage_{project_number}",
+                "drainage_area": f"Road_Length_By_Drainage_Area_{project_number}",
+            }
+            with timed("save"):
+                output_files = [save_table(table, staging.folder, table_names[name]) for name, table in tables.items()]
+            logging.info("Road summary saved successfully")
+            return output_files
+
+        # Clip parcels layer to municipality boundary; it is saved once the coverage columns are added
+        def clip_parcels_task(parcels_gdf, municipality_boundary_gdf):
+            check_cancelled(cancel_event)
+            logging.info("Clipping parcels layer to municipality boundary...")
+            clipped_parcels_gdf = clip_layer(parcels_gdf, municipality_boundary_gdf)
+            logging.info("Parcels layer clipped successfully")
+            return clipped_parcels_gdf
+
+        # Add the wetland and waterbody coverage of each clipped parcel and save the parcels layer
+        def parcel_coverage_task(clipped_parcels_gdf, wetlands_gdf, waterbodies_gdf):
+            check_cancelled(cancel_event)
+            logging.info("Measuring wetland and waterbody coverage of each parcel...")
+            parcels_file = save(
+                parcel_coverage(clipped_parcels_gdf, wetlands_gdf, waterbodies_gdf),
+                output_name("parcels", project_number, **inputs)
+            )
+            logging.info("Parcel coverage added successfully")
+            return parcels_file
+
+        # Run the layer tasks as their inputs become available. County, parcels and the municipality boundary
+        # start straight away; the context layers of the registry, roads and clips start once the boundary is ready,
+        # the parcel coverage once the parcels are clipped and the wetlands and waterbodies fetched, and the road
+        # summary once the roads and parcels are clipped.
+        tasks = {
+            "county": (county_task, []),
+            "parcels": (parcels_task, []),
+            "roads": (roads_task, ["municipality"] if filter_roads_by_boundary else []),
+            "municipality": (municipality_task, []),
+            **{name: (context_task(name), ["municipality"]) for name in context_layers()},
+            "clip_roads": (clip_roads_task, ["roads", "municipality"]),
+            "clip_parcels": (clip_parcels_task, ["parcels", "municipality"]),
+            "parcel_coverage": (parcel_coverage_task, ["clip_parcels", "wetlands", "waterbodies"]),
+            "road_summary": (road_summary_task, ["clip_roads", "clip_parcels"]),
+        }
+        run_tasks(
+            {name: (report.task(name, func), inputs) for name, (func, inputs) in tasks.items()},
+            max_workers=1 if profiler else None,
+            cancel_event=cancel_event,
+        )
+
+        # Move the layers into the output folder, then drop the journal: a run whose commit failed can be resumed
+        with report.stage("commit"):
+            for name, gdf in snapshots.items():
+                write_snapshot(staging.folder, name, gdf)
+            staging.commit()
+        journal.discard()
+        report.finish("completed")
+        log_operations(output_folder, project_number, report)
+        write_report(report, output_folder, project_number)
+        logging.info("Process completed successfully")
+
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+
+        # Nothing has been written to the output folder apart from the report below; the run journal is kept so the
+        # run can be resumed, and the staged layers are dropped in the finally block
+        report.finish("cancelled" if isinstance(e, RunCancelled) else "failed", e)
+        write_report(report, output_folder, project_number)
+
+        # Let the caller report the failure (or the cancellation) to the user
+        raise
+    finally:
+        if staging is not None:
+            staging.discard()
+        RunReport.deactivate(report_token)
@@ -0,0 +1,140 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+# Turn the response cache on or off for the whole application
+CACHE_ENABLED = True
+
+# Where cached responses are kept (override with the SWLAYER_CACHE_DIR environment variable)
+CACHE_DIR = os.environ.get(
+    "SWLAYER_CACHE_DIR",
+    os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "SWLayerGenerator", "cache"),
+)
+
+# Cached responses of layers that do not report a lastEditDate are used for this long without asking the server,
+# and revalidated with their ETag after that. Layers with a lastEditDate are revalidated against it on every use.
+CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Total size of the compressed responses kept on disk; the least recently used ones are removed beyond this
+MAX_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Serializes access to the cache index across fetch threads
+_lock = threading.Lock()
+
+# Open the cache index, creating the cache folder and table on first use
+def open_index():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(CACHE_DIR, "index.sqlite"))
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, url TEXT, stored_at REAL, last_used REAL, size INTEGER, "
+        "etag TEXT, last_edit_date INTEGER)"
+    )
+    return connection
+
+# Path of the compressed body of a cache entry
+def body_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.gz")
+
+# Build the cache key from the request method, service URL and its normalized query parameters.
+# Parameters in the URL and in params/data are merged, blank parameters are dropped and the rest are sorted,
+# so the same query always maps to the same entry however it was written.
+def cache_key(method, url, params=None):
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query)
+    query.extend((str(name), str(value)) for name, value in (params or {}).items())
+    query = sorted((name, value) for name, value in query if value != "")
+    service_url = urllib.parse.urlunsplit((parts.scheme, parts.netloc.lower(), parts.path.rstrip("/"), "", ""))
+    normalized = json.dumps([method.upper(), service_url, query])
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+# Look up a cache entry. Returns its details (including its age in seconds), or None if it is not cached.
+def lookup(key):
+    with _lock:
+        connection = open_index()
+        try:
+            row = connection.execute("SELECT * FROM responses WHERE key = ?", (key,)).fetchone()
+        finally:
+            connection.close()
+    if row is None or not os.path.exists(body_path(key)):
+        return None
+    entry = dict(row)
+    entry["age"] = time.time() - entry["stored_at"]
+    return entry
+
+# Read and decompress the body of a cached response, marking it as recently used. Raises OSError when the body has
+# been evicted since the entry was looked up.
+def read(key):
+    with open(body_path(key), "rb") as body_file:
+        body = gzip.decompress(body_file.read())
+    touch(key)
+    return body
+
+# Mark an entry as recently used; with revalidated=True its TTL also starts over
+def touch(key, revalidated=False):
+    now = time.time()
+    with _lock:
+        connection = open_index()
+        try:
+            if revalidated:
+                connection.execute("UPDATE responses SET last_used = ?, stored_at = ? WHERE key = ?", (now, now, key))
+            else:
+                connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            connection.commit()
+        finally:
+            connection.close()
+
+# Compress and store a response body with the validators used to revalidate it later
+def store(key, url, body, etag=None, last_edit_date=None):
+    compressed = gzip.compress(body, compresslevel=6)
+    temporary_path = f"{body_path(key)}.{threading.get_ident()}.tmp"
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(temporary_path, "wb") as body_file:
+        body_file.write(compressed)
+    os.replace(temporary_path, body_path(key))
+
+    now = time.time()
+    with _lock:
+        connection = open_index()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, now, now, len(compressed), etag, last_edit_date),
+            )
+            connection.commit()
+            evict(connection)
+        finally:
+            connection.close()
+
+# Remove the least recently used entries until the cache fits within MAX_CACHE_BYTES
+def evict(connection):
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= MAX_CACHE_BYTES:
+        return
+    for row in connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+        if total <= MAX_CACHE_BYTES:
+            break
+        try:
+            os.remove(body_path(row["key"]))
+        except FileNotFoundError:
+            pass
+        connection.execute("DELETE FROM responses WHERE key = ?", (row["key"],))
+        total -= row["size"]
+        logging.info(f"Removed least recently used cache entry {row['key']}")
+    connection.commit()
+
+# Remove every cached response
+def clear_cache():
+    with _lock:
+        if not os.path.exists(CACHE_DIR):
+            return
+        for filename in os.listdir(CACHE_DIR):
+            if filename.endswith(".gz") or filename.endswith(".tmp") or filename == "index.sqlite":
+                os.remove(os.path.join(CACHE_DIR, filename))
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+# Where the journals of unfinished runs are kept, one folder per output folder (override with the
+# SWLAYER_JOURNAL_DIR environment variable). They are on the local disk, so staging each downloaded chunk does not
+# write to the output folder, which is often a network share.
+JOURNAL_DIR = os.environ.get(
+    "SWLAYER_JOURNAL_DIR",
+    os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "SWLayerGenerator", "runs"),
+)
+
+# Name of the journal file in a run's journal folder
+JOURNAL_FILE = "journal.json"
+
+# Folder inside the output folder keeping the unclipped parcels and roads of the latest successful run, so a later
+# run can refresh them with only the changes since then
+SNAPSHOT_FOLDER = ".swlayer_snapshot"
+
+# Folder of the journal of the runs writing to an output folder
+def journal_folder(output_folder):
+    key = hashlib.sha256(os.path.normcase(os.path.abspath(output_folder)).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(JOURNAL_DIR, key)
+
+# Read the journal left for an output folder by a run that did not finish, or None if there is none
+def read_journal(output_folder):
+    path = os.path.join(journal_folder(output_folder), JOURNAL_FILE)
+    try:
+        with open(path) as journal_file:
+            return json.load(journal_file)
+    except (OSError, ValueError):
+        return None
+
+# Write a frame to path (without extension) as GeoParquet, or as GeoJSON when pyarrow is not installed, with its
+# fetch details (attrs["fetch"]) in a JSON file beside it. Unlike a pickle, reading these files cannot run code.
+# Each file is written under a temporary name and renamed, so an interrupted write never leaves a partial file.
+def write_frame(gdf, path):
+    try:
+        import pyarrow  # noqa: F401
+        extension = ".parquet"
+    except ImportError:
+        extension = ".geojson"
+    temporary_suffix = f".{threading.get_ident()}.tmp"
+    if extension == ".parquet":
+        gdf.to_parquet(path + extension + temporary_suffix)
+    else:
+        gdf.to_file(path + extension + temporary_suffix, driver="GeoJSON")
+    with open(path + ".json" + temporary_suffix, "w") as info_file:
+        json.dump({"format": extension, "fetch": gdf.attrs.get("fetch")}, info_file)
+    os.replace(path + extension + temporary_suffix, path + extension)
+    os.replace(path + ".json" + temporary_suffix, path + ".json")
+
+# Read a frame written by write_frame, or None if there is none or it cannot be read. geopandas is imported here
+# rather than with the module, so the GUI can read a journal without loading the geospatial stack.
+def read_frame(path):
+    import geopandas as gpd
+    try:
+        with open(path + ".json") as info_file:
+            info = json.load(info_file)
+        if info["format"] == ".parquet":
+            gdf = gpd.read_parquet(path + ".parquet")
+        else:
+            gdf = gpd.read_file(path + ".geojson")
+    except (OSError, ValueError, KeyError, ImportError) as e:
+        if os.path.exists(path + ".json"):
+            logging.warning(f"Could not read {path} ({e})")
+        return None
+    if info.get("fetch") is not None:
+        gdf.attrs["fetch"] = info["fetch"]
+    return gdf
+
+# Journal of a run: records the layers and OBJECTID chunks that have been downloaded, with their data staged
+# next to it, so a failed or cancelled run can be resumed without fetching them again. The journal is kept in
+# JOURNAL_DIR, keyed by the output folder, and removed once the run completes.
+class RunJournal:
+    def __init__(self, output_folder, run, resume=False):
+        self.folder = journal_folder(output_folder)
+        self._lock = threading.Lock()
+        state = read_journal(output_folder) if resume else None
+        if state is not None and state.get("run") == run:
+            logging.info(
+                f"Resuming the last run: {len(state['layers'])} layers and {len(state['chunks'])} chunks already done"
+            )
+        else:
+            if resume:
+                logging.info("No matching run to resume in this output folder, starting from the beginning")
+            shutil.rmtree(self.folder, ignore_errors=True)
+            state = {"run": run, "layers": [], "chunks": []}
+        self.state = state
+        os.makedirs(self.folder, exist_ok=True)
+        self.write()
+
+    # Write the journal file, replacing it in one step so an interrupted write never corrupts it
+    def write(self):
+        temporary_path = os.path.join(self.folder, f"{JOURNAL_FILE}.tmp")
+        with open(temporary_path, "w") as journal_file:
+            json.dump(self.state, journal_file)
+        os.replace(temporary_path, os.path.join(self.folder, JOURNAL_FILE))
+
+    # Path of the staged data for an entry, without its extension (see write_frame)
+    def data_path(self, entry):
+        return os.path.join(self.folder, entry.replace(" ", "_").replace(":", "_"))
+
+    # Stage a frame and record its entry in the journal
+    def stage(self, kind, entry, gdf):
+        write_frame(gdf, self.data_path(entry))
+        with self._lock:
+            self.state[kind].append(entry)
+            self.write()
+
+    # Load the staged frame of an entry, or None if it has not been done
+    def load(self, kind, entry):
+        with self._lock:
+            if entry not in self.state[kind]:
+                return None
+        gdf = read_frame(self.data_path(entry))
+        if gdf is None:
+            logging.warning(f"Could not read staged data for {entry}, fetching it again")
+        return gdf
+
+    # Staged frame of a completed layer, or None
+    def layer(self, name):
+        return self.load("layers", name)
+
+    # Stage a completed layer
+    def stage_layer(self, name, gdf):
+        self.stage("layers", name, gdf)
+
+    # Staged frame of a completed OBJECTID chunk of a layer, or None
+    def chunk(self, layer_name, from_id, to_id):
+        return self.load("chunks", f"{layer_name}:{from_id}-{to_id}")
+
+    # Stage a completed OBJECTID chunk of a layer
+    def stage_chunk(self, layer_name, from_id, to_id, gdf):
+        self.stage("chunks", f"{layer_name}:{from_id}-{to_id}", gdf)
+
+    # Remove the journal and its staged data once the run has completed
+    def discard(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+# Return the staged layer if the journal has it, otherwise fetch the layer and stage it
+def fetch_staged(journal, name, fetch):
+    if journal is None:
+        return fetch()
+    gdf = journal.layer(name)
+    if gdf is not None:
+        logging.info(f"Using the {name} layer downloaded by the last run")
+        return gdf
+    gdf = fetch()
+    if gdf is not None:
+        journal.stage_layer(name, gdf)
+    return gdf
+
+# Read a layer kept by write_snapshot, or None if there is none
+def read_snapshot(output_folder, name):
+    return read_frame(os.path.join(output_folder, SNAPSHOT_FOLDER, name))
+
+# Keep a fetched layer, with its fetch details, for refreshing it in a later run. Snapshots are written into the
+# staging folder, so they reach the output folder with the layers of a successful run.
+def write_snapshot(folder, name, gdf):
+    folder = os.path.join(folder, SNAPSHOT_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    write_frame(gdf, os.path.join(folder, name))
@@ -0,0 +1,230 @@
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import threading
+import time
+
+# Profilers that can be run around each stage of a run
+PROFILERS = ["cprofile", "pyinstrument"]
+
+# Report of the run and stage the current code is working for. Thread pools started by a run pass these on
+# through submit(), so requests made by download threads are counted in the stage that started them.
+_current_report = contextvars.ContextVar("current_report", default=None)
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+# Submit a function to an executor, running it in a copy of the caller's context
+def submit(executor, func, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+# Peak memory used by the process so far, in bytes, or None if it cannot be measured here. This is a high-water mark
+# over the whole process, so it is reported once per run rather than per stage (stages also run concurrently).
+# Uses the resource module where it exists (ru_maxrss is in KiB on Linux and in bytes on macOS), and on Windows
+# the peak working set reported by psutil, when it is installed.
+def peak_memory_bytes():
+    import sys
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return getattr(psutil.Process().memory_info(), "peak_wset", None)
+
+# Timings, transfer sizes and feature counts of a run, broken down by stage and by HTTP request, written as a
+# JSON report next to the run log. Server time (waiting for and downloading responses) is kept apart from local
+# processing time (decoding, clipping, saving) so a slow run can be traced to one or the other.
+class RunReport:
+    def __init__(self, run, profiler=None, profile_prefix="profile"):
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', expected one of: {', '.join(PROFILERS)}")
+        self.run = run
+        self.profiler = profiler
+        self.profile_prefix = profile_prefix
+        self.started = time.time()
+        self.finished = None
+        self.status = "running"
+        self.error = None
+        self.stages = {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    # Make this the report of the calling context; returns a token for deactivate()
+    def activate(self):
+        return _current_report.set(self)
+
+    # Restore the report that was current before activate()
+    @staticmethod
+    def deactivate(token):
+        _current_report.reset(token)
+
+    # Measure a stage of the run; requests, timings and counts recorded inside it are added to the stage
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = {
+            "name": name,
+            "started_seconds": round(time.time() - self.started, 3),
+            "seconds": None,
+            "status": "running",
+            "requests": 0,
+            "cache_hits": 0,
+            "retries": 0,
+            "bytes_received": 0,
+            "server_wait_seconds": 0.0,
+            "download_seconds": 0.0,
+            "features_fetched": None,
+            "features_saved": None,
+            "timings": {},
+        }
+        with self._lock:
+            self.stages[name] = stage
+        token = _current_stage.set(stage)
+        started = time.perf_counter()
+        try:
+            with self.profile(name):
+                yield stage
+            stage["status"] = "ok"
+        except Exception as e:
+            stage["status"] = type(e).__name__
+            raise
+        finally:
+            stage["seconds"] = round(time.perf_counter() - started, 3)
+            _current_stage.reset(token)
+
+    # Run the profiler chosen for this report around a stage and save its output as <profile_prefix>_<stage>.
+    # Profilers only see the thread they run on, so time spent in download threads shows up as waiting.
+    @contextlib.contextmanager
+    def profile(self, name):
+        if self.profiler is None:
+            yield
+            return
+        base_path = f"{self.profile_prefix}_{name}"
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(f"{base_path}.html", "w", encoding="utf-8") as profile_file:
+                    profile_file.write(profiler.output_html())
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(f"{base_path}.prof")
+
+    # Wrap a task function so it runs as a stage of this report
+    def task(self, name, func):
+        def run_stage(*args):
+            with self.stage(name):
+                return func(*args)
+        return run_stage
+
+    # Record a finished HTTP request against the current stage
+    def add_request(self, method, url, status, wait_seconds, download_seconds, size, retries, from_cache):
+        stage = _current_stage.get()
+        with self._lock:
+            self.requests.append({
+                "stage": stage["name"] if stage is not None else None,
+                "method": method,
+                "url": url,
+                "status": status,
+                "wait_seconds": round(wait_seconds, 3),
+                "download_seconds": round(download_seconds, 3),
+                "bytes": size,
+                "retries": retries,
+                "from_cache": from_cache,
+            })
+            if stage is not None:
+                stage["requests"] += 1
+                stage["cache_hits"] += int(from_cache)
+                stage["retries"] += retries
+                stage["bytes_received"] += 0 if from_cache else size
+                stage["server_wait_seconds"] += wait_seconds
+                stage["download_seconds"] += download_seconds
+
+    # Finish the report with the outcome of the run
+    def finish(self, status, error=None):
+        self.finished = time.time()
+        self.status = status
+        self.error = str(error) if error is not None else None
+
+    # The report as a dictionary ready to be written as JSON
+    def to_dict(self):
+        with self._lock:
+            stages = [
+                {
+                    **stage,
+                    "server_wait_seconds": round(stage["server_wait_seconds"], 3),
+                    "download_seconds": round(stage["download_seconds"], 3),
+                    "timings": {key: round(value, 3) for key, value in stage["timings"].items()},
+                }
+                for stage in self.stages.values()
+            ]
+            requests = list(self.requests)
+        peak = peak_memory_bytes()
+        return {
+            "run": self.run,
+            "status": self.status,
+            "error": self.error,
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "seconds": round((self.finished or time.time()) - self.started, 3),
+            "peak_memory_mb": round(peak / (1024 * 1024), 1) if peak is not None else None,
+            "totals": {
+                "requests": len(requests),
+                "cache_hits": sum(request["from_cache"] for request in requests),
+                "retries": sum(request["retries"] for request in requests),
+                "bytes_received": sum(request["bytes"] for request in requests if not request["from_cache"]),
+            },
+            "stages": stages,
+            "requests": requests,
+        }
+
+    # Write the report as JSON
+    def write(self, path):
+        with open(path, "w") as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
+        logging.info(f"Run report saved to {path}")
+
+# Record a finished HTTP request in the current run report, if there is one
+def record_request(method, url, status, wait_seconds, download_seconds, size, retries=0, from_cache=False):
+    report = _current_report.get()
+    if report is not None:
+        report.add_request(method, url, status, wait_seconds, download_seconds, size, retries, from_cache)
+
+# Record the number of features a stage has fetched so far
+def record_features_fetched(count):
+    stage = _current_stage.get()
+    if stage is not None:
+        stage["features_fetched"] = count
+
+# Record the number of features a stage saved
+def record_features_saved(count):
+    stage = _current_stage.get()
+    if stage is not None:
+        stage["features_saved"] = (stage["features_saved"] or 0) + count
+
+# Measure a step of local processing (for example decoding or clipping) and add it to the current stage's timings
+@contextlib.contextmanager
+def timed(step):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage = _current_stage.get()
+        report = _current_report.get()
+        if stage is not None and report is not None:
+            with report._lock:
+                stage["timings"][step] = stage["timings"].get(step, 0.0) + time.perf_counter() - started
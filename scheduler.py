@@ -0,0 +1,56 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from http_client import RunCancelled
+from run_report import submit
+
+# Run a set of dependent tasks in parallel.
+# tasks maps a task name to (function, input task names); each function is called with the results of its
+# inputs, in the order they are listed, as soon as all of them have finished. Independent tasks run at the
+# same time, up to max_workers, each in a copy of the caller's context. Returns a dictionary of task name -> result.
+# If a task fails, cancel_event is set so the other running tasks stop early, and the first error is raised.
+def run_tasks(tasks, max_workers=None, cancel_event=None):
+    for name, (func, inputs) in tasks.items():
+        for input_name in inputs:
+            if input_name not in tasks:
+                raise ValueError(f"Task '{name}' depends on unknown task '{input_name}'")
+
+    if cancel_event is None:
+        cancel_event = threading.Event()
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(tasks))) as executor:
+        while pending or running:
+            # Start every task whose inputs are all available
+            if error is None:
+                for name, (func, inputs) in list(pending.items()):
+                    if all(input_name in results for input_name in inputs):
+                        logging.info(f"Starting task: {name}")
+                        future = submit(executor, func, *[results[input_name] for input_name in inputs])
+                        running[future] = name
+                        del pending[name]
+
+            if not running:
+                if error is None:
+                    raise ValueError(f"Tasks with circular dependencies: {', '.join(pending)}")
+                break
+
+            # Wait for the next task to finish and record its result
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    logging.info(f"Finished task: {name}")
+                except Exception as e:
+                    # Keep the first real error; tasks stopped because of it raise RunCancelled
+                    if error is None or (isinstance(error, RunCancelled) and not isinstance(e, RunCancelled)):
+                        error = e
+                    cancel_event.set()
+
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,81 @@
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+# Where runs stage their layers before committing them (override with the SWLAYER_STAGING_DIR environment variable).
+# By default this is the system temporary folder, on the local disk, so layers are written and read at local disk
+# speed even when the output folder is on a network share.
+STAGING_DIR = os.environ.get("SWLAYER_STAGING_DIR") or None
+
+# Suffixes of the copies and backups made while committing; left-overs of an interrupted commit can be deleted
+INCOMING_SUFFIX = ".swlayer_incoming"
+BACKUP_SUFFIX = ".swlayer_backup"
+
+# Private folder a run writes its layers into. Nothing appears in the output folder until commit(), which moves
+# each layer (a shapefile's subfolder, a GeoPackage or a GeoParquet file) into place with one rename; a failed or
+# cancelled run only discards the staging folder, so it never touches anything else in the output folder.
+class StagingArea:
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.folder = tempfile.mkdtemp(prefix="swlayer_staging_", dir=STAGING_DIR)
+
+    # Move one staged layer into the output folder. Across disks it is first copied next to its destination, so
+    # the final step is always a rename; a layer already there is renamed aside and returned as its backup.
+    def commit_entry(self, name):
+        source = os.path.join(self.folder, name)
+        destination = os.path.join(self.output_folder, name)
+        if os.stat(self.folder).st_dev != os.stat(self.output_folder).st_dev:
+            incoming = f"{destination}{INCOMING_SUFFIX}"
+            if os.path.isdir(source):
+                shutil.copytree(source, incoming)
+            else:
+                shutil.copyfile(source, incoming)
+            source = incoming
+        backup = None
+        if os.path.lexists(destination):
+            backup = f"{destination}.{uuid.uuid4().hex[:8]}{BACKUP_SUFFIX}"
+            os.replace(destination, backup)
+        try:
+            os.replace(source, destination)
+        except OSError:
+            if backup is not None:
+                os.replace(backup, destination)
+            raise
+        return destination, backup
+
+    # Move every staged layer into the output folder. If any of them cannot be moved, the layers moved so far are
+    # taken out again and the ones they replaced are put back, so the output folder is left as it was.
+    def commit(self):
+        os.makedirs(self.output_folder, exist_ok=True)
+        committed = []
+        try:
+            for name in sorted(os.listdir(self.folder)):
+                committed.append(self.commit_entry(name))
+        except Exception:
+            for destination, backup in reversed(committed):
+                remove_path(destination)
+                if backup is not None:
+                    os.replace(backup, destination)
+            for name in os.listdir(self.output_folder):
+                if name.endswith(INCOMING_SUFFIX):
+                    remove_path(os.path.join(self.output_folder, name))
+            raise
+        for _, backup in committed:
+            if backup is not None:
+                remove_path(backup)
+        layers = [destination for destination, _ in committed if not os.path.basename(destination).startswith(".")]
+        logging.info(f"Saved {len(layers)} layers to {self.output_folder}")
+        return [destination for destination, _ in committed]
+
+    # Remove the staging folder and whatever is left in it
+    def discard(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+# Remove a file or a folder
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
@@ -0,0 +1,213 @@
+import logging
+import math
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import run_report
+from concurrent.futures import ThreadPoolExecutor
+from geo_processor import reproject_layer
+
+# Projected CRS areas and distances are measured in, whatever CRS the layers are saved in:
+# NAD83 / New Jersey State Plane, in US survey feet
+ANALYSIS_CRS = "EPSG:3424"
+
+# Parcels (and parcel pairs) are processed in batches of this many, on up to ANALYSIS_WORKERS threads. Shapely
+# releases the GIL while it works through an array of geometries, so the batches run in parallel.
+ANALYSIS_BATCH_SIZE = 10000
+ANALYSIS_WORKERS = min(4, os.cpu_count() or 1)
+
+# Dissolved wetlands and waterbodies with more vertices than this are cut along a grid of GRID_CELL_FEET squares,
+# so a large wetland complex is not intersected as a whole with every parcel it touches
+SUBDIVIDE_VERTICES = 256
+GRID_CELL_FEET = 1000
+
+# Columns added to the parcels layer, named to fit the 10 characters of a shapefile field:
+# wetland and waterbody area (square feet) and percent of the parcel, and distance to the nearest waterbody (feet)
+COVERAGE_COLUMNS = ["WETL_SQFT", "WETL_PCT", "WATR_SQFT", "WATR_PCT", "WATR_DIST"]
+
+# Road centerlines within this distance (feet) of a parcel count towards its frontage
+FRONTAGE_BUFFER_FEET = 50
+
+# Fields giving a road's class; the first one the roads layer has is used, otherwise every road is in one class
+ROAD_CLASS_FIELDS = ["ROAD_CLASS", "ROUTE_SUBTYPE", "ROUTE_SUBT", "FUNC_CLASS"]
+
+# Fields identifying a parcel in the frontage table; the first one the parcels layer has is used
+PARCEL_ID_FIELDS = ["PAMS_PIN", "OBJECTID"]
+
+FEET_PER_MILE = 5280
+
+# Geometries of a GeoDataFrame in ANALYSIS_CRS as a shapely array, with invalid geometries repaired
+def analysis_geometries(gdf):
+    geometries = np.asarray(reproject_layer(gdf, ANALYSIS_CRS).geometry.array, dtype=object)
+    invalid = ~shapely.is_valid(geometries) & ~shapely.is_missing(geometries)
+    if invalid.any():
+        geometries = geometries.copy()
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+    return geometries
+
+# Call func with matching batches of the given arrays, in parallel for large arrays, and join the arrays it returns
+def map_batches(func, *arrays):
+    if len(arrays[0]) <= ANALYSIS_BATCH_SIZE:
+        return func(*arrays)
+    batches = [slice(start, start + ANALYSIS_BATCH_SIZE) for start in range(0, len(arrays[0]), ANALYSIS_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as executor:
+        return np.concatenate(list(executor.map(lambda batch: func(*(array[batch] for array in arrays)), batches)))
+
+# Cut polygons along a grid, keeping the polygonal pieces
+def subdivide(polygons):
+    xmin, ymin, xmax, ymax = shapely.total_bounds(polygons)
+    columns = max(1, math.ceil((xmax - xmin) / GRID_CELL_FEET))
+    rows = max(1, math.ceil((ymax - ymin) / GRID_CELL_FEET))
+    x, y = np.meshgrid(xmin + np.arange(columns) * GRID_CELL_FEET, ymin + np.arange(rows) * GRID_CELL_FEET)
+    cells = shapely.box(x.ravel(), y.ravel(), x.ravel() + GRID_CELL_FEET, y.ravel() + GRID_CELL_FEET)
+    polygon_index, cell_index = shapely.STRtree(cells).query(polygons, predicate="intersects")
+    return polygonal_parts(shapely.intersection(polygons[polygon_index], cells[cell_index]))
+
+# Polygons making up an array of geometries, dropping points, lines and empty geometries
+def polygonal_parts(geometries):
+    parts = shapely.get_parts(geometries[~shapely.is_missing(geometries)])
+    return parts[(shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)]
+
+# Dissolve overlapping polygons into disjoint pieces of bounded size, so the areas of a parcel's intersections with
+# the pieces add up to the area it has in common with the whole layer
+def dissolve(geometries):
+    parts = polygonal_parts(np.array([shapely.union_all(polygonal_parts(geometries))], dtype=object))
+    large = shapely.get_num_coordinates(parts) > SUBDIVIDE_VERTICES
+    if large.any():
+        parts = np.concatenate([parts[~large], subdivide(parts[large])])
+    return parts
+
+# Area of each parcel covered by a dissolved layer. A spatial index finds every (parcel, piece) pair that
+# intersects in one query, and only those pairs are intersected.
+def covered_areas(parcels, pieces):
+    if len(pieces) == 0:
+        return np.zeros(len(parcels))
+    parcel_index, piece_index = shapely.STRtree(pieces).query(parcels, predicate="intersects")
+    areas = map_batches(
+        lambda left, right: shapely.area(shapely.intersection(left, right)), parcels[parcel_index], pieces[piece_index]
+    )
+    return np.bincount(parcel_index, weights=areas, minlength=len(parcels))
+
+# Distance from each parcel to the nearest piece of a dissolved layer (0 for parcels touching it), or NaN when the
+# layer is empty or the parcel has no geometry
+def nearest_distances(parcels, pieces):
+    if len(pieces) == 0:
+        return np.full(len(parcels), np.nan)
+    tree = shapely.STRtree(pieces)
+
+    def batch_distances(batch):
+        distances = np.full(len(batch), np.nan)
+        (index, _), nearest = tree.query_nearest(batch, return_distance=True, all_matches=False)
+        distances[index] = nearest
+        return distances
+    return map_batches(batch_distances, parcels)
+
+# Add the wetland and waterbody coverage of each parcel to the parcels layer (see COVERAGE_COLUMNS). Areas and
+# distances are measured in ANALYSIS_CRS; the parcels are returned in their own CRS.
+def parcel_coverage(parcels_gdf, wetlands_gdf, waterbodies_gdf):
+    with run_report.timed("analysis"):
+        parcels = analysis_geometries(parcels_gdf)
+        parcel_areas = np.nan_to_num(shapely.area(parcels))
+        wetlands = dissolve(analysis_geometries(wetlands_gdf))
+        waterbodies = dissolve(analysis_geometries(waterbodies_gdf))
+
+        def percent(areas):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(parcel_areas > 0, np.minimum(100 * areas / parcel_areas, 100), 0)
+
+        wetland_areas = covered_areas(parcels, wetlands)
+        waterbody_areas = covered_areas(parcels, waterbodies)
+        parcels_gdf = parcels_gdf.copy()
+        parcels_gdf["WETL_SQFT"] = wetland_areas.round(2)
+        parcels_gdf["WETL_PCT"] = percent(wetland_areas).round(2)
+        parcels_gdf["WATR_SQFT"] = waterbody_areas.round(2)
+        parcels_gdf["WATR_PCT"] = percent(waterbody_areas).round(2)
+        parcels_gdf["WATR_DIST"] = nearest_distances(parcels, waterbodies).round(2)
+    logging.info(
+        f"Parcel coverage: {int((wetland_areas > 0).sum())} of {len(parcels_gdf)} parcels contain wetlands, "
+        f"{int((waterbody_areas > 0).sum())} contain waterbodies"
+    )
+    return parcels_gdf
+
+# Class of each road, from the first of ROAD_CLASS_FIELDS the roads layer has
+def road_classes(roads_gdf):
+    field = next((field for field in ROAD_CLASS_FIELDS if field in roads_gdf.columns), None)
+    if field is None:
+        return np.full(len(roads_gdf), "All roads", dtype=object)
+    return roads_gdf[field].fillna("Unknown").astype(str).to_numpy()
+
+# Read a file of drainage area polygons (shapefile, GeoPackage, GeoJSON or any other format geopandas reads)
+def read_drainage_areas(path):
+    try:
+        drainage_areas_gdf = gpd.read_file(path)
+    except Exception as e:
+        raise ValueError(f"Error: Please ensure the drainage areas file is correct ({e})") from e
+    if drainage_areas_gdf.crs is None:
+        raise ValueError("Error: Please ensure the drainage areas file has a coordinate system (.prj file)")
+    return drainage_areas_gdf
+
+# Name of each drainage area: its NAME column, or else its first attribute, or else its position in the file
+def drainage_area_names(drainage_areas_gdf):
+    columns = [column for column in drainage_areas_gdf.columns if column != drainage_areas_gdf.geometry.name]
+    column = next((column for column in columns if column.upper() == "NAME"), columns[0] if columns else None)
+    if column is None:
+        return np.arange(1, len(drainage_areas_gdf) + 1).astype(str)
+    return drainage_areas_gdf[column].astype(str).to_numpy()
+
+# Length of road within each polygon, for every (polygon, road) pair that intersects. A spatial index over the
+# roads finds the pairs in one query, so no polygon is tested against roads far from it.
+def lengths_within(polygons, roads):
+    polygon_index, road_index = shapely.STRtree(roads).query(polygons, predicate="intersects")
+    lengths = map_batches(
+        lambda left, right: shapely.length(shapely.intersection(left, right)),
+        polygons[polygon_index], roads[road_index]
+    )
+    return polygon_index, road_index, lengths
+
+# Total length (feet and miles) and number of road pieces per group
+def length_table(lengths, **groups):
+    table = pd.DataFrame({**groups, "length_ft": lengths}).groupby(list(groups), sort=True).agg(
+        segments=("length_ft", "size"), length_ft=("length_ft", "sum")
+    ).reset_index()
+    table["length_mi"] = table["length_ft"] / FEET_PER_MILE
+    return table.round({"length_ft": 2, "length_mi": 3})
+
+# Summarize the road centerlines of a municipality for MS4 reporting, measured in ANALYSIS_CRS. Returns tables of
+# the length of road per road class (with a total), the length of road fronting each parcel (within
+# FRONTAGE_BUFFER_FEET of it) and, when drainage areas are given, the length of road per drainage area and class.
+def road_summary(roads_gdf, parcels_gdf, drainage_areas_gdf=None):
+    with run_report.timed("analysis"):
+        roads = analysis_geometries(roads_gdf)
+        classes = road_classes(roads_gdf)
+        lengths = np.nan_to_num(shapely.length(roads))
+        by_class = length_table(lengths, road_class=classes)
+        by_class = pd.concat([by_class, pd.DataFrame([{
+            "road_class": "Total",
+            "segments": len(roads),
+            "length_ft": round(float(lengths.sum()), 2),
+            "length_mi": round(float(lengths.sum()) / FEET_PER_MILE, 3),
+        }])], ignore_index=True)
+
+        parcels = analysis_geometries(parcels_gdf)
+        buffers = map_batches(lambda batch: shapely.buffer(batch, FRONTAGE_BUFFER_FEET, quad_segs=4), parcels)
+        parcel_index, _, frontage_lengths = lengths_within(buffers, roads)
+        id_field = next((field for field in PARCEL_ID_FIELDS if field in parcels_gdf.columns), None)
+        frontage = pd.DataFrame({
+            id_field or "parcel": parcels_gdf[id_field].to_numpy() if id_field else np.arange(1, len(parcels) + 1),
+            "frontage_ft": np.bincount(parcel_index, weights=frontage_lengths, minlength=len(parcels)).round(2),
+        })
+        tables = {"class": by_class, "frontage": frontage}
+
+        if drainage_areas_gdf is not None:
+            area_index, road_index, area_lengths = lengths_within(analysis_geometries(drainage_areas_gdf), roads)
+            tables["drainage_area"] = length_table(
+                area_lengths, drainage_area=drainage_area_names(drainage_areas_gdf)[area_index],
+                road_class=classes[road_index]
+            )
+    logging.info(
+        f"Road summary: {lengths.sum() / FEET_PER_MILE:,.2f} miles of road in {len(by_class) - 1} classes, "
+        f"{int((frontage['frontage_ft'] > 0).sum())} of {len(frontage)} parcels front a road"
+    )
+    return tables
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+# The tests import the application modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admin_lookup
+import http_client
+
+# Stand-in for a boundary service answering GET (metadata) and POST (query) requests with JSON, without HTTP
+class FakeService:
+    def __init__(self, records, supports_pagination=True, honours_offset=True, max_record_count=2):
+        self.records = records
+        self.supports_pagination = supports_pagination
+        self.honours_offset = honours_offset
+        self.max_record_count = max_record_count
+        self.queries = 0
+
+    def get(self, url, params=None, **kwargs):
+        return {
+            "objectIdField": "OBJECTID",
+            "maxRecordCount": self.max_record_count,
+            "advancedQueryCapabilities": {"supportsPagination": self.supports_pagination},
+        }
+
+    def post(self, url, data=None, **kwargs):
+        self.queries += 1
+        if self.queries > 50:
+            raise AssertionError("The service was queried too many times")
+        if data.get("returnIdsOnly") == "true":
+            return {"objectIds": [record["OBJECTID"] for record in self.records]}
+        if data.get("objectIds"):
+            wanted = {int(object_id) for object_id in data["objectIds"].split(",")}
+            return {"features": [{"attributes": record} for record in self.records if record["OBJECTID"] in wanted]}
+        offset = data.get("resultOffset", 0) if self.honours_offset else 0
+        page = self.records[offset:offset + self.max_record_count]
+        return {
+            "features": [{"attributes": record} for record in page],
+            "exceededTransferLimit": offset + self.max_record_count < len(self.records),
+        }
+
+    def patch(self):
+        return mock.patch.multiple(http_client, get=self.get, post=self.post, read_json=lambda response: response)
+
+RECORDS = [{"OBJECTID": object_id, "NAME": f"Place {object_id}"} for object_id in range(1, 6)]
+
+class FetchAttributesTest(unittest.TestCase):
+    def fetch(self, service):
+        with service.patch():
+            return sorted(record["OBJECTID"] for record in admin_lookup.fetch_attributes("https://example", "*"))
+
+    def test_pages_through_a_layer(self):
+        self.assertEqual(self.fetch(FakeService(RECORDS)), [1, 2, 3, 4, 5])
+
+    # A service that ignores resultOffset keeps sending the first page; paging must stop instead of looping
+    def test_stops_when_a_page_adds_nothing(self):
+        self.assertEqual(self.fetch(FakeService(RECORDS, honours_offset=False)), [1, 2])
+
+    def test_reads_by_object_id_without_pagination(self):
+        self.assertEqual(self.fetch(FakeService(RECORDS, supports_pagination=False)), [1, 2, 3, 4, 5])
+
+LOOKUP = {
+    "counties": {"atlantic": {"name": "Atlantic", "gnis_code": "882270"}},
+    "municipalities": {
+        "0102": {"name": "Atlantic City", "names": ["atlantic city"], "county": "atlantic"},
+    },
+}
+
+# Inputs differing from the lookup only in case, spacing or leading zeros are accepted
+class ValidateInputsTest(unittest.TestCase):
+    def test_normalises_names_and_codes(self):
+        self.assertEqual(
+            admin_lookup.validate_inputs(" ATLANTIC ", "0102", "Atlantic  CITY", " 0882270 ", LOOKUP),
+            ("Atlantic", "Atlantic  CITY", "882270"),
+        )
+
+    def test_rejects_a_wrong_gnis_code(self):
+        with self.assertRaises(ValueError):
+            admin_lookup.validate_inputs("Atlantic", "0102", "", "882271", LOOKUP)
+
+if __name__ == "__main__":
+    unittest.main()
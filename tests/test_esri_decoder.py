@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+# The tests import the application modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esri_decoder import esri_json_to_frame
+
+# Clockwise unit square, an outer ring in Esri JSON
+SQUARE = [[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]]
+
+# Responses the servers send for valid layers: features without geometry and rings or paths without vertices
+# must decode to None or be skipped rather than fail the whole chunk
+class EsriDecoderTest(unittest.TestCase):
+    def test_polygons_with_missing_and_empty_parts(self):
+        gdf = esri_json_to_frame({
+            "geometryType": "esriGeometryPolygon",
+            "spatialReference": {"wkid": 3424},
+            "features": [
+                {"attributes": {"ID": 1}, "geometry": {"rings": [SQUARE, []]}},
+                {"attributes": {"ID": 2}, "geometry": None},
+                {"attributes": {"ID": 3}, "geometry": {"rings": []}},
+                {"attributes": {"ID": 4}, "geometry": {"rings": [SQUARE]}},
+            ],
+        })
+        self.assertEqual(gdf.crs.to_epsg(), 3424)
+        self.assertEqual(list(gdf["ID"]), [1, 2, 3, 4])
+        self.assertEqual(list(gdf.geometry.isna()), [False, True, True, False])
+        self.assertEqual(gdf.geometry.iloc[0].area, 1)
+
+    def test_lines_with_missing_and_empty_parts(self):
+        gdf = esri_json_to_frame({
+            "geometryType": "esriGeometryPolyline",
+            "features": [
+                {"attributes": {"ID": 1}, "geometry": {"paths": [[], [[0, 0], [3, 4]], [[5, 5]]]}},
+                {"attributes": {"ID": 2}},
+            ],
+        })
+        self.assertEqual(gdf.geometry.iloc[0].geom_type, "MultiLineString")
+        self.assertEqual(gdf.geometry.iloc[0].length, 5)
+        self.assertIsNone(gdf.geometry.iloc[1])
+
+    def test_quantized_rings_after_an_empty_ring(self):
+        gdf = esri_json_to_frame({
+            "geometryType": "esriGeometryPolygon",
+            "transform": {"originPosition": "upperLeft", "scale": [1, 1], "translate": [100, 200]},
+            "features": [
+                {"attributes": {"ID": 1}, "geometry": {"rings": [[], [[0, 0], [0, -1], [1, 0], [0, 1], [-1, 0]]]}},
+            ],
+        })
+        self.assertEqual(gdf.geometry.iloc[0].bounds, (100, 200, 101, 201))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import geopandas as gpd
+
+# The tests import the application modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client
+import pipeline
+import response_cache
+import run_journal
+from benchmarks.mock_arcgis import MUNICIPALITY_CODE, MockArcGISServer
+
+# A layer edited on the server between two runs of the same process must be refreshed from the server's current
+# state, even though the first run left its responses in the response cache
+class RefreshAfterServerEditTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_settings = response_cache.CACHE_ENABLED, response_cache.CACHE_DIR
+        self.journal_dir = run_journal.JOURNAL_DIR
+        run_journal.JOURNAL_DIR = tempfile.mkdtemp(prefix="swlayer_test_runs_")
+        self.original_session = http_client.session
+        response_cache.CACHE_ENABLED = True
+        response_cache.CACHE_DIR = tempfile.mkdtemp(prefix="swlayer_test_cache_")
+        self.output_folder = tempfile.mkdtemp(prefix="swlayer_test_output_")
+        self.server = MockArcGISServer()
+        self.server.start()
+        http_client.session = self.server.create_session()
+
+    def tearDown(self):
+        self.server.stop()
+        http_client.session = self.original_session
+        shutil.rmtree(response_cache.CACHE_DIR, ignore_errors=True)
+        shutil.rmtree(self.output_folder, ignore_errors=True)
+        shutil.rmtree(run_journal.JOURNAL_DIR, ignore_errors=True)
+        run_journal.JOURNAL_DIR = self.journal_dir
+        response_cache.CACHE_ENABLED, response_cache.CACHE_DIR = self.cache_settings
+
+    def run_project(self, refresh=False):
+        pipeline.run_process(
+            self.output_folder, "", MUNICIPALITY_CODE, "", "", "TEST", output_format="geoparquet", refresh=refresh
+        )
+        return gpd.read_parquet(os.path.join(self.output_folder, "Parcels_TEST.parquet"))
+
+    # Run the project, edit the parcels on the server, refresh the project and check it matches the server
+    def check_refresh_after_edit(self, first_refresh):
+        before = self.run_project(refresh=first_refresh)
+        self.assertIsNotNone(run_journal.read_snapshot(self.output_folder, "parcels"))
+        self.server.edit_layer("parcels", scale=2)
+        with self.assertLogs(level="INFO") as logs:
+            after = self.run_project(refresh=True)
+        self.assertTrue(any("since the last run" in line for line in logs.output))
+
+        # What the server holds now, fetched without the cache
+        response_cache.CACHE_ENABLED = False
+        expected = pipeline.fetch_parcels(MUNICIPALITY_CODE)
+
+        self.assertNotEqual(len(before), len(expected))
+        self.assertEqual(sorted(after["PAMS_PIN"]), sorted(expected["PAMS_PIN"]))
+        self.assertEqual(
+            after.set_index("PAMS_PIN")["LAND_VAL"].to_dict(), expected.set_index("PAMS_PIN")["LAND_VAL"].to_dict()
+        )
+
+    def test_refresh_sees_server_edit(self):
+        self.check_refresh_after_edit(first_refresh=True)
+
+    # A project built by a normal run is refreshed from the snapshot that run kept, not downloaded in full
+    def test_refresh_after_normal_run(self):
+        self.check_refresh_after_edit(first_refresh=False)
+
+if __name__ == "__main__":
+    unittest.main()
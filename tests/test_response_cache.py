@@ -0,0 +1,55 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# The tests import the application modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client
+import response_cache
+from benchmarks.mock_arcgis import MockArcGISServer
+from layer_registry import LAYERS
+
+# A cached response evicted by another thread or process between its lookup and its read is requested again
+# instead of failing the request
+class EvictedEntryTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_settings = response_cache.CACHE_ENABLED, response_cache.CACHE_DIR
+        self.original_session = http_client.session
+        response_cache.CACHE_ENABLED = True
+        response_cache.CACHE_DIR = tempfile.mkdtemp(prefix="swlayer_test_cache_")
+        self.server = MockArcGISServer()
+        self.server.start()
+        http_client.session = self.server.create_session()
+        http_client.forget_last_edit_dates()
+
+    def tearDown(self):
+        self.server.stop()
+        http_client.session = self.original_session
+        shutil.rmtree(response_cache.CACHE_DIR, ignore_errors=True)
+        response_cache.CACHE_ENABLED, response_cache.CACHE_DIR = self.cache_settings
+
+    def test_evicted_body_is_a_cache_miss(self):
+        url = f"{LAYERS['county']['url']}/query"
+        params = {"where": "1=1", "outFields": "*", "returnGeometry": "false", "f": "json"}
+        expected = http_client.read_json(http_client.get(url, params=params))
+
+        # Remove the body after the lookup, as an eviction racing with this request would
+        lookup = response_cache.lookup
+
+        def lookup_then_evict(key):
+            entry = lookup(key)
+            os.remove(response_cache.body_path(key))
+            return entry
+
+        response_cache.lookup = lookup_then_evict
+        try:
+            response = http_client.get(url, params=params)
+        finally:
+            response_cache.lookup = lookup
+        self.assertEqual(http_client.read_json(response), expected)
+
+if __name__ == "__main__":
+    unittest.main()